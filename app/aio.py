@@ -0,0 +1,222 @@
+"""
+Contains the asyncio API, for services that run the extraction inside their event loop.
+Requests go through the async HTTP provider of web3, so a scan never blocks the loop.
+The block range of a scan is split into windows up front, a few windows are fetched
+at once and their decoded events are yielded in block order, nothing is written to disk.
+Windows the provider rejects as too large are split in halves,
+transient errors are retried with the backoff of a RequestScheduler.
+Many contracts are scanned concurrently by sharing one semaphore,
+which bounds the eth_getLogs calls in flight across all of them
+"""
+
+import asyncio
+from collections import deque
+from app.config import TRANSFER_TOPIC
+from app.ethereum import decode_window
+from app.parallel import split_range
+from app.ranges import is_overflow_error
+from app.scheduler import RequestScheduler, RetriesExhausted, is_retryable, RETRY_STATUS
+from app.metrics import METRICS
+
+# eth_getLogs calls in flight at once in a scan of many contracts
+CONCURRENCY = 8
+
+
+async def instantiate_async_web3(url, session=None):
+    """
+    Async Web3 instance initializer
+    :param url: url of the node
+    :type url: str
+    :param session: aiohttp session the requests are sent with, owned by the caller.
+        web3 keeps one session per url and thread otherwise, that is never closed
+    :type session: aiohttp.ClientSession
+    :return: Web3 instance with the async eth module
+    :type: Web3
+    """
+    from web3 import Web3, AsyncHTTPProvider
+    from web3.eth import AsyncEth
+
+    provider = AsyncHTTPProvider(url)
+    if session is not None:
+        await provider.cache_async_session(session)
+    return Web3(provider, modules={'eth': (AsyncEth,)}, middlewares=[])
+
+
+def is_retryable_error(error):
+    """
+    Checks if an async request can succeed when it is sent again
+    :param error: exception raised by the async provider
+    :type error: Exception
+    :return: whether to retry the request
+    :type: bool
+    """
+    import aiohttp
+
+    if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRY_STATUS
+    # JSON-RPC errors are raised as a ValueError of the error
+    if isinstance(error, ValueError) and error.args and isinstance(error.args[0], dict):
+        return is_retryable(error.args[0])
+    return False
+
+
+def transfer_filter(address, from_block, to_block, topics=None):
+    """
+    eth_getLogs filter params of the Transfer events of a contract
+    :param topics: The topics to filter by, all Transfer events by default.
+    :type topics: list
+    :rtype: dict
+    """
+    return {
+        'address': address,
+        'fromBlock': from_block,
+        'toBlock': to_block,
+        'topics': topics if topics else [TRANSFER_TOPIC],
+    }
+
+
+async def get_logs(web3, params, limit=None, scheduler=None):
+    """
+    Sends eth_getLogs until it succeeds, fails for good or runs out of retries
+    :param web3: Async Web3 instance
+    :type web3: Web3
+    :param params: Filter params
+    :type params: dict
+    :param limit: Bounds the calls in flight, shared by the scans of many contracts
+    :type limit: asyncio.Semaphore
+    :param scheduler: Retries and backoff of the request, retries without rate limit by default
+    :type scheduler: app.scheduler.RequestScheduler
+    :return: The logs.
+    :rtype: list(dict)
+    """
+    scheduler = scheduler if scheduler else RequestScheduler()
+    attempt = 0
+    while True:
+        try:
+            if limit is not None:
+                async with limit:
+                    return await send_get_logs(web3, params)
+            return await send_get_logs(web3, params)
+        except Exception as error:
+            if not is_retryable_error(error):
+                raise
+
+            if attempt >= scheduler.retries:
+                METRICS.count('rpc_failures')
+                raise RetriesExhausted('eth_getLogs', error, scheduler.retries)
+
+            delay = scheduler.delay(attempt)
+            print("eth_getLogs failed, retrying in {:.2f}s: {}".format(delay, error))
+            scheduler.retried += 1
+            METRICS.count('rpc_retries')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+async def send_get_logs(web3, params):
+    METRICS.count('rpc_calls', method='eth_getLogs')
+    with METRICS.timer('rpc_seconds', method='eth_getLogs'):
+        return await web3.eth.get_logs(params)
+
+
+async def fetch_range(web3, address, from_block, to_block, erc721=False, limit=None, scheduler=None, topics=None):
+    """
+    Fetch all events in the block range,
+    splitting it in halves while the provider rejects it as too large.
+    Takes the same parameters as app.ethereum.fetch_range
+
+    :return: The events, in block order.
+    :rtype: list(dict)
+    """
+    try:
+        logs = await get_logs(web3, transfer_filter(address, from_block, to_block, topics), limit, scheduler)
+    except ValueError as error:
+        if from_block >= to_block or not is_overflow_error(error):
+            raise
+
+        METRICS.count('window_splits')
+        middle = (from_block + to_block) // 2
+        return (
+            await fetch_range(web3, address, from_block, middle, erc721, limit, scheduler, topics) +
+            await fetch_range(web3, address, middle + 1, to_block, erc721, limit, scheduler, topics)
+        )
+
+    return decode_window(logs, erc721)
+
+
+async def fetch_windows(
+    web3,
+    address,
+    from_block,
+    to_block,
+    block_range=1000,
+    erc721=False,
+    workers=1,
+    limit=None,
+    scheduler=None,
+    topics=None
+):
+    """
+    Fetch the windows of a block range, workers windows at once,
+    like app.parallel.fetch_ranges with tasks instead of threads.
+    At most workers * 2 windows are in flight or waiting to be consumed
+
+    :return: (from_block, to_block) and the events of every window, in block order.
+    :rtype: async generator(tuple)
+    """
+    pending = deque()
+    try:
+        for window_from, window_to in split_range(from_block, to_block, block_range):
+            pending.append(((window_from, window_to), asyncio.ensure_future(fetch_range(
+                web3, address, window_from, window_to, erc721, limit, scheduler, topics))))
+            if len(pending) >= max(workers, 1) * 2:
+                window, task = pending.popleft()
+                yield window, await task
+
+        while pending:
+            window, task = pending.popleft()
+            yield window, await task
+    finally:
+        # the consumer stopped early or a window failed
+        for _, task in pending:
+            task.cancel()
+
+
+async def scan_contracts(contracts, from_block=0, to_block=None, block_range=1000, concurrency=CONCURRENCY):
+    """
+    Computes the holders of many contracts concurrently,
+    with at most concurrency eth_getLogs calls in flight across all of them
+    :param contracts: Async contracts, sharing one node
+    :type contracts: list(app.classes.async_contract.AsyncContract)
+    :param from_block: First block of the scan
+    :type from_block: int
+    :param to_block: Last block of the scan, the latest block by default
+    :type to_block: int
+    :param block_range: Number of blocks in one window
+    :type block_range: int
+    :param concurrency: eth_getLogs calls in flight at once
+    :type concurrency: int
+    :return: holders of every contract, by contract address
+    :type: dict
+    """
+    if not contracts:
+        return {}
+
+    if to_block is None:
+        # every contract is scanned up to the same block
+        to_block = await contracts[0].web3.eth.block_number
+
+    limit = asyncio.Semaphore(concurrency)
+    holders = await asyncio.gather(*[
+        contract.get_holders(
+            from_block=from_block,
+            to_block=to_block,
+            block_range=block_range,
+            workers=concurrency,
+            limit=limit
+        )
+        for contract in contracts
+    ])
+    return {contract.address: contract_holders for contract, contract_holders in zip(contracts, holders)}
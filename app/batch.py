@@ -0,0 +1,157 @@
+"""
+Contains the JSON-RPC batch transport,
+used to send many eth_getLogs windows in one HTTP request
+"""
+
+import json
+from requests.exceptions import HTTPError
+from web3 import HTTPProvider
+from web3._utils.request import make_post_request
+from app.scheduler import RETRY_STATUS
+
+
+def format_log(log):
+    """
+    Formats a raw log for decoding: numbers to int and topics to bytes.
+    Lighter than the web3 log formatter, which also checksums the address of every log
+    :param log: log returned by eth_getLogs
+    :type log: dict
+    :return: formatted log
+    :type: dict
+    """
+    formatted = dict(log)
+    for key in ('blockNumber', 'logIndex', 'transactionIndex'):
+        if isinstance(log.get(key), str):
+            formatted[key] = int(log[key], 16)
+    formatted['topics'] = [bytes.fromhex(topic[2:]) for topic in log['topics']]
+    return formatted
+
+
+RESULT_FORMATTERS = {
+    'eth_getLogs': lambda logs: [format_log(log) for log in logs],
+}
+
+
+class BatchHTTPProvider(HTTPProvider):
+
+    """
+    HTTP provider that can send many JSON-RPC calls in one batch payload.
+    Single calls behave exactly like HTTPProvider.
+    If the node rejects a batch, all later batches are sent as single calls
+    """
+    def __init__(self, endpoint_uri=None, request_kwargs=None, session=None):
+        super().__init__(endpoint_uri, request_kwargs, session)
+        self.supports_batch = True
+
+    def make_batch_request(self, calls):
+        """
+        Sends the calls in one batch payload
+        :param calls: (method, params) of every call
+        :type calls: list(tuple)
+        :return: JSON-RPC response of every call, in the order of the calls
+        :type: list(dict)
+        """
+        if self.supports_batch:
+            responses = self.send_batch(calls)
+            if responses is not None:
+                return responses
+
+            print("Node rejected the batch request, falling back to single calls")
+            self.supports_batch = False
+
+        return [self.make_request(method, params) for method, params in calls]
+
+    def send_batch(self, calls):
+        """
+        Posts the batch payload
+        :return: responses matched to the calls by id, None if the node does not support batches
+        :type: list(dict)
+        """
+        payload = [
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": next(self.request_counter)}
+            for method, params in calls
+        ]
+
+        try:
+            raw_response = make_post_request(
+                self.endpoint_uri,
+                json.dumps(payload).encode(),
+                **self.get_request_kwargs()
+            )
+        except HTTPError as error:
+            # rate limits and server errors are retried by the scheduler, not taken as a rejected batch
+            if error.response is not None and error.response.status_code in RETRY_STATUS:
+                raise
+            return None
+
+        responses = self.decode_rpc_response(raw_response)
+        if not isinstance(responses, list):
+            return None
+
+        # the node may answer the calls in any order
+        responses = {response.get('id'): response for response in responses}
+        if any(request['id'] not in responses for request in payload):
+            return None
+
+        return [responses[request['id']] for request in payload]
+
+
+def to_rpc_filter(filter_params):
+    """
+    Encodes the block numbers of eth_getLogs filter params as hex
+    :param filter_params: filter params
+    :type filter_params: dict
+    :return: filter params ready to be sent to the node
+    :type: dict
+    """
+    rpc_filter = dict(filter_params)
+    for key in ('fromBlock', 'toBlock'):
+        if isinstance(rpc_filter.get(key), int):
+            rpc_filter[key] = hex(rpc_filter[key])
+    return rpc_filter
+
+
+def batch_request(web3, calls):
+    """
+    Sends the calls in one batch if the provider supports it,
+    one by one otherwise
+    :param web3: Web3 instance
+    :type web3: Web3
+    :param calls: (method, params) of every call
+    :type calls: list(tuple)
+    :return: formatted result of every call, or the ValueError returned for it
+    :type: list
+    """
+    provider = web3.provider
+
+    if hasattr(provider, 'make_batch_request'):
+        responses = provider.make_batch_request(calls)
+    else:
+        responses = [provider.make_request(method, params) for method, params in calls]
+
+    results = []
+    for (method, params), response in zip(calls, responses):
+        if 'error' in response:
+            results.append(ValueError(response['error']))
+            continue
+
+        formatter = RESULT_FORMATTERS.get(method, lambda result: result)
+        results.append(formatter(response['result']))
+
+    return results
+
+
+def batch_get_logs(web3, filters):
+    """
+    Sends eth_getLogs of every filter in one batch
+    :param web3: Web3 instance
+    :type web3: Web3
+    :param filters: eth_getLogs filter params
+    :type filters: list(dict)
+    :return: logs of every filter, or the ValueError returned for it
+    :type: list
+    """
+    return batch_request(
+        web3,
+        [('eth_getLogs', [to_rpc_filter(filter_params)]) for filter_params in filters]
+    )
@@ -0,0 +1,365 @@
+"""
+Contains the on-disk cache of eth_getLogs responses.
+Responses are stored per filter (address and topics) and block range,
+only for blocks that are deep enough to be final.
+A request is answered from the cached ranges it overlaps,
+only the blocks no cached range covers are asked to the node,
+so a run with another block range still reuses the earlier runs.
+Logs are stored as zlib compressed json in an SQLite database,
+the least recently used ranges are evicted when it grows past its size limit
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from web3.providers.base import BaseProvider
+from app.metrics import METRICS
+
+CACHE_FILE = "app/data/logs_cache.sqlite"
+
+# bytes of compressed logs kept in the cache
+MAX_CACHE_SIZE = 1024 ** 3
+
+# blocks behind the head after which a block is considered final
+FINALIZED_DEPTH = 64
+
+# seconds the head of the chain is remembered
+HEAD_TTL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ranges (
+    key TEXT NOT NULL,
+    from_block INTEGER NOT NULL,
+    to_block INTEGER NOT NULL,
+    logs BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (key, from_block, to_block)
+);
+CREATE INDEX IF NOT EXISTS ranges_used ON ranges (used);
+"""
+
+
+def to_block_number(block):
+    """
+    Block number of a filter, None for tags like latest
+    """
+    if isinstance(block, int):
+        return block
+    if isinstance(block, str) and block.startswith('0x'):
+        return int(block, 16)
+    return None
+
+
+def filter_key(filter_params):
+    """
+    Cache key of a filter: its addresses and topics
+    """
+    addresses = filter_params.get('address')
+    if isinstance(addresses, str):
+        addresses = [addresses]
+    if addresses is not None:
+        addresses = sorted(address.lower() for address in addresses)
+
+    topics = [
+        [topic.lower() for topic in topic] if isinstance(topic, list) else topic and topic.lower()
+        for topic in filter_params.get('topics') or []
+    ]
+    return json.dumps([addresses, topics])
+
+
+def log_position(log):
+    return int(log['blockNumber'], 16), int(log['logIndex'], 16)
+
+
+class LogCache:
+
+    """
+    SQLite cache of the raw eth_getLogs responses of final blocks
+    :param path: Path to the database file
+    :type path: str
+    :param max_size: Bytes of compressed logs kept, least recently used ranges are evicted first
+    :type max_size: int
+    :param finalized_depth: Blocks behind the head after which a block is cached
+    :type finalized_depth: int
+    """
+    def __init__(self, path=CACHE_FILE, max_size=MAX_CACHE_SIZE, finalized_depth=FINALIZED_DEPTH):
+        self.path = path
+        self.max_size = max_size
+        self.finalized_depth = finalized_depth
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.connection.close()
+
+    def cached_ranges(self, key, from_block, to_block):
+        """
+        Cached ranges overlapping [from_block, to_block], their use time is refreshed
+        :return: (from block, to block, logs) of every range, in block order
+        :type: list(tuple)
+        """
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT from_block, to_block, logs FROM ranges "
+                "WHERE key = ? AND from_block <= ? AND to_block >= ? ORDER BY from_block",
+                (key, to_block, from_block)
+            ).fetchall()
+            self.connection.executemany(
+                "UPDATE ranges SET used = ? WHERE key = ? AND from_block = ? AND to_block = ?",
+                [(time.time(), key, row[0], row[1]) for row in rows]
+            )
+
+        return [(start, end, json.loads(zlib.decompress(logs))) for start, end, logs in rows]
+
+    def store(self, key, from_block, to_block, logs):
+        """
+        Caches the logs of a block range, then evicts ranges past the size limit.
+        A range inside a cached range is not stored, cached ranges inside it are replaced by it,
+        so a shorter range starting at the same block never drops the blocks of a longer one
+        """
+        compressed = zlib.compress(json.dumps(logs, separators=(',', ':')).encode())
+
+        with self.lock, self.connection:
+            covering = self.connection.execute(
+                "SELECT 1 FROM ranges WHERE key = ? AND from_block <= ? AND to_block >= ? LIMIT 1",
+                (key, from_block, to_block)
+            ).fetchone()
+            if covering:
+                return
+
+            self.connection.execute(
+                "DELETE FROM ranges WHERE key = ? AND from_block >= ? AND to_block <= ?",
+                (key, from_block, to_block)
+            )
+            self.connection.execute(
+                "INSERT INTO ranges VALUES (?, ?, ?, ?, ?, ?)",
+                (key, from_block, to_block, compressed, len(compressed), time.time())
+            )
+            self.evict()
+
+    def size(self):
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM ranges").fetchone()[0]
+
+    def evict(self):
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return
+
+        evicted = []
+        for key, from_block, to_block, size in self.connection.execute(
+            "SELECT key, from_block, to_block, size FROM ranges ORDER BY used"
+        ):
+            evicted.append((key, from_block, to_block))
+            excess -= size
+            if excess <= 0:
+                break
+
+        self.connection.executemany(
+            "DELETE FROM ranges WHERE key = ? AND from_block = ? AND to_block = ?",
+            evicted
+        )
+
+    def bounds(self, filter_params, head):
+        """
+        Block range of a filter and the last final block,
+        None if the filter cannot be cached
+        """
+        from_block = to_block_number(filter_params.get('fromBlock'))
+        to_block = to_block_number(filter_params.get('toBlock'))
+        finalized = head - self.finalized_depth
+
+        if from_block is None or to_block is None or 'blockHash' in filter_params or from_block > finalized:
+            return None
+        return from_block, to_block, finalized
+
+    def covered(self, key, from_block, to_block):
+        """
+        Cached logs of a block range and the parts of it no cached range covers
+        :return: logs, in block order, and (from block, to block) of every gap
+        :type: tuple(list(dict), list(tuple))
+        """
+        logs = []
+        gaps = []
+        cursor = from_block
+
+        for start, end, cached in self.cached_ranges(key, from_block, to_block):
+            if start > cursor:
+                gaps.append((cursor, start - 1))
+            # cached ranges can overlap, blocks before the cursor are already taken
+            first = max(cursor, start)
+            logs.extend(log for log in cached if first <= int(log['blockNumber'], 16) <= min(end, to_block))
+            cursor = max(cursor, end + 1)
+        if cursor <= to_block:
+            gaps.append((cursor, to_block))
+
+        return logs, gaps
+
+    def lookup(self, filter_params, head):
+        """
+        Logs of a filter if every block of it is cached
+        :return: logs, None if some blocks are not cached
+        :type: list(dict)
+        """
+        bounds = self.bounds(filter_params, head)
+        if bounds is None or bounds[1] > bounds[2]:
+            return None
+
+        logs, gaps = self.covered(filter_key(filter_params), bounds[0], bounds[1])
+        if gaps:
+            return None
+
+        self.hits += 1
+        METRICS.count('cache_hits')
+        return logs
+
+    def add(self, filter_params, logs, head):
+        """
+        Caches the final blocks of the logs returned for a filter
+        """
+        bounds = self.bounds(filter_params, head)
+        if bounds is None:
+            return
+
+        from_block, to_block, finalized = bounds
+        self.misses += 1
+        self.store(filter_key(filter_params), from_block, min(to_block, finalized), [
+            log for log in logs if int(log['blockNumber'], 16) <= finalized
+        ])
+
+    def get_logs(self, filter_params, fetch, head):
+        """
+        Logs of a filter, only the blocks that are not cached are asked to the node
+        :param filter_params: eth_getLogs filter params, block numbers in hex
+        :type filter_params: dict
+        :param fetch: Sends eth_getLogs with a filter, returns the JSON-RPC response
+        :type fetch: callable
+        :param head: Latest block of the chain
+        :type head: int
+        :return: JSON-RPC response
+        :type: dict
+        """
+        bounds = self.bounds(filter_params, head)
+        if bounds is None:
+            return fetch(filter_params)
+
+        from_block, to_block, finalized = bounds
+        key = filter_key(filter_params)
+        logs, gaps = self.covered(key, from_block, to_block)
+
+        if not gaps:
+            self.hits += 1
+            METRICS.count('cache_hits')
+            return {'jsonrpc': '2.0', 'id': None, 'result': logs}
+
+        METRICS.count('cache_misses')
+        for start, end in gaps:
+            gap_filter = dict(filter_params, fromBlock=hex(start), toBlock=hex(end))
+            response = fetch(gap_filter)
+            if 'error' in response:
+                return response
+
+            logs.extend(response['result'])
+            self.add(gap_filter, response['result'], head)
+
+        logs.sort(key=log_position)
+        return {'jsonrpc': '2.0', 'id': None, 'result': logs}
+
+
+class CachedProvider(BaseProvider):
+
+    """
+    Provider that answers eth_getLogs of final blocks from a LogCache,
+    every other call goes to the wrapped provider.
+    Batches are sent with the batch transport of the wrapped provider if it has one
+    :param provider: Provider to wrap
+    :type provider: BaseProvider
+    :param cache: Cache of the logs
+    :type cache: LogCache
+    """
+    def __init__(self, provider, cache):
+        self.provider = provider
+        self.cache = cache
+        self.middlewares = provider.middlewares
+        self.head = None
+        self.head_time = 0
+
+    def latest_block(self):
+        """
+        Latest block of the chain, remembered for HEAD_TTL seconds.
+        The previous head is kept when the node returns an error
+        :return: head, None if the node never returned it
+        :type: int
+        """
+        if self.head is None or time.time() - self.head_time > HEAD_TTL:
+            self.update_head(self.provider.make_request('eth_blockNumber', []))
+        return self.head
+
+    def update_head(self, response):
+        # error responses keep the previous head, the finality of blocks is unknown without one
+        if 'result' in response:
+            self.head = int(response['result'], 16)
+            self.head_time = time.time()
+
+    def make_request(self, method, params):
+        if method == 'eth_getLogs':
+            head = self.latest_block()
+            if head is None:
+                return self.provider.make_request(method, params)
+            return self.cache.get_logs(
+                params[0],
+                lambda filter_params: self.provider.make_request(method, [filter_params]),
+                head
+            )
+
+        response = self.provider.make_request(method, params)
+        if method == 'eth_blockNumber':
+            self.update_head(response)
+        return response
+
+    def make_batch_request(self, calls):
+        """
+        Answers the eth_getLogs calls that are fully cached,
+        sends the others in one batch and caches their final blocks
+        """
+        responses = [None] * len(calls)
+        missing = []
+        head = self.latest_block()
+
+        for position, (method, params) in enumerate(calls):
+            logs = self.cache.lookup(params[0], head) if method == 'eth_getLogs' and head is not None else None
+            if logs is None:
+                missing.append(position)
+            else:
+                responses[position] = {'jsonrpc': '2.0', 'id': None, 'result': logs}
+
+        if not missing:
+            return responses
+
+        missing_calls = [calls[position] for position in missing]
+        if hasattr(self.provider, 'make_batch_request'):
+            fetched = self.provider.make_batch_request(missing_calls)
+        else:
+            fetched = [self.provider.make_request(method, params) for method, params in missing_calls]
+
+        for position, response in zip(missing, fetched):
+            method, params = calls[position]
+            if method == 'eth_getLogs' and 'result' in response and head is not None:
+                self.cache.add(params[0], response['result'], head)
+            responses[position] = response
+
+        return responses
+
+    def isConnected(self):
+        return self.provider.isConnected()
@@ -0,0 +1,82 @@
+"""
+A base abstract class that represents a Contract in Ethereum,
+read through an async Web3 instance.
+Transfers are yielded in batches instead of being written to a file,
+and the holders are returned instead of being written to a file
+"""
+from app.aio import fetch_windows, CONCURRENCY
+from app.ethereum import record_window
+
+
+class AsyncContract:
+
+    """
+    Async contract constructor
+    :param web3: Web3 instance with the async eth module
+    :type web3: Web3
+    :param address: Address of the contract
+    :type address: str
+    :param scheduler: Retries and backoff of the requests
+    :type scheduler: app.scheduler.RequestScheduler
+    """
+    erc721 = False
+
+    # engine the transfers are applied to and its method taking [from, to, value] rows, set by the subclasses
+    holder_engine = None
+    apply_rows = None
+
+    # field of the decoded transfers holding the value or the token id
+    value_field = 'value'
+
+    def __init__(self, web3, address, scheduler=None):
+        self.web3 = web3
+        self.address = address
+        self.scheduler = scheduler
+
+    async def record_transactions(self, from_block=0, to_block=None, block_range=1000, workers=1, limit=None):
+        """
+        Fetches the transfers of the contract, window by window
+        :param from_block: First block of the scan
+        :type from_block: int
+        :param to_block: Last block of the scan, the latest block by default
+        :type to_block: int
+        :param block_range: Number of blocks in one window
+        :type block_range: int
+        :param workers: Windows fetched at once
+        :type workers: int
+        :param limit: Bounds the calls in flight, shared with the scans of other contracts
+        :type limit: asyncio.Semaphore
+        :return: decoded transfers of every window with transfers, in block order
+        :type: async generator(list(dict))
+        """
+        if to_block is None:
+            to_block = await self.web3.eth.block_number
+
+        windows = fetch_windows(
+            self.web3,
+            self.address,
+            from_block,
+            to_block,
+            block_range=block_range,
+            erc721=self.erc721,
+            workers=workers,
+            limit=limit,
+            scheduler=self.scheduler
+        )
+        async for (window_from, window_to), events in windows:
+            record_window(window_from, window_to, events)
+            if events:
+                yield events
+
+    async def get_holders(self, from_block=0, to_block=None, block_range=1000, workers=CONCURRENCY, limit=None):
+        """
+        Holders of the contract from the transfers of the block range,
+        takes the same parameters as record_transactions
+        :return: holders by address, like the rows of the holders csv file
+        :type: dict
+        """
+        engine = self.holder_engine()
+        batches = self.record_transactions(from_block, to_block, block_range, workers, limit)
+        async for events in batches:
+            self.apply_rows(engine, [[event['from'], event['to'], event[self.value_field]] for event in events])
+        return engine.holders()
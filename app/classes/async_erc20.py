@@ -0,0 +1,16 @@
+"""
+Class that represents an ERC20 token contract in Ethereum, read with asyncio
+"""
+
+from app.classes.async_contract import AsyncContract
+from app.holders import BalanceAggregator
+
+
+class AsyncERC20Contract(AsyncContract):
+
+    """
+    Async ERC20 contract, balances are aggregated in memory.
+    Transfers of a batch are summed at once, in any order
+    """
+    holder_engine = BalanceAggregator
+    apply_rows = staticmethod(BalanceAggregator.add_rows)
@@ -0,0 +1,18 @@
+"""
+Class that represents an ERC721 token contract in Ethereum, read with asyncio
+"""
+
+from app.classes.async_contract import AsyncContract
+from app.holders import OwnerIndex
+
+
+class AsyncERC721Contract(AsyncContract):
+
+    """
+    Async ERC721 contract, ownership is kept in an owner index.
+    Batches come in block order, so every token ends with its last owner
+    """
+    erc721 = True
+    holder_engine = OwnerIndex
+    apply_rows = staticmethod(OwnerIndex.apply_rows)
+    value_field = 'tokenId'
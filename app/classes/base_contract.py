@@ -1,17 +1,36 @@
 """
 A base abstract class that represents a Contract in Ethereum
 Has ABI and address
-This class is used to extract useful information from the contract
+This class is used to extract useful information from the contract,
+the methods shared by the ERC20 and ERC721 contracts live here
+and depend on the erc721 class attribute
 """
+from app.deployment import deployment_block
+from app.follow import BackfillReorged, Follower, POLL_INTERVAL
+from app.service import HolderService, serve_holders
+from app.snapshots import Checkpoints, CHECKPOINT_INTERVAL
+from app.stats import HolderStats, stats_path
+from app.store import EventStore, STORE_FILE
+from app.sync import SyncState, do_sync_transactions, read_holders
+from app.watchlist import do_record_watchlist, watched_holders, WATCHLIST_BLOCK_RANGE
+import csv
+import os
+
+
 class BaseContract:
-    
+
     """
     Contract contstructor
     """
-    def __init__(self, web3, address, abi):
-        self.web3 = web3     
+    # whether the contract is an ERC721 contract, set by the subclasses
+    erc721 = False
+
+    def __init__(self, web3, address, abi, ranges_path=None):
+        self.web3 = web3
         self.address = address
         self.abi = abi
+        # json file with the remembered block ranges, RANGES_FILE by default
+        self.ranges_path = ranges_path
 
     def to_token_contract(self):
         """
@@ -19,3 +38,326 @@ class BaseContract:
         """
         contract = self.web3.eth.contract(address=self.address, abi=self.abi)
         return contract
+
+    def deployment_block(self):
+        """
+        Block the contract was deployed in,
+        found by binary search over eth_getCode and remembered
+        """
+        return deployment_block(self.web3, self.address)
+
+    def write_holders(self, holders, output_path):
+        """
+        Writes the holders to the csv file,
+        and their statistics to a json file next to it in the same pass
+        :param holders: Holders by address
+        :type holders: dict
+        :param output_path: Output file
+        :type output_path: str
+        """
+        stats = HolderStats(erc721=self.erc721)
+        with open(output_path, "w") as output:
+            writer = csv.DictWriter(output, fieldnames=['address', 'tokens' if self.erc721 else 'balance'])
+            writer.writeheader()
+            for holder in holders.values():
+                writer.writerow(holder)
+                stats.add_holder(holder)
+
+        stats.save(stats_path(output_path))
+
+    def get_holders_at(self, block, input=None, output=None, interval=CHECKPOINT_INTERVAL):
+        """
+        Get the holders of the contract as of a block,
+        from the nearest earlier checkpoint and the transactions after it
+        :param block: Block of the snapshot
+        :type block: int
+        :param input: Input file, csv or .parquet
+        :type input: str
+        :param output: Output file
+        :type output: str
+        :param interval: Blocks between two checkpoints
+        :type interval: int
+        """
+        self.set_file_name()
+
+        input_path = input if input else "app/data/{}.csv".format(self.file_name)
+        output_path = output if output else "app/data/{}_holders_{}.csv".format(self.file_name, block)
+
+        holders = Checkpoints(input_path, erc721=self.erc721, interval=interval).holders_at(block)
+        print("Found {} unique addresses at block {}".format(len(holders), block))
+
+        self.write_holders(holders, output_path)
+
+    def make_follower(self, state, holders=None, confirmations=0):
+        """
+        Follower of the blocks after the last synced block,
+        anchored to the hash of that block recorded by the sync
+        :param state: Sync state of the transactions file
+        :type state: SyncState
+        :param holders: Holders up to the last synced block
+        :type holders: dict
+        :param confirmations: Number of blocks to stay behind the head
+        :type confirmations: int
+        :return: follower
+        :type: Follower
+        """
+        return Follower(
+            self.to_token_contract(),
+            self.address,
+            from_block=state.synced_to + 1,
+            erc721=self.erc721,
+            holders=holders,
+            confirmations=confirmations,
+            anchor=state.block_hash(),
+            ranges_path=self.ranges_path
+        )
+
+    def resync(self, input_path, output_path):
+        """
+        Syncs the transactions again after the last synced blocks were reorged,
+        the sync goes back to the last checkpoint still on the chain,
+        then recomputes the holders
+        :param input_path: Synced transactions file
+        :type input_path: str
+        :param output_path: Holders file
+        :type output_path: str
+        :return: sync state
+        :type: SyncState
+        """
+        self.sync_transactions(output=input_path)
+        self.get_holders(input=input_path, output=output_path, incremental=True)
+        return SyncState.load(input_path)
+
+    def follow_transfers(self, input=None, output=None, poll_interval=POLL_INTERVAL, confirmations=0, polls=None):
+        """
+        Follow the Transfer events after the last synced block,
+        the holders are kept in memory and the holders file is rewritten after every change.
+        Reorgs are rolled back, so the holders file can be ahead of the transactions file,
+        the next incremental sync recomputes the holders from the transactions.
+        When the last synced blocks are reorged, the transactions are synced again first
+        :param input: Synced transactions file
+        :type input: str
+        :param output: Holders file
+        :type output: str
+        :param poll_interval: Seconds between two polls
+        :type poll_interval: float
+        :param confirmations: Number of blocks to stay behind the head
+        :type confirmations: int
+        :param polls: Number of polls, forever by default
+        :type polls: int
+        :return: follower
+        :type: Follower
+        """
+        self.set_file_name()
+
+        input_path = input if input else "app/data/{}.csv".format(self.file_name)
+        output_path = output if output else "app/data/{}_holders.csv".format(self.file_name)
+
+        state = SyncState.load(input_path)
+        if state.synced_to is None:
+            raise ValueError("Sync the transactions before following them: {}".format(input_path))
+
+        holders = read_holders(output_path, erc721=self.erc721) if os.path.isfile(output_path) else None
+
+        def on_update(follower):
+            # the holders file gets ahead of the transactions file
+            if state.holders is not None:
+                state.holders = None
+                state.save()
+            self.write_holders(follower.holders(), output_path)
+
+        while True:
+            print("Following transfers from block {}".format(state.synced_to + 1))
+            follower = self.make_follower(state, holders, confirmations)
+            try:
+                follower.run(
+                    poll_interval=poll_interval,
+                    on_update=on_update,
+                    polls=polls
+                )
+                return follower
+            except BackfillReorged as error:
+                print("{}, syncing again".format(error))
+                state = self.resync(input_path, output_path)
+                holders = read_holders(output_path, erc721=self.erc721)
+
+    def serve_holders(self, port, input=None, output=None, poll_interval=POLL_INTERVAL, confirmations=0, polls=None, host=''):
+        """
+        Serve balance and ownership queries over HTTP, see app/service.py.
+        The holders are loaded once from the holders file, computed first if it is behind
+        the transactions file, then the transfers of new blocks are applied in memory.
+        When the last synced blocks are reorged, the transactions are synced again first
+        :param port: Port to listen on, 0 picks a free port
+        :type port: int
+        :param input: Synced transactions file
+        :type input: str
+        :param output: Holders file
+        :type output: str
+        :param poll_interval: Seconds between two refreshes
+        :type poll_interval: float
+        :param confirmations: Number of blocks to stay behind the head
+        :type confirmations: int
+        :param polls: Number of refreshes, forever by default
+        :type polls: int
+        :return: service
+        :type: HolderService
+        """
+        self.set_file_name()
+
+        input_path = input if input else "app/data/{}.csv".format(self.file_name)
+        output_path = output if output else "app/data/{}_holders.csv".format(self.file_name)
+
+        state = SyncState.load(input_path)
+        if state.synced_to is None:
+            raise ValueError("Sync the transactions before serving their holders: {}".format(input_path))
+
+        if not state.holders_synced(output_path) or state.holders['offset'] != state.offset:
+            self.get_holders(input=input_path, output=output_path, incremental=True)
+
+        service = HolderService(self.make_follower(state, read_holders(output_path, erc721=self.erc721), confirmations))
+        server = serve_holders(service, port, host)
+        try:
+            while True:
+                try:
+                    service.run(poll_interval=poll_interval, polls=polls)
+                    return service
+                except BackfillReorged as error:
+                    print("{}, syncing again".format(error))
+                    state = self.resync(input_path, output_path)
+                    holders = read_holders(output_path, erc721=self.erc721)
+                    service.replace(self.make_follower(state, holders, confirmations))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def record_watchlist(
+        self,
+        addresses,
+        from_block=None,
+        to_block='latest',
+        block_range=WATCHLIST_BLOCK_RANGE,
+        output=None,
+        workers=1,
+        batch_size=1
+    ):
+        """
+        Fetch only the Transfer events sent or received by the watched addresses
+        and save them to the csv file, the node filters them by the from and to topics
+        :param addresses: Watched addresses
+        :type addresses: list(str)
+        :param from_block: Starting block, the deployment block of the contract by default so the holders are exact
+        :type from_block: int
+        :param to_block: Ending block
+        :type to_block: int
+        :param block_range: Number of blocks to fetch in one go
+        :type block_range: int
+        :param output: Output file
+        :type output: str
+        :param workers: Number of threads fetching the block range concurrently
+        :type workers: int
+        :param batch_size: Number of block ranges sent in one JSON-RPC batch request
+        :type batch_size: int
+        """
+        web3_contract = self.to_token_contract()
+
+        if to_block == 'latest':
+            to_block = self.web3.eth.block_number
+        if from_block is None:
+            from_block = self.deployment_block()
+
+        self.set_file_name()
+
+        do_record_watchlist(
+            self.address,
+            web3_contract,
+            self.file_name,
+            addresses,
+            from_block,
+            to_block,
+            block_range=block_range,
+            erc721=self.erc721,
+            output=output,
+            workers=workers,
+            batch_size=batch_size
+        )
+
+    def get_watchlist_holders(self, addresses, input=None, output=None):
+        """
+        Get the holders among the watched addresses only,
+        from the transactions recorded by record_watchlist or from all the transactions
+        :param addresses: Watched addresses
+        :type addresses: list(str)
+        :param input: Input file, csv or .parquet
+        :type input: str
+        :param output: Output file
+        :type output: str
+        """
+        self.set_file_name()
+
+        input_path = input if input else "app/data/{}_watchlist.csv".format(self.file_name)
+        output_path = output if output else "app/data/{}_watchlist_holders.csv".format(self.file_name)
+
+        holders, transactions_count = self.aggregate(input_path)
+        holders = watched_holders(holders, addresses, erc721=self.erc721)
+
+        print("Total number of transactions: {}".format(transactions_count))
+        print("Found the {} of {} watched addresses".format('tokens' if self.erc721 else 'balances', len(holders)))
+        self.write_holders(holders, output_path)
+
+    def sync_transactions(self, from_block=0, to_block='latest', block_range=None, output=None, workers=1, batch_size=1):
+        """
+        Append Transfer events of the blocks after the last synced block
+        to the csv file, resuming interrupted syncs from the last checkpoint
+        :param from_block: Block to start the first sync from
+        :type from_block: int
+        :param to_block: Block to sync to
+        :type to_block: int
+        :param block_range: Number of blocks to fetch in one go, the remembered range by default
+        :type block_range: int
+        :param output: Output file
+        :type output: str
+        :param workers: Number of threads fetching the block range concurrently
+        :type workers: int
+        :param batch_size: Number of block ranges sent in one JSON-RPC batch request
+        :type batch_size: int
+        """
+        web3_contract = self.to_token_contract()
+
+        if to_block == 'latest':
+            to_block = self.web3.eth.block_number
+
+        self.set_file_name()
+
+        do_sync_transactions(
+            self.address,
+            web3_contract,
+            self.file_name,
+            from_block=from_block,
+            to_block=to_block,
+            block_range=block_range,
+            output=output,
+            erc721=self.erc721,
+            ranges_path=self.ranges_path,
+            workers=workers,
+            batch_size=batch_size
+        )
+
+    def load_store(self, input=None, path=STORE_FILE):
+        """
+        Ingests the recorded transactions into the event store,
+        transactions that are already stored are skipped
+        :param input: Input file, csv or .parquet
+        :type input: str
+        :param path: Path to the event store
+        :type path: str
+        :return: event store
+        :type: EventStore
+        """
+        self.set_file_name()
+
+        input_path = input if input else "app/data/{}.csv".format(self.file_name)
+        self.store = self.store if self.store is not None else EventStore(path)
+
+        count = self.store.ingest_file(self.address, input_path, erc721=self.erc721)
+        print("Stored {} new transactions in {}".format(count, path))
+        return self.store
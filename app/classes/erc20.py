@@ -3,9 +3,12 @@ Class that represents an ERC20 token contract in Ethereum
 """
 
 from app.utils import fetch_abi
-from app.ethereum import do_record_transactions, update_balances
+from app.ethereum import do_record_transactions
+from app.holders import aggregate_rows, aggregate_parquet
+from app.parquet import is_parquet
 from app.classes.base_contract import BaseContract
-import csv
+from app.writers import open_transactions
+from app.sync import SyncState, read_holders, read_transactions
 
 
 class ERC20Contract(BaseContract):
@@ -23,17 +26,20 @@ class ERC20Contract(BaseContract):
     :type symbol: str
     :param file_name: Name of the file to save the transactions to
     :type file_name: str
+    :param ranges_path: Json file with the remembered block ranges, RANGES_FILE by default
+    :type ranges_path: str
     """
-    def __init__(self, web3, address, abi=None, name=None, symbol=None, file_name=None):
+    def __init__(self, web3, address, abi=None, name=None, symbol=None, file_name=None, ranges_path=None):
         self.name = name
         self.symbol = symbol
         self.file_name = file_name
+        self.store = None
         
         if abi:
-            super().__init__(web3, address, abi)
+            super().__init__(web3, address, abi, ranges_path)
         else:
             fetched_abi = fetch_abi()
-            super().__init__(web3, address, abi=fetched_abi)
+            super().__init__(web3, address, abi=fetched_abi, ranges_path=ranges_path)
     
     def set_file_name(self):
         """
@@ -42,57 +48,75 @@ class ERC20Contract(BaseContract):
         name = self.name if self.name is not None else self.address[2:12]
         self.file_name = '{}_erc20_transactions'.format(name)
         
-    def get_holders(self, input=None, output=None):
+    def get_holders(self, input=None, output=None, incremental=False):
         """
         Get all holders of the contract
         This should always be called after the transactions are recorded
-        :param input: Input file
+        :param input: Input file, csv or .parquet
         :type input: str
         :param output: Output file
         :type output: str
+        :param incremental: Only apply the transactions synced since the last call
+        :type incremental: bool
         """
         self.set_file_name()
         
         input_path = input if input else "app/data/{}.csv".format(self.file_name)
+        output_path = output if output else "app/data/{}_holders.csv".format(self.file_name)
         
-        with open(input_path, "r") as transactions:
-            transactions = csv.reader(transactions)
-
-            # sort by block_number ascending
-            sorted_transactions = sorted(transactions, key=lambda k: k[3])
-            
-            print("Total number of transactions: {}".format(len(sorted_transactions)))
-    
-            # get all unique holders
-            addresses = set()
-            for transaction in sorted_transactions:
-                # skip header row
-                if transaction[1] == 'to':
-                    pass
-                addresses.add(transaction[0])
-                addresses.add(transaction[1])
-            
-            print("Found {} unique addresses".format(len(addresses)))
-            
-            # populate with 0 balance
-            holders = {address: {'address': address, 'balance': 0} for address in addresses}
+        state = SyncState.load(input_path) if incremental else None
+        
+        if state is not None and state.holders_synced(output_path):
+            balances = {
+                address: holder['balance'] for address, holder in read_holders(output_path).items()
+            }
+            new_transactions, offset = read_transactions(input_path, state.holders['offset'], state.offset)
             
-            print("Updating balances...")
-            # do actually update the balances
-            holders = update_balances(holders, sorted_transactions)
-
-            print("Updated balances")
+            print("Applying {} new transactions".format(len(new_transactions)))
+            holders, _ = aggregate_rows(new_transactions, balances)
+            self.write_holders(holders, output_path)
             
-            output_path = output if output else "app/data/{}_holders.csv".format(self.file_name)
+            state.holders = {'path': output_path, 'offset': offset}
+            state.save()
+            return
+        
+        print("Updating balances...")
+        holders, transactions_count = self.aggregate(input_path)
+        
+        print("Total number of transactions: {}".format(transactions_count))
+        print("Found {} unique addresses".format(len(holders)))
+        print("Updated balances")
+        
+        self.write_holders(holders, output_path)
+        
+        if state is not None and state.synced_to is not None:
+            state.holders = {'path': output_path, 'offset': state.offset}
+            state.save()
 
-            writer = csv.DictWriter(
-                open(output_path, "w"),
-                fieldnames=['address', 'balance']
-            )
-            writer.writeheader()
-            writer.writerows(holders.values())
+    def aggregate(self, input_path):
+        """
+        Balances of all the addresses in a transactions file
+        :param input_path: Input file, csv or .parquet
+        :type input_path: str
+        :return: holders by address and number of transactions
+        :type: tuple(dict, int)
+        """
+        # balances are aggregated in batches, the order of the transactions does not matter
+        if is_parquet(input_path):
+            return aggregate_parquet(input_path)
+        with open_transactions(input_path) as transactions:
+            return aggregate_rows(transactions)
 
-    def record_transactions(self, from_block=0, to_block='latest', block_range=1000, output=None):
+    def record_transactions(
+        self,
+        from_block=0,
+        to_block='latest',
+        block_range=None,
+        output=None,
+        workers=1,
+        batch_size=1,
+        full_history=False
+    ):
         """
         Fetch all Transfer events in the blockchain
         and save them to the csv file
@@ -100,15 +124,25 @@ class ERC20Contract(BaseContract):
         :type from_block: int
         :param to_block: Ending block
         :type to_block: int
-        :param block_range: Number of blocks to fetch in one go
+        :param block_range: Number of blocks to fetch in one go, the remembered range by default
         :type block_range: int
         :param output: Output file
         :type output: str
+        :param workers: Number of threads fetching the block range concurrently
+        :type workers: int
+        :param batch_size: Number of block ranges sent in one JSON-RPC batch request
+        :type batch_size: int
+        :param full_history: Whether to fetch every block from the deployment of the contract, from block is ignored
+        :type full_history: bool
         """
         web3_contract = self.to_token_contract()
         
         if to_block == 'latest':
             to_block = self.web3.eth.block_number
+
+        deployment_block = self.deployment_block() if full_history else None
+        if full_history:
+            from_block = deployment_block
         
         self.set_file_name()
         
@@ -119,8 +153,22 @@ class ERC20Contract(BaseContract):
             initial_from_block=from_block,
             block_range=block_range,
             initial_to_block=to_block,
-            output=output
+            output=output,
+            ranges_path=self.ranges_path,
+            workers=workers,
+            batch_size=batch_size,
+            deployment_block=deployment_block
         )
+
+    def balance_of(self, address):
+        """
+        Balance of a holder, needs load_store to be called first
+        :param address: Holder address
+        :type address: str
+        :return: Balance
+        :type: int
+        """
+        return self.store.balance_of(self.address, address)
      
     def __str__(self):
         return "ERC20 Contract: {}".format(self.address)
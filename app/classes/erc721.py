@@ -4,8 +4,10 @@ Class that represents an ERC721 token contract in Ethereum
 
 from app.classes.base_contract import BaseContract
 from app.utils import fetch_abi
-from app.ethereum import do_record_transactions, update_balances
-import csv
+from app.ethereum import do_record_transactions
+from app.holders import OwnerIndex
+from app.ordering import ordered_rows
+from app.sync import SyncState, read_holders, read_transactions
 
 
 class ERC721Contract(BaseContract):
@@ -23,16 +25,22 @@ class ERC721Contract(BaseContract):
     :type symbol: str
     :param file_name: Name of the file to save the transactions to
     :type file_name: str
+    :param ranges_path: Json file with the remembered block ranges, RANGES_FILE by default
+    :type ranges_path: str
     """
-    def __init__(self, web3, address, abi=None, name=None, symbol=None, file_name=None):
+    erc721 = True
+
+    def __init__(self, web3, address, abi=None, name=None, symbol=None, file_name=None, ranges_path=None):
         self.name = name
         self.symbol = symbol
         self.file_name = file_name
+        self.index = None
+        self.store = None
         if abi:
-            super().__init__(web3, address, abi)
+            super().__init__(web3, address, abi, ranges_path)
         else:
             fetched_abi = fetch_abi(erc721=True)
-            super().__init__(web3, address, abi=fetched_abi)
+            super().__init__(web3, address, abi=fetched_abi, ranges_path=ranges_path)
         
     def set_file_name(self):
         """
@@ -41,68 +49,139 @@ class ERC721Contract(BaseContract):
         name = self.name if self.name is not None else self.address[2:12]
         self.file_name = "{}_erc721_transfers".format(name)
     
-    def get_holders(self, input=None, output=None):
+    def get_holders(self, input=None, output=None, incremental=False):
         """
         Get all holders of the contract
         This should always be called after the transactions are recorded
-        :param input: Input file
+        :param input: Input file, csv or .parquet
         :type input: str
         :param output: Output file
         :type output: str
+        :param incremental: Only apply the transactions synced since the last call
+        :type incremental: bool
         """
         self.set_file_name()
         
         input_path = input if input else "app/data/{}.csv".format(self.file_name)
-        with open(input_path, "r") as transactions:
-            transactions = csv.reader(transactions)
-
-            # sort by block_number ascending
-            sorted_transactions = sorted(transactions, key=lambda k: k[3])
-            
-            print("Total number of transactions: {}".format(len(sorted_transactions)))
-            
-            # get all unique holders
-            addresses = set()
-            for transaction in sorted_transactions:
-                addresses.add(transaction[0])
-                addresses.add(transaction[1])
-            
-            print("Found {} unique addresses".format(len(addresses)))
+        output_path = output if output else "app/data/{}_holders.csv".format(self.file_name)
+        
+        state = SyncState.load(input_path) if incremental else None
+        
+        if state is not None and state.holders_synced(output_path):
+            self.index = OwnerIndex.from_holders(read_holders(output_path, erc721=True))
+            new_transactions, offset = read_transactions(input_path, state.holders['offset'], state.offset)
             
-            # populate with 0 balance
-            holders = {address: {'address': address, 'tokens': []} for address in addresses}
+            print("Applying {} new transactions".format(len(new_transactions)))
+            self.index.apply_rows(new_transactions)
+            self.write_holders(self.index.holders(), output_path)
             
-            print("Updating balances...")
-            # do actually update the balances
-            holders = update_balances(holders, sorted_transactions, erc721=True)
+            state.holders = {'path': output_path, 'offset': offset}
+            state.save()
+            return
+        
+        self.load_index(input_path)
+        
+        print("Found {} unique addresses".format(len(self.index.tokens)))
+        
+        self.write_holders(self.index.holders(), output_path)
+        
+        if state is not None and state.synced_to is not None:
+            state.holders = {'path': output_path, 'offset': state.offset}
+            state.save()
 
-            print("Updated balances")
-            
-            output_path = output if output else "app/data/{}_holders.csv".format(self.file_name)
-            
-            writer = csv.DictWriter(
-                open(output_path, "w"),
-                fieldnames=['address', 'tokens']
-            )
-            writer.writeheader()
-            writer.writerows(holders.values())
-    
-    def record_transactions(self, from_block=0, to_block='latest', block_range=1000, output=None):
+    def load_index(self, input=None):
+        """
+        Builds the token id to owner index by replaying the transactions
+        :param input: Input file, csv or .parquet
+        :type input: str
+        :return: index
+        :type: OwnerIndex
+        """
+        self.set_file_name()
+        
+        input_path = input if input else "app/data/{}.csv".format(self.file_name)
+        
+        print("Updating balances...")
+        self.index = OwnerIndex()
+        # transfers are applied in (block number, log index) order
+        transactions_count = self.index.apply_rows(ordered_rows(input_path, erc721=True))
+        
+        print("Total number of transactions: {}".format(transactions_count))
+        print("Updated balances")
+        
+        return self.index
+
+    def aggregate(self, input_path):
+        """
+        Tokens of all the addresses in a transactions file, replayed into the index
+        :param input_path: Input file, csv or .parquet
+        :type input_path: str
+        :return: holders by address and number of transactions
+        :type: tuple(dict, int)
+        """
+        self.index = OwnerIndex()
+        transactions_count = self.index.apply_rows(ordered_rows(input_path, erc721=True))
+        return self.index.holders(), transactions_count
+
+    def owner_of(self, token_id):
+        """
+        Owner of a token, needs get_holders, load_index or load_store to be called first
+        :param token_id: Token id
+        :type token_id: int
+        :return: Owner address
+        :type: str
+        """
+        if self.index is None and self.store is not None:
+            return self.store.owner_of(self.address, token_id)
+        return self.index.owner_of(token_id)
+
+    def tokens_of(self, address):
+        """
+        Tokens owned by an address, needs get_holders, load_index or load_store to be called first
+        :param address: Holder address
+        :type address: str
+        :return: Token ids
+        :type: list(str)
+        """
+        if self.index is None and self.store is not None:
+            return self.store.tokens_of(self.address, address)
+        return self.index.tokens_of(address)
+
+    def record_transactions(
+        self,
+        from_block=0,
+        to_block='latest',
+        block_range=None,
+        output=None,
+        workers=1,
+        batch_size=1,
+        full_history=False
+    ):
         """
         Fetches all transfers from the contract
         :param from_block: Starting block
         :type from_block: int
         :param to_block: Ending block
         :type to_block: int
-        :param block_range: Number of blocks to fetch in one go
+        :param block_range: Number of blocks to fetch in one go, the remembered range by default
         :type block_range: int
         :param output: Output file
         :type output: str
+        :param workers: Number of threads fetching the block range concurrently
+        :type workers: int
+        :param batch_size: Number of block ranges sent in one JSON-RPC batch request
+        :type batch_size: int
+        :param full_history: Whether to fetch every block from the deployment of the contract, from block is ignored
+        :type full_history: bool
         """
         web3_contract = self.to_token_contract()
         
         if to_block == 'latest':
             to_block = self.web3.eth.block_number
+
+        deployment_block = self.deployment_block() if full_history else None
+        if full_history:
+            from_block = deployment_block
                 
         self.set_file_name()
         
@@ -117,5 +196,10 @@ class ERC721Contract(BaseContract):
             initial_to_block=to_block,
             block_range=block_range,
             output=output,
-            erc721=True
+            erc721=True,
+            ranges_path=self.ranges_path,
+            workers=workers,
+            batch_size=batch_size,
+            deployment_block=deployment_block
         )
+
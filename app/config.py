@@ -4,5 +4,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 INFURA_URL = os.getenv('INFURA_URL')
+# comma separated RPC urls, requests are spread across them
+RPC_URLS = [url.strip() for url in os.getenv('RPC_URLS', '').split(',') if url.strip()]
 ETHERSCAN_API_KEY = os.getenv("ETHERSCAN_KEY")
 TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+TRANSFER_TOPIC_BYTES = bytes.fromhex(TRANSFER_TOPIC[2:])
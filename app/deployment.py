@@ -0,0 +1,99 @@
+"""
+Contains the discovery of the block a contract was deployed in.
+A contract has no code before its deployment block and code from then on,
+so the block is found by binary search over eth_getCode, in about 25 calls.
+The block of every contract is remembered in a json file.
+Historical eth_getCode needs an archive node
+"""
+
+import json
+import os
+
+DEPLOYMENTS_FILE = "app/data/deployments.json"
+
+
+def load_deployments(path=None):
+    """
+    Loads the remembered deployment blocks of all contracts
+    :param path: path to the json file, DEPLOYMENTS_FILE by default
+    :type path: str
+    :return: mapping of contract address to deployment block
+    :type: dict
+    """
+    path = path if path else DEPLOYMENTS_FILE
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path) as deployments:
+        return json.load(deployments)
+
+
+def save_deployment(address, block_number, path=None):
+    """
+    Remembers the deployment block of a contract
+    """
+    path = path if path else DEPLOYMENTS_FILE
+    deployments = load_deployments(path)
+    deployments[address] = block_number
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, "w") as output:
+        json.dump(deployments, output, indent=4)
+
+
+def has_code(web3, address, block_number):
+    return len(web3.eth.get_code(address, block_identifier=block_number)) > 0
+
+
+def find_deployment_block(web3, address, to_block=None):
+    """
+    Finds the first block where the contract has code
+    :param web3: Web3 instance
+    :type web3: Web3
+    :param address: The contract address
+    :type address: str
+    :param to_block: A block where the contract has code, the latest block by default
+    :type to_block: int
+    :return: deployment block
+    :type: int
+    """
+    high = to_block if to_block is not None else web3.eth.block_number
+    if not has_code(web3, address, high):
+        raise ValueError("No contract at {} in block {}".format(address, high))
+
+    low = 0
+    while low < high:
+        middle = (low + high) // 2
+        if has_code(web3, address, middle):
+            high = middle
+        else:
+            low = middle + 1
+
+    return low
+
+
+def deployment_block(web3, address, path=None):
+    """
+    Deployment block of a contract, found once and then remembered
+    :param web3: Web3 instance
+    :type web3: Web3
+    :param address: The contract address
+    :type address: str
+    :param path: path to the json file, DEPLOYMENTS_FILE by default
+    :type path: str
+    :return: deployment block
+    :type: int
+    """
+    remembered = load_deployments(path).get(address)
+    if remembered is not None:
+        return remembered
+
+    print("Searching the deployment block of {}".format(address))
+    block_number = find_deployment_block(web3, address)
+    print("{} was deployed in block {}".format(address, block_number))
+
+    save_deployment(address, block_number, path)
+    return block_number
@@ -2,11 +2,13 @@
 Contains functions for interacting with the Ethereum blockchain.
 """
 
-import eth_utils
-from web3._utils.filters import construct_event_filter_params
-from app.utils import format_address
-from app.config import TRANSFER_TOPIC
-import pandas as pd
+from app.utils import checksum_address
+from app.config import TRANSFER_TOPIC_BYTES
+from app.ranges import AdaptiveBlockRange, is_overflow_error
+from app.parallel import split_range, group_ranges, fetch_ranges
+from app.writers import open_transfer_writer
+from app.metrics import METRICS, SIZE_BUCKETS
+import time
 
 
 def process_event(event, erc721=False):
@@ -14,23 +16,31 @@ def process_event(event, erc721=False):
     Process an event, return arguments.
     TO-DO: Currently only decodes a Transfer event,
     should make it more generic.
+    Topics are read as raw bytes,
+    addresses are checksummed once per unique address.
 
     :param event: The event.
     :type event: dict
     """
-    # topics contain the transactors addresses
-    from_ = format_address(event['topics'][1])
-    to = format_address(event['topics'][2])
+    topics = event['topics']
+    # topics contain the transactors addresses, in their last 20 bytes
+    from_ = checksum_address(bytes(topics[1][-20:]))
+    to = checksum_address(bytes(topics[2][-20:]))
     block_number = int(event['blockNumber'])
+    # position of the event in the block, transfers are applied in this order
+    log_index = int(event['logIndex'])
+    transaction_index = int(event['transactionIndex'])
     
     if erc721:
         # tokenID is the last topic
-        token_id = int(event['topics'][3].hex(), 16)
+        token_id = int.from_bytes(topics[3], 'big')
         return {
             'from': from_,
             'to': to,
             'tokenId': token_id,
-            'block_number': block_number
+            'block_number': block_number,
+            'log_index': log_index,
+            'transaction_index': transaction_index
         }
 
     # data is hex encoded, is the amount of tokens transferred
@@ -40,7 +50,9 @@ def process_event(event, erc721=False):
         'from': from_,
         'to': to,
         'value': value,
-        'block_number': block_number
+        'block_number': block_number,
+        'log_index': log_index,
+        'transaction_index': transaction_index
     }
     
 
@@ -73,6 +85,35 @@ def fetch_events(
     :return: The events.
     :rtype: list(dict)
     """
+    event_filter_params = build_filter_params(
+        event,
+        argument_filters=argument_filters,
+        from_block=from_block,
+        to_block=to_block,
+        address=address,
+        topics=topics
+    )
+    
+    logs = event.web3.eth.get_logs(event_filter_params)
+    
+    yield from decode_window(logs, erc721)
+
+
+def build_filter_params(
+    event,
+    argument_filters=None,
+    from_block=None,
+    to_block="latest",
+    address=None,
+    topics=None
+):
+    """
+    Build the eth_getLogs filter params of an event.
+    Takes the same parameters as fetch_events.
+
+    :return: The filter params.
+    :rtype: dict
+    """
     if argument_filters is None:
         argument_filters = {}
 
@@ -82,13 +123,18 @@ def fetch_events(
     if topics is None:
         topics = ["0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"]
 
+    # the addresses of a scan of many contracts replace the address of the event
+    contract_address = None if isinstance(address, (list, tuple)) else event.address
+
+    from web3._utils.filters import construct_event_filter_params
+
     event_abi = event._get_event_abi()
     event_codec = event.web3.codec
 
     data_filter_set, event_filter_params = construct_event_filter_params(
         event_abi=event_abi,
         abi_codec=event_codec,
-        contract_address=event.address,
+        contract_address=contract_address,
         argument_filters=argument_filters,
         fromBlock=from_block,
         toBlock=to_block,
@@ -96,46 +142,211 @@ def fetch_events(
         topics=topics
     )
     
-    events = event.web3.eth.get_logs(event_filter_params)
-    
-    for log in events:
-        formatted_topic = eth_utils.to_bytes(log['topics'][0])
-        if formatted_topic.hex() == TRANSFER_TOPIC:
+    return event_filter_params
+
+
+def decode_logs(logs, erc721=False):
+    """
+    Decode the Transfer events of the logs.
+
+    :param logs: The logs returned by eth_getLogs.
+    :type logs: list(dict)
+    :param erc721: Whether the logs are ERC721 events.
+    :type erc721: bool
+    :return: The events.
+    :rtype: list(dict)
+    """
+    for log in logs:
+        # topics are bytes, compare them without converting to hex
+        if log['topics'] and log['topics'][0] == TRANSFER_TOPIC_BYTES:
             yield process_event(log, erc721)
 
 
-def update_balances(holders, events, erc721=False):
+def decode_window(logs, erc721=False):
     """
-    Updates the balance of a holder
-    :param holders: The holders.
-    :type holders: dict
-    :param events: The events.
-    :type events: list(list)
+    Decode the Transfer events of the logs of a window,
+    timed and counted in the metrics.
+
+    :param logs: The logs returned by eth_getLogs.
+    :type logs: list(dict)
+    :param erc721: Whether the logs are ERC721 events.
+    :type erc721: bool
+    :return: The events.
+    :rtype: list(dict)
     """
-    if erc721:
-        for row in events:
-            # pass if it's header row
-            if row[0] == 'from' or row[2] == 'token_id':
-                continue
-            
-            [from_, to, token_id, block_number] = row
-            # remove tokenId from from holder if transfer_event['from']                
-            holders[to]['tokens'].append(token_id)
-            
-            initial_from_tokens = holders[from_]['tokens']
-            filtered_from_tokens = [token for token in initial_from_tokens if token != token_id]
-            holders[from_]['tokens'] = filtered_from_tokens
-            
-        return holders
-                     
-    for row in events:
-        if row[0] == 'from' or row[2] == 'value':
-            continue
-        [from_, to, value, block_number] = row
-        holders[from_]['balance'] -= int(value)
-        holders[to]['balance'] += int(value)
+    with METRICS.timer('decode_seconds'):
+        events = list(decode_logs(logs, erc721))
+    METRICS.count('logs_decoded', len(events))
+    return events
+
+
+def fetch_logs(event, from_block, to_block, address=None, window=None, topics=None):
+    """
+    Fetch the raw logs of the block range,
+    splitting it in halves while the provider rejects it as too large
+
+    :param event: The event.
+    :type event: web3.contract.ContractEvent
+    :param from_block: The first block of the range.
+    :type from_block: int
+    :param to_block: The last block of the range.
+    :type to_block: int
+    :param address: The contract address, or the addresses of many contracts.
+    :type address: str or list(str)
+    :param window: Adaptive block range to shrink on overflow.
+    :type window: app.ranges.AdaptiveBlockRange
+    :param topics: The topics to filter by, all Transfer events by default.
+    :type topics: list
+    :return: The logs, in block order.
+    :rtype: list(dict)
+    """
+    try:
+        return list(event.web3.eth.get_logs(build_filter_params(
+            event,
+            from_block=from_block,
+            to_block=to_block,
+            address=address,
+            topics=topics
+        )))
+    except ValueError as error:
+        if from_block >= to_block or not is_overflow_error(error):
+            raise
+        
+        METRICS.count('window_splits')
+        if window is not None:
+            window.shrink(to_block - from_block + 1)
         
-    return holders
+        middle = (from_block + to_block) // 2
+        return (
+            fetch_logs(event, from_block, middle, address, window, topics) +
+            fetch_logs(event, middle + 1, to_block, address, window, topics)
+        )
+
+
+def fetch_range(event, from_block, to_block, address=None, erc721=False, window=None, topics=None):
+    """
+    Fetch all events in the block range,
+    splitting it in halves while the provider rejects it as too large
+
+    :param event: The event.
+    :type event: web3.contract.ContractEvent
+    :param from_block: The first block of the range.
+    :type from_block: int
+    :param to_block: The last block of the range.
+    :type to_block: int
+    :param address: The contract address.
+    :type address: str
+    :param erc721: Whether to fetch ERC721 events.
+    :type erc721: bool
+    :param window: Adaptive block range to shrink on overflow.
+    :type window: app.ranges.AdaptiveBlockRange
+    :param topics: The topics to filter by, all Transfer events by default.
+    :type topics: list
+    :return: The events, in block order.
+    :rtype: list(dict)
+    """
+    return decode_window(fetch_logs(event, from_block, to_block, address, window, topics), erc721)
+
+
+def fetch_logs_batch(event, windows, address=None, window=None, topics=None):
+    """
+    Fetch the raw logs of many block ranges with one JSON-RPC batch request.
+    Ranges the provider rejects as too large are split and fetched on their own
+
+    :param event: The event.
+    :type event: web3.contract.ContractEvent
+    :param windows: (from_block, to_block) of every range.
+    :type windows: list(tuple)
+    :param address: The contract address, or the addresses of many contracts.
+    :type address: str or list(str)
+    :param window: Adaptive block range to shrink on overflow.
+    :type window: app.ranges.AdaptiveBlockRange
+    :param topics: The topics to filter by, all Transfer events by default.
+    :type topics: list
+    :return: The logs of every range.
+    :rtype: list(list(dict))
+    """
+    from app.batch import batch_get_logs
+
+    filters = [
+        build_filter_params(event, from_block=from_block, to_block=to_block, address=address, topics=topics)
+        for from_block, to_block in windows
+    ]
+    
+    fetched = []
+    for (from_block, to_block), logs in zip(windows, batch_get_logs(event.web3, filters)):
+        if not isinstance(logs, ValueError):
+            fetched.append(logs)
+        elif is_overflow_error(logs) and from_block < to_block:
+            fetched.append(fetch_logs(event, from_block, to_block, address, window, topics))
+        else:
+            raise logs
+    
+    return fetched
+
+
+def fetch_batch(event, windows, address=None, erc721=False, window=None, topics=None):
+    """
+    Fetch the events of many block ranges with one JSON-RPC batch request.
+    Ranges the provider rejects as too large are split and fetched on their own
+
+    :param event: The event.
+    :type event: web3.contract.ContractEvent
+    :param windows: (from_block, to_block) of every range.
+    :type windows: list(tuple)
+    :param address: The contract address.
+    :type address: str
+    :param erc721: Whether to fetch ERC721 events.
+    :type erc721: bool
+    :param window: Adaptive block range to shrink on overflow.
+    :type window: app.ranges.AdaptiveBlockRange
+    :param topics: The topics to filter by, all Transfer events by default.
+    :type topics: list
+    :return: The events of every range.
+    :rtype: list(list(dict))
+    """
+    return [decode_window(logs, erc721) for logs in fetch_logs_batch(event, windows, address, window, topics)]
+
+
+def fetch_windows(event, ranges, address=None, erc721=False, window=None, workers=1, batch_size=1, topics=None):
+    """
+    Fetch the events of consecutive block ranges,
+    concurrently with workers threads and batch_size ranges per JSON-RPC batch
+
+    :param event: The event.
+    :type event: web3.contract.ContractEvent
+    :param ranges: (from_block, to_block) of every range, in ascending order.
+    :type ranges: list(tuple)
+    :param address: The contract address.
+    :type address: str
+    :param erc721: Whether to fetch ERC721 events.
+    :type erc721: bool
+    :param window: Adaptive block range to shrink on overflow.
+    :type window: app.ranges.AdaptiveBlockRange
+    :param workers: Number of threads.
+    :type workers: int
+    :param batch_size: Number of ranges in one JSON-RPC batch.
+    :type batch_size: int
+    :param topics: The topics to filter by, all Transfer events by default.
+    :type topics: list
+    :return: The events of every range, in the order of the ranges.
+    :rtype: generator(list(dict))
+    """
+    if batch_size > 1:
+        batches = fetch_ranges(
+            lambda batch: fetch_batch(event, batch, address, erc721, window, topics),
+            group_ranges(ranges, batch_size),
+            workers=workers
+        )
+        for batch in batches:
+            yield from batch
+        return
+    
+    yield from fetch_ranges(
+        lambda range_: fetch_range(event, range_[0], range_[1], address, erc721, window, topics),
+        ranges,
+        workers=workers
+    )
 
 
 def do_record_transactions(
@@ -144,15 +355,31 @@ def do_record_transactions(
     file_name, 
     initial_from_block, 
     initial_to_block,
-    block_range=1000,
+    block_range=None,
     erc721=False,
     output=None,
+    ranges_path=None,
+    workers=1,
+    batch_size=1,
+    deployment_block=None,
 ):
     """
-    Records all transactions of a contract in csv file
-    Infura only allows to fetch events in the span of 1000 blocks
-    Therefore, we need to fetch the events in batches
-    and stop the loop when we have zero events in 1000 blocks
+    Records all transactions of a contract in csv file, or in a Parquet file if output ends with .parquet
+    Events are streamed to the file window by window, in the order they are fetched,
+    events of every window are in block order.
+    Providers limit the number of events returned by one query,
+    therefore we fetch the events in windows walking back from the to block.
+    The window is halved and retried when the provider rejects it as too large,
+    and doubled after windows with few events.
+    The whole [from block, to block] range is always fetched,
+    after that we keep walking back until a window has zero events,
+    or down to the deployment block of the contract when it is known.
+    With more than one worker or a batch size above one,
+    the [from block, to block] range is split into windows up front.
+    Workers fetch windows concurrently, and every request of a worker
+    packs batch size windows into one JSON-RPC batch.
+    A failed window stops the whole run with an error,
+    transient errors are retried by the request scheduler before that
     :param address: The contract address.
     :type address: str
     :param web3_contract: The web3 contract.
@@ -162,63 +389,97 @@ def do_record_transactions(
     :param initial_from_block: The initial from block.
     :type initial_from_block: int
     :param initial_to_block: The initial to block.
-    :param block_range: The block range.
+    :param block_range: The block range to start with, the one remembered for the contract by default.
     :type block_range: int
     :param erc721: Whether to fetch ERC721 events.
     :type erc721: bool
     :param output: The output file
     :type output: str
+    :param ranges_path: The json file with remembered block ranges
+    :type ranges_path: str
+    :param workers: Number of threads fetching the [from block, to block] range
+    :type workers: int
+    :param batch_size: Number of windows sent in one JSON-RPC batch
+    :type batch_size: int
+    :param deployment_block: Block the contract was deployed in, no block before it is fetched
+    :type deployment_block: int
     :return: void
     """
-    transactions = pd.DataFrame(columns=[
-        'from', 
-        'to', 
-        'value' 
-        if not erc721 else 'tokenId',
-        'block_number',
-    ])
-    
-    events = list(fetch_events(
-        web3_contract.events.Transfer, 
-        from_block=initial_from_block, 
-        to_block=initial_to_block,
-        address=address,
-        erc721=erc721)
-    )
+    started = time.perf_counter()
+    event = web3_contract.events.Transfer
+    lowest_block = deployment_block if deployment_block is not None else 0
+    initial_from_block = max(initial_from_block, lowest_block)
+    window = AdaptiveBlockRange(address, block_range, path=ranges_path)
+    to_block = initial_to_block
     
-    transactions_count = len(events)
-    print("{} events found".format(transactions_count))
+    output_path = output if output else 'app/data/{}.csv'.format(file_name)
+    print('Writing to file {}'.format(output_path))
     
-    # add events to transactions
-    transactions = transactions.append(events)
-        
-    while True:
-        initial_to_block = initial_from_block + 1
-        initial_from_block = initial_to_block - block_range
-        
-        if initial_from_block < 0:
-            break
+    with open_transfer_writer(output_path, erc721=erc721) as writer:
+        if workers > 1 or batch_size > 1:
+            ranges = split_range(initial_from_block, initial_to_block, window.block_range)
+            print("Fetching {} windows with {} workers in batches of {}".format(
+                len(ranges), workers, batch_size))
+            
+            transactions_count = 0
+            windows = fetch_windows(event, ranges, address, erc721, window, workers, batch_size)
+            for (from_block, to_block), events in zip(ranges, windows):
+                record_window(from_block, to_block, events)
+                with METRICS.timer('write_seconds'):
+                    writer.write(events)
+                transactions_count += len(events)
+            
+            print('Stored {} transfer events from blocks {}-{}'.format(
+                transactions_count, initial_from_block, initial_to_block))
+            to_block = initial_from_block - 1
         
-        try:
-            events = list(fetch_events(
-                web3_contract.events.Transfer, 
-                from_block=initial_from_block, 
-                to_block=initial_to_block,
-                address=address,
-                erc721=erc721)
-            )
+        while to_block >= lowest_block:
+            from_block = max(to_block - window.block_range + 1, lowest_block)
+            
+            # never let a window cross the start of the requested range
+            if to_block >= initial_from_block:
+                from_block = max(from_block, initial_from_block)
+            
+            try:
+                events = list(fetch_events(
+                    event, 
+                    from_block=from_block, 
+                    to_block=to_block,
+                    address=address,
+                    erc721=erc721)
+                )
+            except ValueError as error:
+                if is_overflow_error(error) and window.shrink(to_block - from_block + 1):
+                    METRICS.count('window_splits')
+                    print("Too many events in blocks {}-{}, retrying with block range {}".format(
+                        from_block, to_block, window.block_range))
+                    continue
+                # transient errors are already retried by the scheduler, do not truncate the history
+                print("Failed at block {}: {}".format(to_block, error))
+                raise
             
             transactions_count = len(events)
-            print('Storing {} transfer events'.format(transactions_count))
-            transactions = transactions.append(events)
+            print('Storing {} transfer events from blocks {}-{}'.format(
+                transactions_count, from_block, to_block))
+            record_window(from_block, to_block, events)
+            with METRICS.timer('write_seconds'):
+                writer.write(events)
             
-        except Exception:
-            break
-
-        if transactions_count == 0:
-            break
-    
-    print('Writing to file {}'.format(file_name))
-    output_path = output if output else 'app/data/{}.csv'.format(file_name)
+            window.update(transactions_count)
+            
+            # past the requested range, stop at the first empty window unless the deployment block is known
+            if from_block < initial_from_block and transactions_count == 0 and deployment_block is None:
+                break
+            
+            to_block = from_block - 1
     
-    transactions.to_csv(output_path, index=False)
+    window.save()
+    METRICS.observe('stage_seconds', time.perf_counter() - started, stage='record')
+
+
+def record_window(from_block, to_block, events):
+    """
+    Records the size of a fetched window in the metrics
+    """
+    METRICS.observe('window_blocks', to_block - from_block + 1, buckets=SIZE_BUCKETS)
+    METRICS.observe('window_logs', len(events), buckets=SIZE_BUCKETS)
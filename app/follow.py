@@ -0,0 +1,400 @@
+"""
+Contains the follow mode: after the backfill, new blocks are polled
+and their transfers are applied to holders kept in memory.
+The hash of the last block of every poll is remembered, starting with
+the last block of the backfill. When one of them is no longer on the chain,
+the blocks after the last remembered block that still is are rolled back
+and fetched again. Blocks deeper than the reorg depth are forgotten,
+except the newest of them, the block reorgs can always be rolled back to.
+A poll reads the chain first and only takes the lock of the follower
+to change the holders, so the reads run while the holders are being queried
+"""
+
+import threading
+import time
+from itertools import groupby
+from app.ethereum import fetch_range
+from app.holders import OwnerIndex
+from app.metrics import METRICS
+from app.ranges import AdaptiveBlockRange
+
+# number of blocks a reorg can roll back
+REORG_DEPTH = 64
+
+# seconds between two polls
+POLL_INTERVAL = 2
+
+
+class BackfillReorged(ValueError):
+
+    """
+    Raised when the last block of the backfill is no longer on the chain,
+    the holders of the backfill cannot be rolled back in memory and the transactions must be synced again
+    :param block_number: Last block of the backfill
+    :type block_number: int
+    """
+    def __init__(self, block_number):
+        super().__init__("Block {} of the backfill is no longer on the chain".format(block_number))
+        self.block_number = block_number
+
+
+def block_hash(web3, block_number):
+    """
+    Hash of a block of the chain, None if the chain is shorter
+    :param web3: Web3 instance
+    :type web3: Web3
+    :param block_number: Block number
+    :type block_number: int
+    :return: hash
+    :type: bytes
+    """
+    from web3.exceptions import BlockNotFound
+
+    try:
+        block = web3.eth.get_block(block_number)
+    except BlockNotFound:
+        return None
+    return bytes(block['hash'])
+
+
+def is_transient(error):
+    """
+    Checks if a failed poll can succeed on a later poll:
+    connection errors, timeouts, rate limits and requests the scheduler gave up on.
+    Reorgs that cannot be rolled back and windows that cannot be split are not
+    :param error: exception raised by the poll
+    :type error: Exception
+    :type: bool
+    """
+    from app.scheduler import RetriesExhausted, is_retryable
+
+    if isinstance(error, RetriesExhausted):
+        return True
+    # JSON-RPC errors are raised as a ValueError of the error
+    if isinstance(error, ValueError) and error.args and isinstance(error.args[0], dict):
+        return is_retryable(error.args[0])
+    return is_retryable(error)
+
+
+class HolderState:
+
+    """
+    Holders kept in memory, transfers are applied block by block
+    and can be undone block by block
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :param holders: Holders to start from, in the format of the holders csv file
+    :type holders: dict
+    """
+    def __init__(self, erc721=False, holders=None):
+        self.erc721 = erc721
+
+        if erc721:
+            self.index = OwnerIndex.from_holders(holders or {})
+        else:
+            self.balances = {address: holder['balance'] for address, holder in (holders or {}).items()}
+
+    def apply(self, events):
+        """
+        Applies the transfers of a block
+        :param events: Decoded Transfer events, in log index order
+        :type events: list(dict)
+        :return: what is needed to undo the transfers
+        :type: list(tuple)
+        """
+        undo = []
+
+        for event in events:
+            if self.erc721:
+                token_id = str(event['tokenId'])
+                new_holders = [address for address in (event['from'], event['to']) if address not in self.index.tokens]
+                undo.append((event['from'], event['to'], token_id, self.index.owners.get(token_id), new_holders))
+                self.index.transfer(event['from'], event['to'], token_id)
+            else:
+                new_holders = [address for address in (event['from'], event['to']) if address not in self.balances]
+                undo.append((event['from'], event['to'], event['value'], None, new_holders))
+                self.balances[event['from']] = self.balances.get(event['from'], 0) - event['value']
+                self.balances[event['to']] = self.balances.get(event['to'], 0) + event['value']
+
+        return undo
+
+    def rollback(self, undo):
+        """
+        Undoes the transfers of a block
+        :param undo: The list returned by apply
+        :type undo: list(tuple)
+        """
+        for from_, to, value, previous, new_holders in reversed(undo):
+            if self.erc721:
+                self.index.tokens[to].pop(value, None)
+                if previous is None:
+                    del self.index.owners[value]
+                else:
+                    self.index.tokens[previous][value] = None
+                    self.index.owners[value] = previous
+                for address in new_holders:
+                    self.index.tokens.pop(address, None)
+            else:
+                self.balances[from_] += value
+                self.balances[to] -= value
+                for address in new_holders:
+                    self.balances.pop(address, None)
+
+    def holders(self):
+        """
+        Holders in the format of the holders csv file
+        """
+        if self.erc721:
+            return self.index.holders()
+        return {address: {'address': address, 'balance': balance} for address, balance in self.balances.items()}
+
+
+class Follower:
+
+    """
+    Follows the Transfer events of a contract at the head of the chain
+    :param web3_contract: The web3 contract
+    :type web3_contract: web3.contract.Contract
+    :param address: The contract address
+    :type address: str
+    :param from_block: First block to follow
+    :type from_block: int
+    :param erc721: Whether to follow ERC721 events
+    :type erc721: bool
+    :param holders: Holders up to from_block - 1
+    :type holders: dict
+    :param confirmations: Number of blocks to stay behind the head
+    :type confirmations: int
+    :param block_range: Number of blocks fetched by one poll to start with, shrunk when the node rejects it,
+        the range remembered for the contract by default
+    :type block_range: int
+    :param reorg_depth: Number of blocks that can be rolled back
+    :type reorg_depth: int
+    :param anchor: Hash of block from_block - 1 recorded by the backfill, read on the first poll by default
+    :type anchor: bytes
+    :param ranges_path: The json file with remembered block ranges
+    :type ranges_path: str
+    """
+    def __init__(
+        self,
+        web3_contract,
+        address,
+        from_block,
+        erc721=False,
+        holders=None,
+        confirmations=0,
+        block_range=None,
+        reorg_depth=REORG_DEPTH,
+        anchor=None,
+        ranges_path=None
+    ):
+        self.event = web3_contract.events.Transfer
+        self.web3 = web3_contract.web3
+        self.address = address
+        self.erc721 = erc721
+        self.confirmations = confirmations
+        self.window = AdaptiveBlockRange(address, block_range, path=ranges_path)
+        self.reorg_depth = reorg_depth
+
+        self.state = HolderState(erc721, holders)
+        self.synced_to = from_block - 1
+        # the blocks of the backfill cannot be rolled back
+        self.backfilled_to = from_block - 1
+        self.head = None
+        self.rolled_back = 0
+        # taken while the holders change, readers of the holders from other threads take it too
+        self.lock = threading.Lock()
+        self.polled = None
+        # hashes of the remembered blocks and the undo lists of the blocks with transfers
+        self.hashes = {}
+        self.undo = {}
+        if anchor is not None:
+            self.hashes[self.backfilled_to] = anchor
+
+    def block_hash(self, block_number):
+        """
+        Hash of a block of the chain, None if the chain is shorter
+        """
+        return block_hash(self.web3, block_number)
+
+    def find_fork(self):
+        """
+        Last applied block that is still on the chain, the remembered blocks
+        are checked from the newest to the oldest
+        :return: block number
+        :type: int
+        """
+        for block_number in sorted(self.hashes, reverse=True):
+            if self.block_hash(block_number) == self.hashes[block_number]:
+                # every earlier block is on the chain too
+                return block_number
+
+        if not self.hashes:
+            return self.synced_to
+        if self.backfilled_to in self.hashes:
+            raise BackfillReorged(self.backfilled_to)
+        raise ValueError("Reorg deeper than {} blocks before block {}".format(self.reorg_depth, self.synced_to))
+
+    def rollback(self, fork):
+        """
+        Rolls back the blocks after the fork
+        :param fork: Last block that is still on the chain
+        :type fork: int
+        :return: number of blocks rolled back
+        :type: int
+        """
+        if fork >= self.synced_to:
+            return 0
+
+        for block_number in sorted(self.undo, reverse=True):
+            if block_number > fork:
+                self.state.rollback(self.undo.pop(block_number))
+        for block_number in [number for number in self.hashes if number > fork]:
+            del self.hashes[block_number]
+
+        print("Reorg, rolled back blocks {}-{}".format(fork + 1, self.synced_to))
+        rolled_back = self.synced_to - fork
+        METRICS.count('reorgs')
+        METRICS.count('blocks_rolled_back', rolled_back)
+        self.synced_to = fork
+        return rolled_back
+
+    def fetch(self):
+        """
+        Reads the chain since the last poll without changing the holders:
+        the last applied block still on the chain, then the transfers after it.
+        The lock is only taken to remember the anchor hash and the head.
+        Windows the node rejects as too large are split
+        :return: block to roll back to, last fetched block, its hash, None if there is no new block,
+            and the decoded transfers after the fork in block order
+        :type: tuple(int, int, bytes, list(dict))
+        """
+        if not self.hashes and self.synced_to >= 0:
+            # the last block of the backfill anchors the first reorg check
+            anchor = self.block_hash(self.synced_to)
+            with self.lock:
+                self.hashes[self.synced_to] = anchor
+
+        fork = self.find_fork()
+
+        head = self.web3.eth.block_number - self.confirmations
+        # status readers take the lock, only the poll thread changes the hashes and the head
+        with self.lock:
+            self.head = head
+        if head <= fork:
+            return fork, fork, None, []
+
+        to_block = min(head, fork + self.window.block_range)
+        # read before the logs, if the chain changes in between the next poll rolls it back
+        tip = self.block_hash(to_block)
+        if tip is None:
+            return fork, fork, None, []
+
+        events = fetch_range(self.event, fork + 1, to_block, self.address, self.erc721, self.window)
+        self.window.update(len(events))
+        return fork, to_block, tip, events
+
+    def apply(self, fetched):
+        """
+        Rolls back the reorged blocks and applies the fetched transfers
+        :param fetched: The tuple returned by fetch
+        :type fetched: tuple
+        :return: number of transfers applied
+        :type: int
+        """
+        fork, to_block, tip, events = fetched
+        self.rolled_back = self.rollback(fork)
+        if tip is None:
+            return 0
+
+        count = 0
+        for block_number, block_events in groupby(events, key=lambda event: event['block_number']):
+            block_events = list(block_events)
+            self.undo[block_number] = self.state.apply(block_events)
+            count += len(block_events)
+
+        self.hashes[to_block] = tip
+        self.synced_to = to_block
+        self.prune()
+        METRICS.count('rows_applied', count)
+
+        return count
+
+    def poll(self):
+        """
+        Applies the transfers of the blocks added since the last poll,
+        after rolling back reorged blocks.
+        The chain is read without the lock, it is only taken to change the holders
+        :return: number of transfers applied
+        :type: int
+        """
+        fetched = self.fetch()
+        with self.lock:
+            count = self.apply(fetched)
+            self.polled = time.time()
+        return count
+
+    def prune(self):
+        """
+        Forgets the blocks that are too deep to be rolled back,
+        the newest of them is kept so a reorg can always be rolled back to it
+        """
+        oldest = self.synced_to - self.reorg_depth
+        deep = [number for number in self.hashes if number <= oldest]
+        if not deep:
+            return
+
+        base = max(deep)
+        for block_number in deep:
+            if block_number != base:
+                del self.hashes[block_number]
+        for block_number in [number for number in self.undo if number <= base]:
+            del self.undo[block_number]
+
+    def holders(self):
+        return self.state.holders()
+
+    def run(self, poll_interval=POLL_INTERVAL, on_update=None, polls=None):
+        """
+        Polls the chain until interrupted, or polls times
+        :param poll_interval: Seconds between two polls
+        :type poll_interval: float
+        :param on_update: Called with the follower after every poll that changed the holders
+        :type on_update: callable
+        :param polls: Number of polls, forever by default
+        :type polls: int
+        """
+        count = 0
+        try:
+            while polls is None or count < polls:
+                count += 1
+                self.run_once(poll_interval, on_update)
+        except KeyboardInterrupt:
+            print("Stopped following at block {}".format(self.synced_to))
+
+    def run_once(self, poll_interval, on_update):
+        """
+        Polls once, then waits unless the follower is catching up.
+        Errors that a later poll can recover from are printed, the others are raised
+        :param poll_interval: Seconds between two polls
+        :type poll_interval: float
+        :param on_update: Called with the follower after a poll that changed the holders
+        :type on_update: callable
+        """
+        try:
+            transfers_count = self.poll()
+        except Exception as error:
+            if not is_transient(error):
+                raise
+            print("Poll failed at block {}: {}".format(self.synced_to, error))
+            time.sleep(poll_interval)
+            return
+
+        if transfers_count or self.rolled_back:
+            print("Applied {} transfer events up to block {}".format(transfers_count, self.synced_to))
+            if on_update is not None:
+                on_update(self)
+
+        # catching up polls again right away
+        if self.head is None or self.synced_to >= self.head:
+            time.sleep(poll_interval)
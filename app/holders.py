@@ -0,0 +1,280 @@
+"""
+Contains the holder engines.
+ERC721 ownership is kept in a token id to owner index.
+ERC20 transfers are aggregated in batches with numpy:
+every batch is grouped by address, outflows are subtracted and inflows added.
+uint256 values do not fit in any numpy integer, so they are split
+into limbs that are summed separately in int64 and joined back to python ints
+once per address and batch, which keeps the balances exact.
+numpy is imported by the functions that aggregate, the ERC721 index never loads it
+"""
+
+from app.parquet import require_pyarrow
+from app.metrics import METRICS
+
+# 9 limbs of 9 decimal digits hold the 78 digits of any uint256
+DECIMAL_LIMBS = 9
+DECIMAL_DIGITS = 9
+
+# number of transfers aggregated at once
+BATCH_SIZE = 100000
+
+
+def decimal_limbs(values):
+    """
+    Splits decimal values into limbs of 9 digits, most significant first
+    :param values: decimal strings or ints
+    :type values: list
+    :return: limbs, one row per value
+    :type: numpy.ndarray
+    """
+    import numpy as np
+
+    width = DECIMAL_LIMBS * DECIMAL_DIGITS
+    strings = np.char.zfill(np.array([str(value) for value in values], dtype='S{}'.format(width)), width)
+    digits = strings.view(np.uint8).reshape(len(values), DECIMAL_LIMBS, DECIMAL_DIGITS) - ord('0')
+    powers = 10 ** np.arange(DECIMAL_DIGITS - 1, -1, -1, dtype=np.int64)
+    return digits.astype(np.int64).dot(powers)
+
+
+def word_limbs(raw):
+    """
+    Splits 32 bytes big endian values into 8 limbs of 32 bits, most significant first
+    :param raw: concatenated 32 bytes values
+    :type raw: bytes or buffer
+    :return: limbs, one row per value
+    :type: numpy.ndarray
+    """
+    import numpy as np
+
+    return np.frombuffer(raw, dtype='>u4').reshape(-1, 8).astype(np.int64)
+
+
+class BalanceAggregator:
+
+    """
+    Aggregates ERC20 balances batch by batch.
+    Only the final balance is computed, so the order of the transfers does not matter
+    :param balances: Balances to start from, by address
+    :type balances: dict
+    """
+    def __init__(self, balances=None):
+        self.balances = dict(balances) if balances else {}
+
+    def add_batch(self, from_, to, limbs, base):
+        """
+        Applies a batch of transfers
+        :param from_: senders
+        :type from_: numpy.ndarray
+        :param to: receivers
+        :type to: numpy.ndarray
+        :param limbs: limbs of the values, most significant first
+        :type limbs: numpy.ndarray
+        :param base: base of a limb
+        :type base: int
+        """
+        import numpy as np
+
+        if len(from_) == 0:
+            return
+
+        addresses, inverse = np.unique(np.concatenate([from_, to]), return_inverse=True)
+        flows = np.concatenate([-limbs, limbs])
+
+        # group the flows by address, every address appears at least once
+        order = np.argsort(inverse, kind='stable')
+        starts = np.flatnonzero(np.diff(inverse[order], prepend=-1))
+        sums = np.add.reduceat(flows[order], starts, axis=0)
+
+        weights = np.array([base ** power for power in range(limbs.shape[1] - 1, -1, -1)], dtype=object)
+        deltas = sums.astype(object).dot(weights)
+
+        for address, delta in zip(addresses.tolist(), deltas):
+            self.balances[address] = self.balances.get(address, 0) + delta
+
+    def add_rows(self, rows):
+        """
+        Applies transfers given as rows of [from, to, value, ...]
+        :param rows: rows of a transactions file, without the header row
+        :type rows: list(list)
+        """
+        import numpy as np
+
+        if not rows:
+            return
+
+        with METRICS.timer('apply_seconds'):
+            from_, to, values = zip(*[row[:3] for row in rows])
+            base = 10 ** DECIMAL_DIGITS
+            self.add_batch(np.array(from_), np.array(to), decimal_limbs(values), base)
+        METRICS.count('rows_applied', len(rows))
+
+    def holders(self, to_address=None):
+        """
+        Holders in the format of the holders csv file
+        :param to_address: converts the aggregated keys to addresses
+        :type to_address: callable
+        :return: holders by address
+        :type: dict
+        """
+        holders = {}
+        for key, balance in self.balances.items():
+            address = to_address(key) if to_address else key
+            holders[address] = {'address': address, 'balance': balance}
+        return holders
+
+
+def aggregate_rows(rows, balances=None, batch_size=BATCH_SIZE):
+    """
+    Aggregates the balances of transactions file rows, skipping the header row
+    :param rows: rows of [from, to, value, block number]
+    :type rows: iterable(list)
+    :param balances: Balances to start from, by address
+    :type balances: dict
+    :param batch_size: Number of rows aggregated at once
+    :type batch_size: int
+    :return: holders by address and the number of transfers
+    :type: tuple(dict, int)
+    """
+    aggregator = BalanceAggregator(balances)
+    batch = []
+    count = 0
+
+    for row in rows:
+        if row[2] == 'value':
+            continue
+
+        batch.append(row)
+        if len(batch) >= batch_size:
+            aggregator.add_rows(batch)
+            count += len(batch)
+            batch = []
+
+    aggregator.add_rows(batch)
+    count += len(batch)
+
+    return aggregator.holders(), count
+
+
+def aggregate_parquet(path, batch_size=BATCH_SIZE):
+    """
+    Aggregates the balances of a Parquet transactions file,
+    reading only the from, to and value columns.
+    Addresses stay 20 bytes keys until the end, each is checksummed once
+    :param path: Path to the Parquet file
+    :type path: str
+    :param batch_size: Number of rows aggregated at once
+    :type batch_size: int
+    :return: holders by address and the number of transfers
+    :type: tuple(dict, int)
+    """
+    import eth_utils
+    import numpy as np
+
+    _, pq = require_pyarrow()
+    aggregator = BalanceAggregator()
+    count = 0
+
+    def keys(column):
+        return np.frombuffer(column.buffers()[1], dtype='S20', count=len(column), offset=column.offset * 20)
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=['from', 'to', 'value']):
+        from_, to, values = batch.columns
+        raw = values.buffers()[1][values.offset * 32:(values.offset + len(values)) * 32]
+        with METRICS.timer('apply_seconds'):
+            aggregator.add_batch(keys(from_), keys(to), word_limbs(raw), 2 ** 32)
+        METRICS.count('rows_applied', batch.num_rows)
+        count += batch.num_rows
+
+    # numpy strips trailing zero bytes of the keys
+    holders = aggregator.holders(lambda key: eth_utils.to_checksum_address(key.ljust(20, b'\0')))
+    return holders, count
+
+
+class OwnerIndex:
+
+    """
+    Ownership of ERC721 tokens: the owner of every token id,
+    and the token ids of every address in the order they were received.
+    A transfer costs O(1) no matter how many tokens the addresses hold
+    """
+    def __init__(self):
+        self.owners = {}
+        # dicts are used as ordered sets
+        self.tokens = {}
+
+    @classmethod
+    def from_holders(cls, holders):
+        """
+        Builds the index from holders read from a holders file,
+        without replaying the transactions
+        :param holders: holders by address, with their tokens
+        :type holders: dict
+        :return: index
+        :type: OwnerIndex
+        """
+        index = cls()
+        for address, holder in holders.items():
+            index.tokens[address] = dict.fromkeys(holder['tokens'])
+            for token_id in holder['tokens']:
+                index.owners[token_id] = address
+        return index
+
+    def transfer(self, from_, to, token_id):
+        """
+        Moves a token to its new owner
+        :param from_: sender
+        :type from_: str
+        :param to: receiver
+        :type to: str
+        :param token_id: token id
+        :type token_id: str
+        """
+        previous = self.owners.get(token_id)
+        if previous is not None:
+            self.tokens[previous].pop(token_id, None)
+
+        # senders stay holders, even without tokens
+        self.tokens.setdefault(from_, {}).pop(token_id, None)
+        self.tokens.setdefault(to, {})[token_id] = None
+        self.owners[token_id] = to
+
+    def apply_rows(self, rows):
+        """
+        Applies transfers given as rows of [from, to, token id, ...], skipping the header row
+        :param rows: rows of a transactions file, in block order
+        :type rows: iterable(list)
+        :return: number of transfers applied
+        :type: int
+        """
+        count = 0
+        for row in rows:
+            if row[2] == 'tokenId':
+                continue
+            self.transfer(row[0], row[1], str(row[2]))
+            count += 1
+        METRICS.count('rows_applied', count)
+        return count
+
+    def owner_of(self, token_id):
+        """
+        Owner of a token, None if the token was never transferred
+        """
+        return self.owners.get(str(token_id))
+
+    def tokens_of(self, address):
+        """
+        Token ids owned by an address
+        """
+        return list(self.tokens.get(address, ()))
+
+    def holders(self):
+        """
+        Holders in the format of the holders csv file
+        :return: holders by address
+        :type: dict
+        """
+        return {
+            address: {'address': address, 'tokens': list(tokens)}
+            for address, tokens in self.tokens.items()
+        }
@@ -0,0 +1,279 @@
+"""
+Contains the instrumentation of the pipeline stages: counters and histograms
+of RPC latencies, decoded logs, window sizes, retries and rows sorted and applied.
+Metrics are off by default, then every call returns at once and timers are a shared no-op,
+so the instrumented code pays one attribute check.
+They are dumped as json at the end of a run, or served in the Prometheus text format
+on /metrics in the long-running follow mode
+"""
+
+import json
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# prefix of the metric names in the Prometheus text format
+PREFIX = "holders_"
+
+# bucket bounds of the histograms of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# bucket bounds of the histograms of sizes, like blocks or logs in a window
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+# rates reported with the metrics: name, counter, and the histogram of seconds
+# whose sum the counter is divided by, None divides by the seconds of the run
+RATES = (
+    ('logs_decoded_per_second', 'logs_decoded', 'decode_seconds'),
+    ('rows_applied_per_second', 'rows_applied', 'apply_seconds'),
+    ('rpc_calls_per_second', 'rpc_calls', None),
+)
+
+NO_TIMER = nullcontext()
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=None):
+    """
+    Labels of a sample in the Prometheus text format
+    """
+    labels = list(key) + ([extra] if extra else [])
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in labels) + "}"
+
+
+class Histogram:
+
+    """
+    Counts of the observed values below every bucket bound, their sum and count
+    :param buckets: Upper bounds of the buckets, in ascending order
+    :type buckets: tuple
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        position = 0
+        while position < len(self.buckets) and value > self.buckets[position]:
+            position += 1
+        self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        (upper bound, values at or below it) of every bucket, the last bound is +Inf
+        """
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            yield bound, total
+
+
+class Timer:
+
+    """
+    Context manager observing the seconds of a block in a histogram
+    """
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class Metrics:
+
+    """
+    Registry of the counters and histograms of a run, shared by all threads
+    :param enabled: Whether the metrics are recorded
+    :type enabled: bool
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        # bucket bounds of every histogram, latency buckets by default
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def count(self, name, value=1, **labels):
+        """
+        Adds value to a counter
+        """
+        if not self.enabled:
+            return
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=None, **labels):
+        """
+        Observes a value in a histogram
+        :param buckets: Bucket bounds, set by the first observation of the histogram
+        :type buckets: tuple
+        """
+        if not self.enabled:
+            return
+        key = (name, label_key(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.buckets.setdefault(name, buckets if buckets else LATENCY_BUCKETS)
+                self.histograms[key] = Histogram(self.buckets[name])
+            self.histograms[key].observe(value)
+
+    def timer(self, name, **labels):
+        """
+        Times a block into the histogram of seconds name
+        """
+        if not self.enabled:
+            return NO_TIMER
+        return Timer(self, name, labels)
+
+    def rates(self):
+        """
+        Rates of RATES whose counter and seconds were recorded,
+        counters and histograms are summed over their labels
+        :return: rate by name
+        :type: dict
+        """
+        run_seconds = time.time() - self.started
+        rates = {}
+        with self.lock:
+            for name, counter, timer in RATES:
+                value = sum(count for (counter_name, _), count in self.counters.items() if counter_name == counter)
+                if timer is None:
+                    seconds = run_seconds
+                else:
+                    seconds = sum(
+                        histogram.sum for (histogram_name, _), histogram in self.histograms.items()
+                        if histogram_name == timer
+                    )
+                if value and seconds > 0:
+                    rates[name] = value / seconds
+        return rates
+
+    def to_dict(self):
+        """
+        Metrics of the run, the rates are per second of the sum of their timer,
+        or of the run, see RATES
+        :type: dict
+        """
+        rates = self.rates()
+        with self.lock:
+            counters = [
+                {'name': name, 'labels': dict(key), 'value': value}
+                for (name, key), value in sorted(self.counters.items())
+            ]
+            histograms = [{
+                'name': name,
+                'labels': dict(key),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'mean': histogram.sum / histogram.count if histogram.count else None,
+                'buckets': {str(bound): count for bound, count in histogram.cumulative()},
+            } for (name, key), histogram in sorted(self.histograms.items())]
+
+        return {
+            'seconds': time.time() - self.started,
+            'counters': counters,
+            'histograms': histograms,
+            'rates': rates,
+        }
+
+    def save(self, path):
+        """
+        Writes the metrics to a json file
+        """
+        with open(path, "w") as output:
+            json.dump(self.to_dict(), output, indent=4)
+        print("Metrics written to {}".format(path))
+
+    def prometheus(self):
+        """
+        Metrics in the Prometheus text format
+        :type: str
+        """
+        lines = []
+        for name, rate in sorted(self.rates().items()):
+            lines.append("# TYPE {}{} gauge".format(PREFIX, name))
+            lines.append("{}{} {}".format(PREFIX, name, rate))
+
+        with self.lock:
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append("# TYPE {}{}_total counter".format(PREFIX, name))
+                for (counter, key), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append("{}{}_total{} {}".format(PREFIX, name, format_labels(key), value))
+
+            names = sorted({name for name, _ in self.histograms})
+            for name in names:
+                lines.append("# TYPE {}{} histogram".format(PREFIX, name))
+                for (histogram_name, key), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        lines.append("{}{}_bucket{} {}".format(PREFIX, name, format_labels(key, ('le', bound)), count))
+                    lines.append("{}{}_sum{} {}".format(PREFIX, name, format_labels(key), histogram.sum))
+                    lines.append("{}{}_count{} {}".format(PREFIX, name, format_labels(key), histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+
+# metrics of the process, every stage records into it
+METRICS = Metrics()
+
+
+def serve_metrics(port, metrics=METRICS, host=''):
+    """
+    Serves the metrics in the Prometheus text format on /metrics, from a daemon thread
+    :param port: Port to listen on, 0 picks a free port
+    :type port: int
+    :return: server, its port is server.server_address[1]
+    :type: ThreadingHTTPServer
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Serving metrics on port {}".format(server.server_address[1]))
+    return server
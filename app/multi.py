@@ -0,0 +1,154 @@
+"""
+Contains the batch mode that extracts the transfers of many contracts with one scan of the chain.
+eth_getLogs is called with the list of contract addresses and the Transfer topic,
+the logs are then demultiplexed by the address that emitted them.
+ERC20 and ERC721 Transfer events have the same topic, the manifest tells them apart
+"""
+
+import json
+import os
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.ethereum import decode_window, fetch_logs, fetch_logs_batch
+from app.parallel import split_range, group_ranges, fetch_ranges
+from app.ranges import AdaptiveBlockRange
+from app.writers import open_transfer_writer
+
+
+def load_contracts(web3, manifest, ranges_path=None):
+    """
+    Instantiates the contracts of a manifest like test-contracts.json
+    :param web3: Web3 instance, None to only read transactions files
+    :type web3: Web3
+    :param manifest: Path to the json manifest, a list of {name, type, symbol, address}
+    :type manifest: str
+    :param ranges_path: Json file with the remembered block ranges, RANGES_FILE by default
+    :type ranges_path: str
+    :return: contracts
+    :type: list(ERC20Contract or ERC721Contract)
+    """
+    import eth_utils
+
+    with open(manifest) as contracts:
+        contracts = json.load(contracts)
+
+    instances = []
+    for contract in contracts:
+        contract_class = ERC721Contract if contract.get('type') == 'ERC721' else ERC20Contract
+        instances.append(contract_class(
+            web3,
+            eth_utils.to_checksum_address(contract['address']),
+            name=contract.get('name'),
+            symbol=contract.get('symbol'),
+            ranges_path=ranges_path,
+        ))
+
+    return instances
+
+
+def transactions_paths(contracts, directory='app/data', extension='csv'):
+    """
+    Transactions file of every contract in a directory, named like record_transactions names it
+    :param contracts: contracts
+    :type contracts: list(ERC20Contract or ERC721Contract)
+    :param directory: Directory of the transactions files
+    :type directory: str
+    :param extension: Format of the transactions files, csv or parquet
+    :type extension: str
+    :return: path of the transactions file of every contract, by address
+    :rtype: dict
+    """
+    paths = {}
+    for contract in contracts:
+        contract.set_file_name()
+        paths[contract.address] = os.path.join(directory, "{}.{}".format(contract.file_name, extension))
+    return paths
+
+
+def do_record_contracts(
+    contracts,
+    from_block,
+    to_block,
+    block_range=None,
+    output_dir='app/data',
+    extension='csv',
+    workers=1,
+    batch_size=1,
+):
+    """
+    Records the transactions of many contracts with one scan of [from_block, to_block].
+    Every contract gets its own transactions file, named like record_transactions names it
+    :param contracts: contracts to record, the node is the one of their web3 instance
+    :type contracts: list(ERC20Contract or ERC721Contract)
+    :param from_block: The first block of the range.
+    :type from_block: int
+    :param to_block: The last block of the range.
+    :type to_block: int
+    :param block_range: The block range to start with, the one remembered for the contracts by default.
+    :type block_range: int
+    :param output_dir: Directory of the transactions files
+    :type output_dir: str
+    :param extension: Format of the transactions files, csv or parquet
+    :type extension: str
+    :param workers: Number of threads fetching windows
+    :type workers: int
+    :param batch_size: Number of windows sent in one JSON-RPC batch
+    :type batch_size: int
+    :return: path of the transactions file of every contract, by address
+    :rtype: dict
+    """
+    addresses = [contract.address for contract in contracts]
+    by_address = {contract.address.lower(): contract for contract in contracts}
+    # ERC20 and ERC721 contracts share the Transfer event, the filter is built from the first one
+    event = contracts[0].to_token_contract().events.Transfer
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = transactions_paths(contracts, output_dir, extension)
+    writers = {
+        contract.address.lower(): open_transfer_writer(paths[contract.address], erc721=contract.erc721)
+        for contract in contracts
+    }
+
+    # the contracts share one remembered range, in the ranges file of the first one
+    window = AdaptiveBlockRange(",".join(sorted(by_address)), block_range, path=contracts[0].ranges_path)
+    ranges = split_range(from_block, to_block, window.block_range)
+    print("Scanning {} windows for {} contracts".format(len(ranges), len(contracts)))
+
+    if batch_size > 1:
+        fetched = fetch_ranges(
+            lambda batch: fetch_logs_batch(event, batch, addresses, window),
+            group_ranges(ranges, batch_size),
+            workers=workers
+        )
+        fetched = (logs for batch in fetched for logs in batch)
+    else:
+        fetched = fetch_ranges(
+            lambda range_: fetch_logs(event, range_[0], range_[1], addresses, window),
+            ranges,
+            workers=workers
+        )
+
+    counts = dict.fromkeys(by_address, 0)
+    try:
+        for logs in fetched:
+            # demultiplex by the address that emitted the log
+            demultiplexed = {}
+            for log in logs:
+                demultiplexed.setdefault(log['address'].lower(), []).append(log)
+
+            for address, contract_logs in demultiplexed.items():
+                if address not in by_address:
+                    continue
+                events = decode_window(contract_logs, by_address[address].erc721)
+                writers[address].write(events)
+                counts[address] += len(events)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    window.save()
+
+    for address, count in counts.items():
+        print("Stored {} transfer events of {}".format(count, by_address[address].address))
+
+    return paths
@@ -0,0 +1,165 @@
+"""
+Contains the ordering stage of the transactions.
+Transfers have to be applied in (block number, log index) order.
+do_record_transactions writes windows that are each in order,
+so instead of sorting the whole file the windows are found and read in order.
+Files that are not made of such windows are sorted with an external merge sort
+"""
+
+import heapq
+import os
+import tempfile
+from app.parquet import is_parquet, find_parquet_runs, read_parquet_runs
+from app.metrics import METRICS
+
+# number of rows sorted in memory at once by the external merge sort
+MEMORY_ROWS = 1000000
+
+
+def sort_key(row):
+    """
+    Position of a transfer in the chain
+    Rows of files without a log index are kept in file order within a block
+    :param row: row of a transactions file
+    :type row: list
+    :return: (block number, log index)
+    :type: tuple(int, int)
+    """
+    log_index = row[4] if len(row) > 4 and row[4] != '' else 0
+    return int(row[3]), int(log_index)
+
+
+def parse_line(line):
+    """
+    Parses a line of a transactions csv file,
+    fields of transactions files never contain commas or quotes
+    """
+    return line.decode().rstrip('\r\n').split(',')
+
+
+def find_runs(path):
+    """
+    Finds the runs of a csv transactions file: consecutive rows in (block, log index) order
+    :param path: Path to the csv file
+    :type path: str
+    :return: (first key, last key, start offset, end offset) of every run
+    :type: list(tuple)
+    """
+    runs = []
+
+    with open(path, "rb") as transactions:
+        transactions.readline()
+        start = transactions.tell()
+        first = last = None
+
+        while True:
+            line = transactions.readline()
+            if not line.strip():
+                break
+
+            key = sort_key(parse_line(line))
+            if last is not None and key < last:
+                end = transactions.tell() - len(line)
+                runs.append((first, last, start, end))
+                first, start = key, end
+            elif first is None:
+                first = key
+            last = key
+
+        if first is not None:
+            runs.append((first, last, start, transactions.tell()))
+
+    return runs
+
+
+def read_run(path, start, end):
+    """
+    Reads the rows between two offsets of a csv file
+    """
+    with open(path, "rb") as transactions:
+        transactions.seek(start)
+        while transactions.tell() < end:
+            line = transactions.readline()
+            if not line.strip():
+                break
+            yield parse_line(line)
+
+
+def external_sort(rows, memory_rows=MEMORY_ROWS):
+    """
+    Sorts rows that may not fit in memory:
+    chunks of memory_rows rows are sorted and spilled to temporary files,
+    which are then merged
+    :param rows: rows to sort
+    :type rows: iterable(list)
+    :param memory_rows: Number of rows sorted in memory at once
+    :type memory_rows: int
+    :return: rows in (block, log index) order
+    :type: generator(list)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        chunks = []
+        chunk = []
+
+        def spill():
+            path = os.path.join(directory, "{}.csv".format(len(chunks)))
+            with METRICS.timer('sort_seconds'), open(path, "wb") as spilled:
+                for row in sorted(chunk, key=sort_key):
+                    spilled.write(",".join(str(field) for field in row).encode() + b"\n")
+            METRICS.count('rows_sorted', len(chunk))
+            chunks.append(path)
+
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= memory_rows:
+                spill()
+                chunk = []
+
+        if not chunks:
+            with METRICS.timer('sort_seconds'):
+                chunk.sort(key=sort_key)
+            METRICS.count('rows_sorted', len(chunk))
+            yield from chunk
+            return
+
+        if chunk:
+            spill()
+
+        # merge is stable, ties keep the order of the chunks
+        yield from heapq.merge(
+            *[read_run(path, 0, os.path.getsize(path)) for path in chunks],
+            key=sort_key
+        )
+
+
+def ordered_rows(path, erc721=False, memory_rows=MEMORY_ROWS):
+    """
+    Reads a transactions file in (block number, log index) order, without the header row.
+    Windows that do not overlap are read one after the other,
+    anything else is sorted with an external merge sort
+    :param path: Path to the transactions file, csv or .parquet
+    :type path: str
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :param memory_rows: Number of rows sorted in memory at once
+    :type memory_rows: int
+    :return: rows
+    :type: generator(list)
+    """
+    if is_parquet(path):
+        runs = sorted(find_parquet_runs(path))
+    else:
+        runs = sorted(find_runs(path))
+    overlapping = any(runs[i][1] > runs[i + 1][0] for i in range(len(runs) - 1))
+
+    def read(runs):
+        if is_parquet(path):
+            return read_parquet_runs(path, runs)
+        return (row for _, _, start, end in runs for row in read_run(path, start, end))
+
+    if not overlapping:
+        yield from read(runs)
+        return
+
+    print("Transactions are not in block order, sorting {}".format(path))
+    yield from external_sort(read(runs), memory_rows)
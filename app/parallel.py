@@ -0,0 +1,73 @@
+"""
+Contains functions for fetching block ranges concurrently
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def split_range(from_block, to_block, block_range, limit=None):
+    """
+    Splits a block range into consecutive windows
+    :param from_block: First block of the range
+    :type from_block: int
+    :param to_block: Last block of the range
+    :type to_block: int
+    :param block_range: Number of blocks in one window
+    :type block_range: int
+    :param limit: Maximum number of windows to return, starting from from_block
+    :type limit: int
+    :return: (from_block, to_block) of every window, in ascending order
+    :type: list(tuple)
+    """
+    block_range = max(int(block_range), 1)
+    if limit is not None:
+        to_block = min(to_block, from_block + block_range * limit - 1)
+    return [
+        (start, min(start + block_range - 1, to_block))
+        for start in range(from_block, to_block + 1, block_range)
+    ]
+
+
+def group_ranges(ranges, size):
+    """
+    Groups consecutive windows, e.g to send them in one batch
+    :param ranges: Windows to group
+    :type ranges: list(tuple)
+    :param size: Number of windows in one group
+    :type size: int
+    :return: Groups of windows, in ascending order
+    :type: list(list(tuple))
+    """
+    size = max(int(size), 1)
+    return [ranges[start:start + size] for start in range(0, len(ranges), size)]
+
+
+def fetch_ranges(fetch, ranges, workers=4):
+    """
+    Calls fetch for every window with a bounded pool of threads
+    Results are yielded in the order of the windows, not in the order they finished.
+    At most workers * 2 windows are in flight or waiting to be consumed
+    :param fetch: Function that takes a window, or a group of windows, and returns a list
+    :type fetch: callable
+    :param ranges: Windows to fetch
+    :type ranges: list
+    :param workers: Number of threads
+    :type workers: int
+    :return: Result of every window
+    :type: generator(list)
+    """
+    if workers <= 1:
+        for window in ranges:
+            yield fetch(window)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for window in ranges:
+            pending.append(executor.submit(fetch, window))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
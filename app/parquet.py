@@ -0,0 +1,272 @@
+"""
+Contains the columnar (Parquet) format of transactions files.
+Addresses are stored as 20 bytes, values and token ids as 32 bytes big endian,
+so uint256 values are stored lossless and sort like the integers they encode.
+pyarrow is optional, it is only needed for .parquet files,
+and it is imported by the first function that reads or writes one
+"""
+
+import importlib.util
+
+# pyarrow modules, set by require_pyarrow
+pa = None
+pq = None
+
+# number of events in one row group
+CHUNK_SIZE = 100000
+
+
+def is_parquet(path):
+    """
+    Checks if the file at path is a Parquet file
+    :param path: path to the file
+    :type path: str
+    :return: whether the file is a Parquet file
+    :type: bool
+    """
+    return path is not None and path.endswith('.parquet')
+
+
+def has_pyarrow():
+    """
+    Checks if pyarrow is installed, without importing it
+    :type: bool
+    """
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def require_pyarrow():
+    """
+    Imports pyarrow, raises an ImportError if it is not installed
+    :return: the pyarrow and pyarrow.parquet modules
+    :type: tuple
+    """
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required for .parquet files, install it with `pip install pyarrow`")
+        pa, pq = pyarrow, pyarrow.parquet
+    return pa, pq
+
+
+def transfer_schema(erc721=False):
+    """
+    Schema of a transactions table
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :return: pyarrow schema
+    :type: pyarrow.Schema
+    """
+    require_pyarrow()
+    return pa.schema([
+        ('from', pa.binary(20)),
+        ('to', pa.binary(20)),
+        ('value' if not erc721 else 'tokenId', pa.binary(32)),
+        ('block_number', pa.int64()),
+        ('log_index', pa.int32()),
+        ('transaction_index', pa.int32()),
+    ])
+
+
+def address_to_bytes(address):
+    """
+    Converts a hex address to 20 bytes
+    """
+    return bytes.fromhex(address[2:])
+
+
+def uint256_to_bytes(value):
+    """
+    Converts an uint256 to 32 bytes big endian
+    """
+    return int(value).to_bytes(32, 'big')
+
+
+class ParquetTransferWriter:
+
+    """
+    Writes Transfer events to a Parquet file, one row group per chunk.
+    Same interface as CSVTransferWriter, but it can not append to an existing file
+    and the file is only readable after it is closed
+    :param path: Path to the Parquet file
+    :type path: str
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :param chunk_size: Number of events in one row group
+    :type chunk_size: int
+    """
+    def __init__(self, path, erc721=False, chunk_size=CHUNK_SIZE, append=False):
+        if append:
+            raise ValueError("Parquet files can not be appended to: {}".format(path))
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.schema = transfer_schema(erc721)
+        self.value_column = self.schema.names[2]
+        self.buffer = []
+        self.count = 0
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, events):
+        """
+        Buffers the events, writes a row group once the buffer is full
+        :param events: Decoded Transfer events
+        :type events: iterable(dict)
+        """
+        for event in events:
+            self.buffer.append(event)
+            if len(self.buffer) >= self.chunk_size:
+                self.flush()
+
+    def flush(self, sync=False):
+        """
+        Writes the buffered events as a row group
+        """
+        if not self.buffer:
+            return
+
+        table = pa.table({
+            'from': [address_to_bytes(event['from']) for event in self.buffer],
+            'to': [address_to_bytes(event['to']) for event in self.buffer],
+            self.value_column: [uint256_to_bytes(event[self.value_column]) for event in self.buffer],
+            'block_number': [event['block_number'] for event in self.buffer],
+            'log_index': [event.get('log_index', 0) for event in self.buffer],
+            'transaction_index': [event.get('transaction_index', 0) for event in self.buffer],
+        }, schema=self.schema)
+
+        self.writer.write_table(table)
+        self.count += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        """
+        Writes the remaining events and the footer of the file
+        """
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_parquet_transactions(path, columns=None):
+    """
+    Reads the columns of a Parquet transactions file
+    :param path: Path to the Parquet file
+    :type path: str
+    :param columns: Columns to read, all by default
+    :type columns: list(str)
+    :return: transactions table
+    :type: pyarrow.Table
+    """
+    require_pyarrow()
+    return pq.read_table(path, columns=columns)
+
+
+def address_converter():
+    """
+    Checksums raw addresses, once per unique address
+    :return: function from 20 bytes to a checksummed address
+    :type: callable
+    """
+    import eth_utils
+
+    addresses = {}
+
+    def to_address(raw):
+        if raw not in addresses:
+            addresses[raw] = eth_utils.to_checksum_address(raw)
+        return addresses[raw]
+
+    return to_address
+
+
+def batch_rows(batch, to_address):
+    """
+    Rows of a batch of a Parquet transactions file, strings like the csv reader returns them
+    for ERC20 and ERC721 transfers alike
+    """
+    for row in zip(*[column.to_pylist() for column in batch.columns]):
+        yield [
+            to_address(row[0]),
+            to_address(row[1]),
+            str(int.from_bytes(row[2], 'big')),
+        ] + [str(field) for field in row[3:]]
+
+
+def iter_parquet_rows(path, erc721=False, batch_size=CHUNK_SIZE):
+    """
+    Reads a Parquet transactions file as rows like the csv reader returns them:
+    [from, to, value or token id, block number, log index, transaction index] as strings,
+    without the header row.
+    Addresses are checksummed once per unique address
+    :param path: Path to the Parquet file
+    :type path: str
+    :param erc721: Whether the transfers are ERC721 transfers, their rows have the same types
+    :type erc721: bool
+    :param batch_size: Number of rows read at once
+    :type batch_size: int
+    :return: rows
+    :type: generator(list)
+    """
+    require_pyarrow()
+    to_address = address_converter()
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from batch_rows(batch, to_address)
+
+
+def find_parquet_runs(path):
+    """
+    Finds the runs of a Parquet transactions file: consecutive rows in (block, log index) order.
+    Only the block number and log index columns are read, one row group at a time
+    :param path: Path to the Parquet file
+    :type path: str
+    :return: (first key, last key, row group, start row, end row) of every run
+    :type: list(tuple)
+    """
+    require_pyarrow()
+    parquet_file = pq.ParquetFile(path)
+    runs = []
+
+    for row_group in range(parquet_file.num_row_groups):
+        table = parquet_file.read_row_group(row_group, columns=['block_number', 'log_index'])
+        keys = list(zip(table.column('block_number').to_pylist(), table.column('log_index').to_pylist()))
+
+        start = 0
+        for position in range(1, len(keys)):
+            if keys[position] < keys[position - 1]:
+                runs.append((keys[start], keys[position - 1], row_group, start, position))
+                start = position
+        if keys:
+            runs.append((keys[start], keys[-1], row_group, start, len(keys)))
+
+    return runs
+
+
+def read_parquet_runs(path, runs):
+    """
+    Reads runs found by find_parquet_runs, one after the other,
+    a row group is read once for consecutive runs of it
+    :param path: Path to the Parquet file
+    :type path: str
+    :param runs: (first key, last key, row group, start row, end row) of the runs to read
+    :type runs: iterable(tuple)
+    :return: rows
+    :type: generator(list)
+    """
+    require_pyarrow()
+    parquet_file = pq.ParquetFile(path)
+    to_address = address_converter()
+    read_group, table = None, None
+
+    for _, _, row_group, start, end in runs:
+        if row_group != read_group:
+            read_group, table = row_group, parquet_file.read_row_group(row_group)
+        yield from batch_rows(table.slice(start, end - start), to_address)
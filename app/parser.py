@@ -19,10 +19,58 @@ parser.add_option("-c", "--erc721", dest="erc721",
                   help="Contract is ERC721", metavar="ERC721")
 
 parser.add_option("-i", "--infile", dest="infile",
-                  help="Input file", metavar="INFILE")
+                  help="Input file, .parquet files are read as Parquet, the directory of the transactions files with a manifest", metavar="INFILE")
 
 parser.add_option("-o", "--outfile", dest="outfile",
-                  help="Output file", metavar="OUTFILE")
+                  help="Output file, .parquet files are written as Parquet, the directory of the output files with a manifest", metavar="OUTFILE")
 
 parser.add_option("-r", "--blockrange", dest="blockrange",
-                  help="Block range", metavar="BLOCKRANGE")
+                  help="Block range, replaces the range remembered for the contract", metavar="BLOCKRANGE")
+
+parser.add_option("-f", "--fromblock", dest="fromblock",
+                  help="Block to start extracting events from", metavar="FROMBLOCK")
+
+parser.add_option("-w", "--workers", dest="workers",
+                  help="Number of concurrent eth_getLogs requests", metavar="WORKERS")
+
+parser.add_option("-b", "--batchsize", dest="batchsize",
+                  help="Number of eth_getLogs windows in one JSON-RPC batch", metavar="BATCHSIZE")
+
+parser.add_option("-y", "--sync", dest="sync", action="store_true", default=False,
+                  help="Only fetch blocks after the last synced block and update holders incrementally")
+
+parser.add_option("-m", "--manifest", dest="manifest",
+                  help="Json list of contracts to extract with one scan, like test-contracts.json", metavar="MANIFEST")
+
+parser.add_option("-d", "--store", dest="store",
+                  help="SQLite event store to add the transactions to", metavar="STORE")
+
+parser.add_option("-t", "--atblock", dest="atblock",
+                  help="Block to get the holders at, from the nearest balance checkpoint", metavar="ATBLOCK")
+
+parser.add_option("-l", "--follow", dest="follow", action="store_true", default=False,
+                  help="After syncing, follow new blocks and keep the holders file current")
+
+parser.add_option("-k", "--cache", dest="cache",
+                  help="SQLite file caching eth_getLogs responses of final blocks", metavar="CACHE")
+
+parser.add_option("-q", "--rate", dest="rate",
+                  help="Most requests per second sent to the node", metavar="RATE")
+
+parser.add_option("-e", "--hedge", dest="hedge", action="store_true", default=False,
+                  help="Send eth_getLogs slower than the p95 latency to a second RPC url too")
+
+parser.add_option("-g", "--fullhistory", dest="fullhistory", action="store_true", default=False,
+                  help="Fetch every block from the deployment of the contract, found with eth_getCode")
+
+parser.add_option("-u", "--watchlist", dest="watchlist",
+                  help="File of addresses, only their transfers are fetched and their holdings written", metavar="WATCHLIST")
+
+parser.add_option("-x", "--metrics", dest="metrics",
+                  help="Json file the timers and counters of every stage are written to at the end", metavar="METRICS")
+
+parser.add_option("-p", "--metricsport", dest="metricsport",
+                  help="Port serving the metrics in the Prometheus text format on /metrics", metavar="METRICSPORT")
+
+parser.add_option("-v", "--serve", dest="serve",
+                  help="After syncing, serve balance and ownership queries over HTTP on this port", metavar="SERVE")
@@ -0,0 +1,217 @@
+"""
+Contains the provider pool that spreads requests across several RPC endpoints.
+Every request goes to the endpoint with the lowest expected wait:
+its average latency, times the requests it already has in flight,
+weighted up by its recent error rate.
+Endpoints that fail several times in a row are left out for a while.
+With hedging, an eth_getLogs that is still running after the p95 latency
+is sent to a second endpoint too, and the first answer wins.
+The pool sits under the request scheduler, so the second request takes
+its own token from the rate limit of the scheduler
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from web3.providers.base import BaseProvider
+from app.scheduler import is_retryable
+
+# weight of the last request in the average latency
+LATENCY_WEIGHT = 0.2
+
+# failures in a row after which an endpoint is left out
+MAX_FAILURES = 3
+
+# seconds an unhealthy endpoint is left out
+COOLDOWN = 30
+
+# eth_getLogs latencies kept to compute the hedging delay
+LATENCY_SAMPLES = 200
+
+# eth_getLogs calls measured before hedging starts
+MIN_HEDGE_SAMPLES = 20
+
+# methods that are hedged
+HEDGED_METHODS = ('eth_getLogs',)
+
+
+class Endpoint:
+
+    """
+    An RPC endpoint of the pool and its health
+    :param provider: Provider of the endpoint
+    :type provider: BaseProvider
+    :param name: Name shown in the logs
+    :type name: str
+    """
+    def __init__(self, provider, name=None):
+        self.provider = provider
+        self.name = name if name else getattr(provider, 'endpoint_uri', repr(provider))
+        self.latency = None
+        self.in_flight = 0
+        self.failures = 0
+        # recent outcomes, 1 for an error
+        self.errors = deque(maxlen=50)
+        self.down_until = 0
+        self.requests = 0
+
+    def error_rate(self):
+        return sum(self.errors) / len(self.errors) if self.errors else 0
+
+    def expected_wait(self):
+        """
+        Expected time until a new request to the endpoint is answered,
+        endpoints that were never measured go first
+        """
+        latency = self.latency if self.latency is not None else 0
+        return latency * (self.in_flight + 1) * (1 + 4 * self.error_rate())
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+    def record(self, latency, failed):
+        """
+        Updates the latency and health of the endpoint after a request
+        """
+        self.errors.append(1 if failed else 0)
+        if failed:
+            self.failures += 1
+            if self.failures >= MAX_FAILURES:
+                print("Leaving out {} for {}s after {} failures".format(self.name, COOLDOWN, self.failures))
+                self.down_until = time.monotonic() + COOLDOWN
+                self.failures = 0
+            return
+
+        self.failures = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_WEIGHT * (latency - self.latency)
+
+
+class ProviderPool(BaseProvider):
+
+    """
+    Provider that spreads the calls across the providers of several endpoints
+    :param providers: Providers of the endpoints
+    :type providers: list(BaseProvider)
+    :param hedge: Whether to send a second eth_getLogs when one passes the p95 latency
+    :type hedge: bool
+    :param bucket: Rate limit the second eth_getLogs takes a token from, the one of the request scheduler
+    :type bucket: app.scheduler.TokenBucket
+    """
+    def __init__(self, providers, hedge=False, bucket=None):
+        self.endpoints = [Endpoint(provider) for provider in providers]
+        self.hedge = hedge
+        self.bucket = bucket
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.endpoints) + 2) if hedge else None
+        self.hedged = 0
+
+    def pick(self, exclude=None):
+        """
+        Picks the endpoint with the lowest expected wait,
+        unhealthy endpoints are only used when all are unhealthy
+        :param exclude: Endpoint not to pick
+        :type exclude: Endpoint
+        :return: endpoint, its in flight count is already increased
+        :type: Endpoint
+        """
+        now = time.monotonic()
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint is not exclude]
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy(now)]
+            if not healthy:
+                healthy = [min(candidates, key=lambda endpoint: endpoint.down_until)]
+
+            # endpoints that were never measured are spread by the requests in flight
+            endpoint = min(healthy, key=lambda endpoint: (endpoint.expected_wait(), endpoint.in_flight))
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def send(self, endpoint, method, send):
+        """
+        Sends a request to an endpoint and records its latency and outcome
+        """
+        start = time.monotonic()
+        failed = True
+        try:
+            response = send(endpoint.provider)
+            if isinstance(response, dict):
+                failed = 'error' in response and is_retryable(response['error'])
+            else:
+                failed = False
+            return response
+        finally:
+            latency = time.monotonic() - start
+            with self.lock:
+                endpoint.in_flight -= 1
+                endpoint.record(latency, failed)
+                if not failed and method in HEDGED_METHODS:
+                    self.latencies.append(latency)
+
+    def hedge_delay(self):
+        """
+        p95 latency of eth_getLogs, None until enough calls are measured
+        """
+        with self.lock:
+            if len(self.latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+    def make_request(self, method, params):
+        def send(provider):
+            return provider.make_request(method, params)
+
+        delay = self.hedge_delay() if self.hedge and method in HEDGED_METHODS else None
+        if delay is None or len(self.endpoints) < 2:
+            return self.send(self.pick(), method, send)
+
+        first = self.pick()
+        pending = {self.executor.submit(self.send, first, method, send)}
+        done, pending = wait(pending, timeout=delay)
+
+        if not done:
+            # still running after the p95 latency, ask another endpoint too
+            if self.bucket is not None:
+                self.bucket.acquire()
+            self.hedged += 1
+            pending.add(self.executor.submit(self.send, self.pick(exclude=first), method, send))
+
+        # the first answer wins, the other request is left to finish
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def make_batch_request(self, calls):
+        def send(provider):
+            if hasattr(provider, 'make_batch_request'):
+                return provider.make_batch_request(calls)
+            return [provider.make_request(method, params) for method, params in calls]
+
+        return self.send(self.pick(), 'batch', send)
+
+    def isConnected(self):
+        return any(endpoint.provider.isConnected() for endpoint in self.endpoints)
+
+    def stats(self):
+        """
+        Requests, average latency and error rate of every endpoint
+        :type: list(dict)
+        """
+        return [{
+            'endpoint': endpoint.name,
+            'requests': endpoint.requests,
+            'latency': endpoint.latency,
+            'error_rate': endpoint.error_rate(),
+        } for endpoint in self.endpoints]
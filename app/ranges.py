@@ -0,0 +1,141 @@
+"""
+Contains the adaptive block range used for querying Transfer events
+"""
+
+import json
+import os
+
+RANGES_FILE = "app/data/block_ranges.json"
+
+# range of contracts with no remembered range, in blocks
+DEFAULT_BLOCK_RANGE = 1000
+
+# bounds of a single eth_getLogs window, in blocks
+MIN_BLOCK_RANGE = 1
+MAX_BLOCK_RANGE = 500000
+
+# providers cap eth_getLogs at 10000 results, aim well below that
+TARGET_EVENTS = 5000
+
+# substrings of the errors providers return when a window is too large
+OVERFLOW_ERRORS = (
+    "more than 10000 results",
+    "query returned more than",
+    "response size exceeded",
+    "block range is too wide",
+    "block range too large",
+    "exceed maximum block range",
+    "query timeout exceeded",
+)
+
+
+def is_overflow_error(error):
+    """
+    Checks if the error is returned because the window had too many events
+    :param error: error raised by the provider
+    :type error: Exception
+    :return: whether the window should be split and retried
+    :type: bool
+    """
+    message = error.args[0] if error.args else error
+    if isinstance(message, dict):
+        message = message.get('message', '')
+    message = str(message).lower()
+    return any(overflow in message for overflow in OVERFLOW_ERRORS)
+
+
+def load_ranges(path=None):
+    """
+    Loads remembered block ranges of all contracts
+    :param path: path to the json file, RANGES_FILE by default
+    :type path: str
+    :return: mapping of contract address to block range
+    :type: dict
+    """
+    path = path if path else RANGES_FILE
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path) as ranges:
+        return json.load(ranges)
+
+
+class AdaptiveBlockRange:
+
+    """
+    Block range that adapts to the density of Transfer events of a contract.
+    Halves the range when the provider rejects a window as too large,
+    doubles it after windows with few events,
+    and remembers the last good range of the contract between runs.
+    A range passed explicitly replaces the remembered one
+    :param address: Address of the contract
+    :type address: str
+    :param block_range: Range to start with, the remembered range or DEFAULT_BLOCK_RANGE by default
+    :type block_range: int
+    :param target: Number of events per window to aim for
+    :type target: int
+    :param path: Path to the json file with remembered ranges, RANGES_FILE by default
+    :type path: str
+    """
+    def __init__(
+        self,
+        address,
+        block_range=None,
+        target=TARGET_EVENTS,
+        min_range=MIN_BLOCK_RANGE,
+        max_range=MAX_BLOCK_RANGE,
+        path=None
+    ):
+        self.address = address
+        self.target = target
+        self.min_range = min_range
+        self.max_range = max_range
+        self.path = path if path else RANGES_FILE
+
+        remembered = load_ranges(self.path).get(address)
+        if block_range:
+            initial = block_range
+        else:
+            initial = remembered if remembered else DEFAULT_BLOCK_RANGE
+        self.block_range = min(max(int(initial), min_range), max_range)
+
+        if block_range and remembered and remembered != self.block_range:
+            self.save()
+
+    def shrink(self, span=None):
+        """
+        Halves the range after a window overflowed
+        :param span: Number of blocks in the window that overflowed
+        :type span: int
+        :return: whether the range could be shrunk
+        :type: bool
+        """
+        span = span if span is not None else self.block_range
+        if span <= self.min_range:
+            return False
+
+        self.block_range = max(span // 2, self.min_range)
+        return True
+
+    def update(self, events_count):
+        """
+        Grows the range after a sparse window
+        :param events_count: Number of events in the last window
+        :type events_count: int
+        """
+        if events_count < self.target // 2:
+            self.block_range = min(self.block_range * 2, self.max_range)
+
+    def save(self):
+        """
+        Remembers the current range of the contract
+        """
+        ranges = load_ranges(self.path)
+        ranges[self.address] = self.block_range
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path, "w") as output:
+            json.dump(ranges, output, indent=4)
@@ -0,0 +1,260 @@
+"""
+Contains the request scheduler in front of the node.
+Requests are paced by a token bucket, so a run can go at the full rate the provider allows.
+Timeouts, connection errors, HTTP 429 and 5xx and rate limit errors are retried
+with jittered exponential backoff, when the retries run out the request fails
+with RetriesExhausted instead of being dropped.
+Errors of windows with too many events are not retried, they are split by the callers
+"""
+
+import random
+import threading
+import time
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+from web3.providers.base import BaseProvider
+from app.ranges import is_overflow_error
+from app.metrics import METRICS
+
+# retries of a request before it fails
+RETRIES = 6
+
+# seconds of the first backoff, doubled after every retry
+BACKOFF = 0.5
+
+# seconds of the longest backoff
+MAX_BACKOFF = 30
+
+# HTTP status codes that are retried
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# substrings of the JSON-RPC errors that are retried
+RETRY_ERRORS = (
+    "rate limit",
+    "request rate exceeded",
+    "too many requests",
+    "capacity exceeded",
+    "timeout",
+    "timed out",
+    "header not found",
+    "internal error",
+    "service unavailable",
+)
+
+
+class RetriesExhausted(Exception):
+
+    """
+    Raised when a request still fails after all its retries
+    :param method: JSON-RPC method of the request
+    :type method: str
+    :param error: Last error of the request
+    :type error: Exception or dict
+    :param retries: Retries of the request
+    :type retries: int
+    """
+    def __init__(self, method, error, retries=RETRIES):
+        super().__init__("{} failed after {} retries: {}".format(method, retries, error))
+        self.method = method
+        self.error = error
+
+
+def is_retryable(error):
+    """
+    Checks if a failed request can succeed when it is sent again
+    :param error: exception raised by the provider, or error of a JSON-RPC response
+    :type error: Exception or dict
+    :return: whether to retry the request
+    :type: bool
+    """
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    if isinstance(error, HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUS
+    if isinstance(error, dict):
+        if is_overflow_error(ValueError(error)):
+            return False
+        message = str(error.get('message', '')).lower()
+        return error.get('code') == 429 or any(retry in message for retry in RETRY_ERRORS)
+    return False
+
+
+class TokenBucket:
+
+    """
+    Token bucket rate limit, shared by all threads
+    :param rate: Tokens added per second, no limit if None
+    :type rate: float
+    :param burst: Most tokens the bucket holds
+    :type burst: int
+    """
+    def __init__(self, rate=None, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst if burst else max(rate or 1, 1)
+        self.tokens = self.burst
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket, waiting until there are enough.
+        Requests larger than the bucket take all of it and wait for the rest
+        """
+        if self.rate is None:
+            return
+
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            # the tokens are reserved, later callers wait behind this one
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            METRICS.observe('rate_limit_wait_seconds', wait)
+            self.sleep(wait)
+
+
+class RequestScheduler:
+
+    """
+    Sends requests through a token bucket and retries the retryable failures
+    :param rate: Requests per second, no limit if None
+    :type rate: float
+    :param burst: Requests sent at once after an idle period
+    :type burst: int
+    :param retries: Retries of a request before it fails
+    :type retries: int
+    :param backoff: Seconds of the first backoff
+    :type backoff: float
+    :param max_backoff: Seconds of the longest backoff
+    :type max_backoff: float
+    """
+    def __init__(
+        self,
+        rate=None,
+        burst=None,
+        retries=RETRIES,
+        backoff=BACKOFF,
+        max_backoff=MAX_BACKOFF,
+        sleep=time.sleep
+    ):
+        self.bucket = TokenBucket(rate, burst, sleep=sleep)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.retried = 0
+
+    def delay(self, attempt):
+        """
+        Jittered exponential backoff before a retry
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, method, send, cost=1):
+        """
+        Sends a request until it succeeds, fails for good or runs out of retries
+        :param method: JSON-RPC method, for the error message
+        :type method: str
+        :param send: Sends the request, returns the JSON-RPC response
+        :type send: callable
+        :param cost: Tokens the request takes
+        :type cost: int
+        :return: JSON-RPC response
+        :type: dict or list
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire(cost)
+            try:
+                response = send()
+                error = response.get('error') if isinstance(response, dict) else None
+            except Exception as exception:
+                if not is_retryable(exception):
+                    raise
+                error = exception
+
+            if error is None or not is_retryable(error):
+                return response
+
+            if attempt >= self.retries:
+                METRICS.count('rpc_failures')
+                raise RetriesExhausted(method, error, self.retries)
+
+            delay = self.delay(attempt)
+            print("{} failed, retrying in {:.2f}s: {}".format(method, delay, error))
+            self.retried += 1
+            METRICS.count('rpc_retries')
+            self.sleep(delay)
+            attempt += 1
+
+
+class ScheduledProvider(BaseProvider):
+
+    """
+    Provider that sends every call of the wrapped provider through a RequestScheduler.
+    Calls of a batch are retried together, and the calls of a batch
+    that fail with a retryable error are sent again in a smaller batch
+    :param provider: Provider to wrap
+    :type provider: BaseProvider
+    :param scheduler: Scheduler of the requests
+    :type scheduler: RequestScheduler
+    """
+    def __init__(self, provider, scheduler):
+        self.provider = provider
+        self.scheduler = scheduler
+        self.middlewares = provider.middlewares
+
+    def make_request(self, method, params):
+        def send():
+            with METRICS.timer('rpc_seconds', method=method):
+                return self.provider.make_request(method, params)
+
+        METRICS.count('rpc_calls', method=method)
+        return self.scheduler.call(method, send)
+
+    def make_batch_request(self, calls):
+        responses = [None] * len(calls)
+        pending = list(range(len(calls)))
+        attempt = 0
+
+        while pending:
+            batch = [calls[position] for position in pending]
+            fetched = self.scheduler.call(
+                "batch of {} calls".format(len(batch)),
+                lambda: self.send_batch(batch),
+                cost=len(batch)
+            )
+
+            retry = []
+            for position, response in zip(pending, fetched):
+                responses[position] = response
+                if 'error' in response and is_retryable(response['error']):
+                    retry.append(position)
+
+            if retry and attempt >= self.scheduler.retries:
+                METRICS.count('rpc_failures')
+                raise RetriesExhausted(calls[retry[0]][0], responses[retry[0]]['error'], attempt)
+            if retry:
+                self.scheduler.retried += 1
+                METRICS.count('rpc_retries')
+                self.scheduler.sleep(self.scheduler.delay(attempt))
+                attempt += 1
+            pending = retry
+
+        return responses
+
+    def send_batch(self, calls):
+        for method, _ in calls:
+            METRICS.count('rpc_calls', method=method)
+
+        with METRICS.timer('rpc_seconds', method='batch'):
+            if hasattr(self.provider, 'make_batch_request'):
+                return self.provider.make_batch_request(calls)
+            return [self.provider.make_request(method, params) for method, params in calls]
+
+    def isConnected(self):
+        return self.provider.isConnected()
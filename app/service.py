@@ -0,0 +1,239 @@
+"""
+Contains the holder query service: the holders of a synced contract are loaded once,
+kept in memory by a follower, and served over HTTP as json:
+- /balance/<address>: ERC20 balance of an address
+- /owner/<token id>: ERC721 owner of a token
+- /tokens/<address>: ERC721 tokens of an address
+- /top?n=10: largest holders, by balance or by number of tokens
+- /status: last applied block and number of holders
+Balances are read from the address index of the follower state and owners
+from its token index, so lookups cost O(1). The ranking of the largest holders
+is computed once after every refresh that changed the holders.
+The follower applies the transfers of new blocks, rolling back reorgs,
+so the state is refreshed incrementally instead of recomputed
+"""
+
+import heapq
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from app.follow import POLL_INTERVAL
+from app.metrics import METRICS
+
+# holders returned by /top without n
+TOP_HOLDERS = 10
+
+# most holders /top returns, the ranking keeps only them
+MAX_TOP_HOLDERS = 1000
+
+# first part of the paths that are answered, the route label of the query timer
+ROUTES = ('balance', 'owner', 'tokens', 'top', 'status')
+
+
+def normalize_address(address):
+    """
+    Checksummed address of a hex address in any case
+    :param address: 0x prefixed hex address
+    :type address: str
+    :return: checksummed address
+    :type: str
+    """
+    from app.utils import checksum_address
+
+    if len(address) != 42 or not address.startswith('0x'):
+        raise ValueError("Not an address: {}".format(address))
+    return checksum_address(bytes.fromhex(address[2:]))
+
+
+class HolderService:
+
+    """
+    Holders of a contract answering queries while they are refreshed.
+    Queries take the lock of the follower, which it only holds while it applies
+    the transfers it read from the chain, a query never sees half a block
+    :param follower: Follower keeping the holders, from the last synced block
+    :type follower: app.follow.Follower
+    """
+    def __init__(self, follower):
+        self.follower = follower
+        self.erc721 = follower.erc721
+        self.ranking = None
+
+    @property
+    def state(self):
+        return self.follower.state
+
+    @property
+    def lock(self):
+        return self.follower.lock
+
+    def invalidate(self, follower=None):
+        """
+        Drops the ranking after the holders changed, the next top query computes it again
+        :param follower: Follower that changed the holders, passed by Follower.run
+        :type follower: app.follow.Follower
+        """
+        with self.lock:
+            self.ranking = None
+
+    def refresh(self):
+        """
+        Applies the transfers of the blocks added since the last refresh
+        :return: number of transfers applied
+        :type: int
+        """
+        count = self.follower.poll()
+        if count or self.follower.rolled_back:
+            self.invalidate()
+        return count
+
+    def replace(self, follower):
+        """
+        Serves the holders of another follower, after the transactions were synced again
+        :param follower: Follower keeping the holders
+        :type follower: app.follow.Follower
+        """
+        with self.lock:
+            self.follower = follower
+            self.ranking = None
+
+    def run(self, poll_interval=POLL_INTERVAL, polls=None):
+        """
+        Refreshes the holders until interrupted, or polls times
+        :param poll_interval: Seconds between two refreshes
+        :type poll_interval: float
+        :param polls: Number of refreshes, forever by default
+        :type polls: int
+        """
+        self.follower.run(poll_interval=poll_interval, on_update=self.invalidate, polls=polls)
+
+    def balance_of(self, address):
+        """
+        Balance of an ERC20 holder, 0 for unknown addresses
+        """
+        with self.lock:
+            return self.state.balances.get(address, 0)
+
+    def owner_of(self, token_id):
+        """
+        Owner of an ERC721 token, None if the token was never transferred
+        """
+        with self.lock:
+            return self.state.index.owner_of(token_id)
+
+    def tokens_of(self, address):
+        """
+        Token ids owned by an ERC721 holder
+        """
+        with self.lock:
+            return self.state.index.tokens_of(address)
+
+    def top(self, n=TOP_HOLDERS):
+        """
+        Largest holders, by balance or by number of tokens
+        :param n: Number of holders, at most MAX_TOP_HOLDERS
+        :type n: int
+        :return: (address, balance or number of tokens), largest first
+        :type: list(tuple)
+        """
+        with self.lock:
+            if self.ranking is None:
+                if self.erc721:
+                    amounts = ((address, len(tokens)) for address, tokens in self.state.index.tokens.items() if tokens)
+                else:
+                    amounts = ((address, balance) for address, balance in self.state.balances.items() if balance > 0)
+                # ties keep the order the holders were first seen in
+                self.ranking = heapq.nlargest(MAX_TOP_HOLDERS, amounts, key=lambda amount: amount[1])
+            return self.ranking[:max(min(n, MAX_TOP_HOLDERS), 0)]
+
+    def status(self):
+        """
+        Last applied block, head of the chain and number of holders
+        :type: dict
+        """
+        with self.lock:
+            holders = self.state.index.tokens if self.erc721 else self.state.balances
+            return {
+                'address': self.follower.address,
+                'erc721': self.erc721,
+                'synced_to': self.follower.synced_to,
+                'head': self.follower.head,
+                'holders': len(holders),
+                'refreshed': self.follower.polled,
+            }
+
+    def query(self, path):
+        """
+        Answers a request path
+        :param path: path and query string of the request
+        :type path: str
+        :return: HTTP status and json body
+        :type: tuple(int, dict)
+        """
+        url = urlsplit(path)
+        parts = [part for part in url.path.split('/') if part]
+        # unknown paths share one label, whatever they are
+        route = parts[0] if parts and parts[0] in ROUTES else 'unknown'
+
+        with METRICS.timer('query_seconds', route=route):
+            if route == 'status' and len(parts) == 1:
+                return 200, self.status()
+
+            if route == 'top' and len(parts) == 1:
+                n = int(parse_qs(url.query).get('n', [TOP_HOLDERS])[0])
+                field = 'tokens' if self.erc721 else 'balance'
+                return 200, {'holders': [
+                    {'address': address, field: str(amount) if not self.erc721 else amount}
+                    for address, amount in self.top(n)
+                ]}
+
+            if route == 'balance' and len(parts) == 2 and not self.erc721:
+                address = normalize_address(parts[1])
+                # balances do not fit in a json number
+                return 200, {'address': address, 'balance': str(self.balance_of(address))}
+
+            if route == 'owner' and len(parts) == 2 and self.erc721:
+                owner = self.owner_of(parts[1])
+                if owner is None:
+                    return 404, {'error': "Unknown token: {}".format(parts[1])}
+                return 200, {'tokenId': parts[1], 'owner': owner}
+
+            if route == 'tokens' and len(parts) == 2 and self.erc721:
+                address = normalize_address(parts[1])
+                return 200, {'address': address, 'tokens': self.tokens_of(address)}
+
+        return 404, {'error': "Unknown path: {}".format(url.path)}
+
+
+def serve_holders(service, port, host=''):
+    """
+    Serves the queries of a holder service, from a daemon thread
+    :param service: Holders to serve
+    :type service: HolderService
+    :param port: Port to listen on, 0 picks a free port
+    :type port: int
+    :return: server, its port is server.server_address[1]
+    :type: ThreadingHTTPServer
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            try:
+                status, body = service.query(self.path)
+            except ValueError as error:
+                status, body = 400, {'error': str(error)}
+
+            body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Serving holders on port {}".format(server.server_address[1]))
+    return server
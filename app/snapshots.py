@@ -0,0 +1,259 @@
+"""
+Contains point-in-time snapshots of the holders.
+While the transactions are replayed in block order, the full balances (or token owners)
+are saved every interval blocks next to the transactions file.
+The holders as of a block are the nearest earlier checkpoint
+plus the transfers between the checkpoint and the block.
+Checkpoints of csv files written in block order also keep the byte offset
+the next transfer starts at, so only the delta is read from the file
+"""
+
+import json
+import os
+from app.holders import BalanceAggregator, OwnerIndex
+from app.ordering import sort_key, parse_line, find_runs, ordered_rows
+from app.parquet import is_parquet
+
+# blocks between two checkpoints
+CHECKPOINT_INTERVAL = 100000
+
+# number of ERC20 transfers aggregated at once
+BATCH_SIZE = 100000
+
+
+def read_positions(path, start, end):
+    """
+    Reads the rows between two offsets of a csv file,
+    with the offset every row starts at
+    :return: (offset, row) of every row
+    :type: generator(tuple)
+    """
+    with open(path, "rb") as transactions:
+        transactions.seek(start)
+        while transactions.tell() < end:
+            offset = transactions.tell()
+            line = transactions.readline()
+            if not line.strip():
+                break
+            yield offset, parse_line(line)
+
+
+class Replay:
+
+    """
+    Holders of a contract while transfers are applied in block order
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :param holders: Holders to start from, in the format of the holders csv file
+    :type holders: dict
+    """
+    def __init__(self, erc721=False, holders=None):
+        self.erc721 = erc721
+        self.batch = []
+
+        if erc721:
+            self.index = OwnerIndex.from_holders(holders or {})
+        else:
+            balances = {address: holder['balance'] for address, holder in (holders or {}).items()}
+            self.aggregator = BalanceAggregator(balances)
+
+    def apply(self, row):
+        if self.erc721:
+            self.index.transfer(row[0], row[1], str(row[2]))
+            return
+
+        self.batch.append(row)
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.erc721:
+            self.aggregator.add_rows(self.batch)
+            self.batch = []
+
+    def holders(self):
+        """
+        Holders in the format of the holders csv file
+        """
+        self.flush()
+        if self.erc721:
+            return self.index.holders()
+        return self.aggregator.holders()
+
+
+class Checkpoints:
+
+    """
+    Balance checkpoints of a transactions file,
+    saved in the <transactions file>.checkpoints directory.
+    A checkpoint of block b holds the holders after every transfer up to block b
+    :param path: Path to the transactions file, csv or .parquet
+    :type path: str
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :param interval: Blocks between two checkpoints
+    :type interval: int
+    """
+    def __init__(self, path, erc721=False, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.erc721 = erc721
+        self.interval = interval
+        self.directory = "{}.checkpoints".format(path)
+        # block of every checkpoint and the position of the next transfer
+        self.positions = {}
+        self.runs = None
+
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def checkpoint_path(self, block):
+        return os.path.join(self.directory, "{}.json".format(block))
+
+    def source(self):
+        """
+        Identifies the version of the transactions file the checkpoints were built from
+        """
+        status = os.stat(self.path)
+        return {'size': status.st_size, 'mtime': status.st_mtime_ns}
+
+    def load(self):
+        """
+        Loads the checkpoints index
+        :return: whether the checkpoints match the transactions file
+        :type: bool
+        """
+        if not os.path.isfile(self.index_path()):
+            return False
+
+        with open(self.index_path()) as index:
+            index = json.load(index)
+
+        if (
+            index.get('source') != self.source() or
+            index.get('interval') != self.interval or
+            index.get('erc721') != self.erc721
+        ):
+            return False
+
+        self.positions = {int(block): position for block, position in index['positions'].items()}
+        self.runs = index['runs']
+        return True
+
+    def save_checkpoint(self, block, holders):
+        with open(self.checkpoint_path(block), "w") as checkpoint:
+            json.dump(holders, checkpoint)
+
+    def read_checkpoint(self, block):
+        # json keeps the uint256 balances exact
+        with open(self.checkpoint_path(block)) as checkpoint:
+            return json.load(checkpoint)
+
+    def positioned_rows(self, run=0, offset=None):
+        """
+        Reads the transfers in block order with their position in the file,
+        starting at a position.
+        Positions are (run, offset) for csv files written in block order, None otherwise
+        :return: (position, row) of every transfer
+        :type: generator(tuple)
+        """
+        if self.runs is None:
+            for row in ordered_rows(self.path, erc721=self.erc721):
+                yield None, row
+            return
+
+        for number in range(run, len(self.runs)):
+            start, end = self.runs[number]
+            if number == run and offset is not None:
+                start = offset
+            for row_offset, row in read_positions(self.path, start, end):
+                yield (number, row_offset), row
+
+    def build(self):
+        """
+        Replays the whole transactions file and saves a checkpoint every interval blocks
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+        self.runs = None
+        self.positions = {}
+
+        if not is_parquet(self.path):
+            runs = sorted(find_runs(self.path))
+            if all(runs[i][1] <= runs[i + 1][0] for i in range(len(runs) - 1)):
+                self.runs = [[start, end] for _, _, start, end in runs]
+
+        print("Building checkpoints of {} every {} blocks".format(self.path, self.interval))
+        replay = Replay(self.erc721)
+        next_block = None
+
+        for position, row in self.positioned_rows():
+            block = sort_key(row)[0]
+            if next_block is None:
+                next_block = block - block % self.interval + self.interval - 1
+
+            if block > next_block:
+                # every transfer before the row is applied, blocks without transfers
+                # share the checkpoint of the last interval before the row
+                next_block = block - block % self.interval - 1
+                self.save_checkpoint(next_block, replay.holders())
+                self.positions[next_block] = position
+                next_block += self.interval
+
+            replay.apply(row)
+
+        if next_block is not None:
+            self.save_checkpoint(next_block, replay.holders())
+            self.positions[next_block] = None
+
+        with open(self.index_path(), "w") as index:
+            json.dump({
+                'source': self.source(),
+                'interval': self.interval,
+                'erc721': self.erc721,
+                'runs': self.runs,
+                'positions': self.positions,
+            }, index, indent=4)
+
+        print("Saved {} checkpoints".format(len(self.positions)))
+
+    def holders_at(self, block):
+        """
+        Holders after every transfer up to block,
+        checkpoints are built first if they are missing or out of date
+        :param block: Block of the snapshot
+        :type block: int
+        :return: holders by address
+        :type: dict
+        """
+        if not self.load():
+            self.build()
+
+        earlier = [checkpoint for checkpoint in self.positions if checkpoint <= block]
+        if not earlier:
+            replay = Replay(self.erc721)
+            rows = self.positioned_rows()
+        else:
+            checkpoint = max(earlier)
+            replay = Replay(self.erc721, self.read_checkpoint(checkpoint))
+            position = self.positions[checkpoint]
+
+            if position is None and checkpoint == max(self.positions):
+                # the last checkpoint is after every transfer
+                return replay.holders()
+            if position is None:
+                # files that are not in block order are read again, only the delta is applied
+                rows = (
+                    (None, row) for _, row in self.positioned_rows()
+                    if sort_key(row)[0] > checkpoint
+                )
+            else:
+                rows = self.positioned_rows(position[0], position[1])
+
+        for _, row in rows:
+            if sort_key(row)[0] > block:
+                break
+            replay.apply(row)
+
+        return replay.holders()
@@ -0,0 +1,210 @@
+"""
+Contains the holder statistics, computed in one pass while the holders are written.
+Memory is bounded: the largest holders are kept in a heap,
+and the distribution in a log-linear histogram with a bucket for every
+number of digits and first two digits of a balance, so a bucket spans at most 10%.
+Holder count, total and top shares are exact,
+the Gini coefficient and the quantiles are computed from the histogram.
+Balances are written as strings in the json summary, uint256 values do not fit in a double,
+the token counts of ERC721 holders are written as numbers.
+Only positive balances are counted, the mints make the zero address negative
+"""
+
+import ast
+import csv
+import heapq
+import json
+import os
+
+# largest holders listed in the summary
+TOP_HOLDERS = 100
+
+# quantiles of the balances in the summary
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def stats_path(holders_path):
+    """
+    Path of the json summary of a holders file
+    :param holders_path: path to the holders file
+    :type holders_path: str
+    :return: path to the summary, next to the holders file
+    :type: str
+    """
+    return "{}_stats.json".format(os.path.splitext(holders_path)[0])
+
+
+def holder_balance(holder):
+    """
+    Balance of a holder of the holders file, the number of tokens for ERC721
+    """
+    if 'balance' in holder:
+        return int(holder['balance'])
+
+    tokens = holder['tokens']
+    if isinstance(tokens, str):
+        tokens = ast.literal_eval(tokens) if tokens else []
+    return len(tokens)
+
+
+class HolderStats:
+
+    """
+    Streaming statistics of the holders
+    :param top: Number of largest holders kept
+    :type top: int
+    :param erc721: Whether the holders hold ERC721 tokens, their token count is listed instead of a balance
+    :type erc721: bool
+    """
+    def __init__(self, top=TOP_HOLDERS, erc721=False):
+        self.top = top
+        self.erc721 = erc721
+        self.holders = 0
+        self.total = 0
+        # min heap of (balance, address), at least the 10 largest for the top 10 share
+        self.largest = []
+        self.size = max(top, 10)
+        # (digits, first two digits) -> [holders, balance]
+        self.buckets = {}
+
+    def add(self, address, balance):
+        """
+        Counts a holder
+        :param address: address of the holder
+        :type address: str
+        :param balance: balance, or number of tokens
+        :type balance: int
+        """
+        if balance <= 0:
+            return
+
+        self.holders += 1
+        self.total += balance
+
+        if len(self.largest) < self.size:
+            heapq.heappush(self.largest, (balance, address))
+        elif balance > self.largest[0][0]:
+            heapq.heapreplace(self.largest, (balance, address))
+
+        digits = str(balance)
+        bucket = self.buckets.setdefault((len(digits), int(digits[:2])), [0, 0])
+        bucket[0] += 1
+        bucket[1] += balance
+
+    def add_holder(self, holder):
+        """
+        Counts a row of the holders file
+        """
+        self.add(holder['address'], holder_balance(holder))
+
+    def top_holders(self, count=None):
+        """
+        Largest holders, largest first
+        :type: list(tuple)
+        """
+        count = self.top if count is None else count
+        return sorted(self.largest, reverse=True)[:count]
+
+    def top_share(self, count=10):
+        """
+        Share of the total held by the largest holders
+        """
+        if not self.total:
+            return 0
+        return sum(balance for balance, _ in self.top_holders(count)) / self.total
+
+    def gini(self):
+        """
+        Gini coefficient of the balances, the holders of a bucket are taken as equal.
+        From the Lorenz curve: 1 - sum of holders share * (cumulative share before + after the bucket)
+        """
+        if not self.total:
+            return 0
+
+        gini = 1
+        cumulative = 0
+        for key in sorted(self.buckets):
+            holders, balance = self.buckets[key]
+            share = cumulative / self.total
+            cumulative += balance
+            gini -= holders / self.holders * (share + cumulative / self.total)
+        return max(gini, 0)
+
+    def quantile(self, q):
+        """
+        Balance below which a share q of the holders are, the average balance of its bucket
+        """
+        rank = q * self.holders
+        seen = 0
+        for key in sorted(self.buckets):
+            holders, balance = self.buckets[key]
+            seen += holders
+            if seen >= rank:
+                return balance // holders
+        return 0
+
+    def histogram(self):
+        """
+        Holders and balance by number of digits of the balance
+        :type: list(dict)
+        """
+        digits = {}
+        for (length, _), (holders, balance) in self.buckets.items():
+            bucket = digits.setdefault(length, [0, 0])
+            bucket[0] += holders
+            bucket[1] += balance
+
+        return [{
+            'min': str(10 ** (length - 1)),
+            'holders': digits[length][0],
+            'balance': str(digits[length][1]),
+        } for length in sorted(digits)]
+
+    def summary(self):
+        """
+        Summary written to the json file
+        :type: dict
+        """
+        return {
+            'holders': self.holders,
+            'total': str(self.total),
+            'top10_share': round(self.top_share(10), 6),
+            'gini': round(self.gini(), 6),
+            'quantiles': {
+                'p{:g}'.format(q * 100): str(self.quantile(q)) for q in QUANTILES
+            },
+            'top': [
+                {'address': address, 'token_count': balance} if self.erc721 else
+                {'address': address, 'balance': str(balance)}
+                for balance, address in self.top_holders()
+            ],
+            'histogram': self.histogram(),
+        }
+
+    def save(self, path):
+        """
+        Writes the summary to a json file
+        """
+        with open(path, "w") as output:
+            json.dump(self.summary(), output, indent=4)
+
+        print("{} holders, Gini {:.4f}, top 10 hold {:.2%}".format(
+            self.holders, self.gini(), self.top_share(10)))
+
+
+def holders_file_stats(path, top=TOP_HOLDERS):
+    """
+    Statistics of an existing holders file, read row by row
+    :param path: path to the holders file
+    :type path: str
+    :param top: Number of largest holders kept
+    :type top: int
+    :return: statistics
+    :type: HolderStats
+    """
+    with open(path) as holders:
+        reader = csv.DictReader(holders)
+        stats = HolderStats(top, erc721='tokens' in (reader.fieldnames or []))
+        for holder in reader:
+            stats.add_holder(holder)
+    return stats
@@ -0,0 +1,271 @@
+"""
+Contains the local event store: an SQLite database of Transfer events
+with a balances table and an owners table that are maintained on ingestion,
+so balance and ownership lookups do not replay the transactions.
+uint256 values do not fit in SQLite integers, they are stored as decimal text,
+balances also keep an approximate REAL amount that orders the holders
+"""
+
+import os
+import sqlite3
+import threading
+from app.holders import BalanceAggregator
+from app.ordering import ordered_rows
+
+STORE_FILE = "app/data/events.sqlite"
+
+# number of transfers inserted in one transaction
+BATCH_SIZE = 50000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfers (
+    contract TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    transaction_index INTEGER NOT NULL,
+    from_address TEXT NOT NULL,
+    to_address TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (contract, block_number, log_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS transfers_from ON transfers (contract, from_address, block_number);
+CREATE INDEX IF NOT EXISTS transfers_to ON transfers (contract, to_address, block_number);
+
+CREATE TABLE IF NOT EXISTS balances (
+    contract TEXT NOT NULL,
+    address TEXT NOT NULL,
+    balance TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (contract, address)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS balances_amount ON balances (contract, amount DESC);
+
+CREATE TABLE IF NOT EXISTS owners (
+    contract TEXT NOT NULL,
+    token_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    PRIMARY KEY (contract, token_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS owners_owner ON owners (contract, owner);
+"""
+
+
+class EventStore:
+
+    """
+    SQLite store of the Transfer events of many contracts.
+    Events have to be ingested in (block number, log index) order,
+    events that are already stored are skipped
+    :param path: Path to the database file
+    :type path: str
+    """
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.connection.close()
+
+    def new_events(self, contract, events):
+        """
+        Drops the events that are already stored
+        """
+        if not events:
+            return []
+
+        blocks = [event['block_number'] for event in events]
+        stored = set(self.connection.execute(
+            "SELECT block_number, log_index FROM transfers "
+            "WHERE contract = ? AND block_number BETWEEN ? AND ?",
+            (contract, min(blocks), max(blocks))
+        ))
+        return [
+            event for event in events
+            if (event['block_number'], event.get('log_index', 0)) not in stored
+        ]
+
+    def ingest(self, contract, events, erc721=False):
+        """
+        Bulk inserts decoded Transfer events and updates the balances or owners
+        :param contract: Address of the contract
+        :type contract: str
+        :param events: Decoded Transfer events, in block order
+        :type events: list(dict)
+        :param erc721: Whether the transfers are ERC721 transfers
+        :type erc721: bool
+        :return: number of events inserted
+        :type: int
+        """
+        value_key = 'tokenId' if erc721 else 'value'
+
+        with self.lock, self.connection:
+            events = self.new_events(contract, events)
+            self.connection.executemany(
+                "INSERT INTO transfers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(
+                    contract,
+                    event['block_number'],
+                    event.get('log_index', 0),
+                    event.get('transaction_index', 0),
+                    event['from'],
+                    event['to'],
+                    str(event[value_key]),
+                ) for event in events]
+            )
+
+            if erc721:
+                self.update_owners(contract, events)
+            else:
+                self.update_balances(contract, events)
+
+        return len(events)
+
+    def update_balances(self, contract, events):
+        if not events:
+            return
+
+        aggregator = BalanceAggregator()
+        aggregator.add_rows([[event['from'], event['to'], event['value']] for event in events])
+
+        addresses = list(aggregator.balances)
+        current = {}
+        for start in range(0, len(addresses), 500):
+            chunk = addresses[start:start + 500]
+            current.update(self.connection.execute(
+                "SELECT address, balance FROM balances WHERE contract = ? AND address IN ({})".format(
+                    ",".join("?" * len(chunk))),
+                [contract] + chunk
+            ))
+
+        rows = []
+        for address, delta in aggregator.balances.items():
+            balance = int(current.get(address, 0)) + delta
+            rows.append((contract, address, str(balance), float(balance)))
+
+        self.connection.executemany("INSERT OR REPLACE INTO balances VALUES (?, ?, ?, ?)", rows)
+
+    def update_owners(self, contract, events):
+        # later transfers of the same token overwrite earlier ones
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO owners VALUES (?, ?, ?)",
+            [(contract, str(event['tokenId']), event['to']) for event in events]
+        )
+
+    def ingest_file(self, contract, path, erc721=False, batch_size=BATCH_SIZE):
+        """
+        Ingests a transactions file, csv or .parquet
+        :param contract: Address of the contract
+        :type contract: str
+        :param path: Path to the transactions file
+        :type path: str
+        :param erc721: Whether the transfers are ERC721 transfers
+        :type erc721: bool
+        :return: number of events inserted
+        :type: int
+        """
+        columns = ['from', 'to', 'tokenId' if erc721 else 'value', 'block_number', 'log_index', 'transaction_index']
+        count = 0
+        batch = []
+        position = (None, 0)
+
+        for row in ordered_rows(path, erc721=erc721):
+            event = dict(zip(columns, row))
+            event['block_number'] = int(event['block_number'])
+            event['transaction_index'] = int(event.get('transaction_index') or 0)
+
+            # files without a log index number the transfers of a block in file order
+            position = (event['block_number'], position[1] + 1 if position[0] == event['block_number'] else 0)
+            event['log_index'] = int(event['log_index']) if event.get('log_index') else position[1]
+            batch.append(event)
+
+            if len(batch) >= batch_size:
+                count += self.ingest(contract, batch, erc721)
+                batch = []
+
+        count += self.ingest(contract, batch, erc721)
+        return count
+
+    def balance_of(self, contract, address):
+        """
+        Balance of an ERC20 holder
+        :return: balance, 0 for unknown addresses
+        :type: int
+        """
+        row = self.connection.execute(
+            "SELECT balance FROM balances WHERE contract = ? AND address = ?", (contract, address)
+        ).fetchone()
+        return int(row[0]) if row else 0
+
+    def holders(self, contract, limit=None):
+        """
+        ERC20 holders with a positive balance, largest first
+        :param limit: Number of holders to return, all by default
+        :type limit: int
+        :return: (address, balance) of every holder
+        :type: list(tuple)
+        """
+        query = "SELECT address, balance FROM balances WHERE contract = ? AND amount > 0"
+        if limit is None:
+            rows = self.connection.execute(query, (contract,))
+        else:
+            # amounts are approximate but never out of order, the holders tied
+            # with the last one kept by the limit are read too so none is cut off
+            threshold = self.connection.execute(
+                "SELECT amount FROM balances WHERE contract = ? AND amount > 0 "
+                "ORDER BY amount DESC LIMIT 1 OFFSET ?",
+                (contract, max(limit - 1, 0))
+            ).fetchone()
+            # fewer holders than the limit have no threshold
+            amount = threshold[0] if threshold else 0
+            rows = self.connection.execute(query + " AND amount >= ?", (contract, amount))
+
+        holders = [(address, int(balance)) for address, balance in rows]
+        # order exactly by the balance
+        holders.sort(key=lambda holder: holder[1], reverse=True)
+        return holders if limit is None else holders[:max(limit, 0)]
+
+    def owner_of(self, contract, token_id):
+        """
+        Owner of an ERC721 token, None if the token is unknown
+        """
+        row = self.connection.execute(
+            "SELECT owner FROM owners WHERE contract = ? AND token_id = ?", (contract, str(token_id))
+        ).fetchone()
+        return row[0] if row else None
+
+    def tokens_of(self, contract, address):
+        """
+        Token ids owned by an address
+        """
+        rows = self.connection.execute(
+            "SELECT token_id FROM owners WHERE contract = ? AND owner = ?", (contract, address)
+        )
+        return [token_id for token_id, in rows]
+
+    def transfers(self, contract, from_block=0, to_block=None, address=None):
+        """
+        Transfers of a block range, optionally only those from or to an address
+        :return: (block number, log index, from, to, value) of every transfer, in block order
+        :type: list(tuple)
+        """
+        to_block = to_block if to_block is not None else 2 ** 62
+        query = (
+            "SELECT block_number, log_index, from_address, to_address, value FROM transfers "
+            "WHERE contract = ? AND block_number BETWEEN ? AND ?"
+        )
+
+        if address is None:
+            return list(self.connection.execute(query + " ORDER BY block_number, log_index",
+                                                (contract, from_block, to_block)))
+
+        # each side uses its own index
+        return list(self.connection.execute(
+            "SELECT * FROM ({0} AND from_address = ? UNION {0} AND to_address = ?) "
+            "ORDER BY block_number, log_index".format(query),
+            (contract, from_block, to_block, address, contract, from_block, to_block, address)
+        ))
@@ -0,0 +1,305 @@
+"""
+Contains functions for incremental, resumable syncing of Transfer events.
+The transactions csv file only ever grows,
+a json state file next to it keeps the last block that is fully written to it.
+The state also keeps the checkpoints of the last REORG_DEPTH blocks with the hashes
+of their blocks, a sync that finds one of them reorged goes back to the last
+checkpoint still on the chain and drops the rows after it
+"""
+
+import ast
+import csv
+import io
+import json
+import os
+from app.ethereum import fetch_windows
+from app.follow import REORG_DEPTH, block_hash
+from app.parallel import split_range
+from app.ranges import AdaptiveBlockRange
+from app.writers import CSVTransferWriter
+from app.parquet import is_parquet
+from app.metrics import METRICS
+
+
+class SyncState:
+
+    """
+    Sync state of a transactions csv file
+    :param path: Path to the transactions csv file
+    :type path: str
+    :param address: Address of the contract
+    :type address: str
+    :param synced_to: Last block whose events are fully written to the file
+    :type synced_to: int
+    :param offset: Size of the file in bytes after the last block was written
+    :type offset: int
+    :param holders: Path of the holders file and the offset it was computed up to
+    :type holders: dict
+    :param checkpoints: [synced to, offset, hex hash of the block or None] of the last checkpoints, oldest first
+    :type checkpoints: list(list)
+    """
+    def __init__(self, path, address=None, synced_to=None, offset=0, holders=None, checkpoints=None):
+        self.path = path
+        self.address = address
+        self.synced_to = synced_to
+        self.offset = offset
+        self.holders = holders
+        self.checkpoints = checkpoints if checkpoints is not None else []
+
+    @staticmethod
+    def state_path(path):
+        """
+        Path of the state file of a transactions file
+        """
+        return "{}.sync.json".format(path)
+
+    @classmethod
+    def load(cls, path, address=None):
+        """
+        Loads the state of a transactions file,
+        returns an empty state if the file was never synced
+        :param path: Path to the transactions csv file
+        :type path: str
+        :return: Sync state
+        :type: SyncState
+        """
+        if not os.path.isfile(cls.state_path(path)):
+            return cls(path, address)
+
+        with open(cls.state_path(path)) as state:
+            state = json.load(state)
+
+        return cls(
+            path,
+            address=state.get('address', address),
+            synced_to=state.get('synced_to'),
+            offset=state.get('offset', 0),
+            holders=state.get('holders'),
+            checkpoints=state.get('checkpoints')
+        )
+
+    def holders_synced(self, holders_path):
+        """
+        Checks if the holders file can be updated incrementally
+        """
+        return (
+            self.holders is not None and
+            self.holders.get('path') == holders_path and
+            os.path.isfile(holders_path)
+        )
+
+    def save(self):
+        """
+        Saves the state, the file is replaced atomically
+        so a crash never leaves a half written state
+        """
+        temporary = "{}.tmp".format(self.state_path(self.path))
+
+        with open(temporary, "w") as state:
+            json.dump({
+                'address': self.address,
+                'synced_to': self.synced_to,
+                'offset': self.offset,
+                'holders': self.holders,
+                'checkpoints': self.checkpoints,
+            }, state, indent=4)
+
+        os.replace(temporary, self.state_path(self.path))
+
+    def checkpoint(self, block_hash=None):
+        """
+        Remembers the current block and offset as a checkpoint,
+        only the checkpoints a reorg can reach and the newest one before them are kept
+        :param block_hash: Hash of the last synced block, None for blocks deep enough to be final
+        :type block_hash: bytes
+        """
+        self.checkpoints.append([self.synced_to, self.offset, block_hash.hex() if block_hash else None])
+
+        oldest = self.synced_to - REORG_DEPTH
+        deep = [position for position, checkpoint in enumerate(self.checkpoints) if checkpoint[0] <= oldest]
+        if deep:
+            del self.checkpoints[:deep[-1]]
+
+    def block_hash(self):
+        """
+        Hash of the last synced block, None if it was not recorded
+        :type: bytes
+        """
+        if self.checkpoints and self.checkpoints[-1][0] == self.synced_to and self.checkpoints[-1][2]:
+            return bytes.fromhex(self.checkpoints[-1][2])
+        return None
+
+    def rewind(self, web3):
+        """
+        Goes back to the last checkpoint whose block is still on the chain,
+        the oldest checkpoint is deep enough to be final
+        :param web3: Web3 instance
+        :type web3: Web3
+        :return: number of blocks gone back
+        :type: int
+        """
+        while len(self.checkpoints) > 1:
+            block_number, _, expected = self.checkpoints[-1]
+            if expected is None or block_hash(web3, block_number) == bytes.fromhex(expected):
+                break
+            self.checkpoints.pop()
+
+        if not self.checkpoints or self.checkpoints[-1][0] >= self.synced_to:
+            return 0
+
+        rewound = self.synced_to - self.checkpoints[-1][0]
+        self.synced_to, self.offset, _ = self.checkpoints[-1]
+        if self.holders is not None and self.holders.get('offset', 0) > self.offset:
+            # the holders include transactions of reorged blocks
+            self.holders = None
+        print("Reorg, syncing again from block {}".format(self.synced_to + 1))
+        return rewound
+
+
+def read_transactions(path, offset=0, end=None):
+    """
+    Reads the rows of a transactions file written between two offsets,
+    rows after the last checkpoint may belong to an interrupted sync and are left out by passing its offset
+    :param path: Path to the transactions csv file
+    :type path: str
+    :param offset: Byte offset to start reading from
+    :type offset: int
+    :param end: Byte offset to stop reading at, the end of the file by default
+    :type end: int
+    :return: rows and the offset they were read up to
+    :type: tuple(list(list), int)
+    """
+    with open(path, "rb") as transactions:
+        transactions.seek(offset)
+        data = transactions.read() if end is None else transactions.read(max(end - offset, 0))
+
+    rows = list(csv.reader(io.StringIO(data.decode(), newline='')))
+    return rows, offset + len(data)
+
+
+def read_holders(path, erc721=False):
+    """
+    Reads a holders file written by get_holders
+    :param path: Path to the holders csv file
+    :type path: str
+    :param erc721: Whether the holders hold ERC721 tokens
+    :type erc721: bool
+    :return: holders by address
+    :type: dict
+    """
+    holders = {}
+
+    with open(path, "r", newline='') as rows:
+        for row in csv.DictReader(rows):
+            if erc721:
+                tokens = [str(token) for token in ast.literal_eval(row['tokens'])]
+                holders[row['address']] = {'address': row['address'], 'tokens': tokens}
+            else:
+                holders[row['address']] = {'address': row['address'], 'balance': int(row['balance'])}
+
+    return holders
+
+
+def do_sync_transactions(
+    address,
+    web3_contract,
+    file_name,
+    from_block,
+    to_block,
+    block_range=None,
+    erc721=False,
+    output=None,
+    ranges_path=None,
+    workers=1,
+    batch_size=1,
+):
+    """
+    Appends the Transfer events of the blocks after the last synced block
+    to the transactions csv file.
+    The first sync starts at from_block, later syncs continue after the last synced block.
+    A first sync refuses to overwrite a transactions file it did not write.
+    A checkpoint is saved after every step of workers * batch_size windows,
+    so an interrupted sync resumes from the last checkpoint
+    :param address: The contract address.
+    :type address: str
+    :param web3_contract: The web3 contract.
+    :type web3_contract: web3.contract.Contract
+    :param file_name: The file name.
+    :type file_name: str
+    :param from_block: The block to start the first sync from.
+    :type from_block: int
+    :param to_block: The block to sync to.
+    :type to_block: int
+    :param block_range: The block range to start with, the one remembered for the contract by default.
+    :type block_range: int
+    :param erc721: Whether to fetch ERC721 events.
+    :type erc721: bool
+    :param output: The output file
+    :type output: str
+    :param ranges_path: The json file with remembered block ranges
+    :type ranges_path: str
+    :param workers: Number of threads fetching windows
+    :type workers: int
+    :param batch_size: Number of windows sent in one JSON-RPC batch
+    :type batch_size: int
+    :return: The sync state
+    :rtype: SyncState
+    """
+    output_path = output if output else 'app/data/{}.csv'.format(file_name)
+    if is_parquet(output_path):
+        raise ValueError("Sync needs a csv transactions file: {}".format(output_path))
+    state = SyncState.load(output_path, address)
+
+    if state.synced_to is None and os.path.isfile(output_path) and os.path.getsize(output_path) > 0:
+        # the blocks of a file written by record_transactions are unknown, it is never overwritten
+        raise ValueError("{} exists and was not written by a sync, sync to another file".format(output_path))
+
+    if state.synced_to is None or not os.path.isfile(output_path):
+        print("Starting sync of {} from block {}".format(output_path, from_block))
+        CSVTransferWriter(output_path, erc721=erc721).close()
+
+        state = SyncState(output_path, address, synced_to=from_block - 1)
+        state.offset = os.path.getsize(output_path)
+        state.checkpoint()
+    else:
+        if state.rewind(web3_contract.web3):
+            state.save()
+        print("Resuming sync of {} from block {}".format(output_path, state.synced_to + 1))
+        # drop rows written after the last checkpoint
+        with open(output_path, "r+") as transactions:
+            transactions.truncate(state.offset)
+
+    if state.synced_to >= to_block:
+        print("Already synced to block {}".format(state.synced_to))
+        return state
+
+    event = web3_contract.events.Transfer
+    window = AdaptiveBlockRange(address, block_range, path=ranges_path)
+    step = max(workers * batch_size, 1)
+
+    with CSVTransferWriter(output_path, erc721=erc721, append=True) as writer:
+        while state.synced_to < to_block:
+            ranges = split_range(state.synced_to + 1, to_block, window.block_range, limit=step)
+            events_count = 0
+
+            for events in fetch_windows(event, ranges, address, erc721, window, workers, batch_size):
+                with METRICS.timer('write_seconds'):
+                    writer.write(events)
+                events_count += len(events)
+
+            with METRICS.timer('write_seconds'):
+                writer.flush(sync=True)
+
+            state.synced_to = ranges[-1][1]
+            state.offset = os.path.getsize(output_path)
+            # blocks that can still be reorged are checked when the sync or a follower resumes
+            recent = state.synced_to > to_block - REORG_DEPTH
+            state.checkpoint(block_hash(web3_contract.web3, state.synced_to) if recent else None)
+            state.save()
+
+            print('Synced {} transfer events up to block {}'.format(events_count, state.synced_to))
+
+            window.update(events_count // len(ranges))
+
+    window.save()
+    return state
@@ -1,10 +1,19 @@
 """
-Contains utility functions for the app
+Contains utility functions for the app.
+web3 and eth_utils take most of the startup time of the cli,
+so they are imported by the functions that need them,
+and commands that never reach the node do not pay for them
 """
 
-import eth_utils
-from web3 import Web3, HTTPProvider, WebsocketProvider
 import json
+import os
+from functools import lru_cache
+
+# number of unique addresses whose checksum is remembered
+ADDRESS_CACHE_SIZE = 1000000
+
+# directory of the default ABI files
+ABI_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'abi')
 
 
 def format_address(address):
@@ -17,27 +26,99 @@ def format_address(address):
     :return: formatted address
     :type: str
     """
-    bytes = eth_utils.to_bytes(address)
+    import eth_utils
+
+    if not isinstance(address, bytes):
+        address = eth_utils.to_bytes(address)
 
     # get the last 20 bytes only
-    address_bytes = bytes[-20:]
+    return checksum_address(bytes(address[-20:]))
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def checksum_address(address_bytes):
+    """
+    Checksums a 20 bytes address.
+    The checksum needs a keccak hash, so it is computed once per unique address,
+    every later call returns the same interned string
+    :param address_bytes: address to checksum
+    :type address_bytes: bytes
+    :return: checksummed address
+    :type: str
+    """
+    import eth_utils
+
     return eth_utils.to_checksum_address(address_bytes)
         
 
-def instantiate_web3(url):
+def make_provider(url):
     """
-    Web3 instance initializer
+    Provider of a node url, websocket for wss urls and batch capable http otherwise
     :param url: url of the node
     :type url: str
+    :return: provider
+    :type: BaseProvider
+    """
+    from web3 import WebsocketProvider
+    from app.batch import BatchHTTPProvider
+
+    if url.startswith('wss'):
+        return WebsocketProvider(url, {"max_size": 10000000})
+    return BatchHTTPProvider(url)
+
+
+def instantiate_web3(url, cache=None, scheduler=None, hedge=False):
+    """
+    Web3 instance initializer
+    :param url: url of the node, or a list of urls to spread the requests across
+    :type url: str or list(str)
+    :param cache: Cache answering eth_getLogs of final blocks
+    :type cache: app.cache.LogCache
+    :param scheduler: Rate limit and retries of the requests, retries without rate limit by default
+    :type scheduler: app.scheduler.RequestScheduler
+    :param hedge: Whether slow eth_getLogs are sent to a second url
+    :type hedge: bool
     :return: Web3 instance
     :type: Web3
     """
+    from web3 import Web3
+    from app.cache import CachedProvider
+    from app.scheduler import RequestScheduler, ScheduledProvider
+    from app.pool import ProviderPool
+
     if isinstance(url, Web3):
         return url
-    elif url.startswith('wss'):
-        return Web3(WebsocketProvider(url, {"max_size": 10000000}))
+    
+    scheduler = scheduler if scheduler else RequestScheduler()
+    if isinstance(url, (list, tuple)):
+        # hedged requests are sent under the scheduler, they take from its rate limit themselves
+        provider = ProviderPool(
+            [make_provider(endpoint) for endpoint in url],
+            hedge=hedge,
+            bucket=scheduler.bucket
+        )
     else:
-        return Web3(HTTPProvider(url))
+        provider = make_provider(url)
+    
+    provider = ScheduledProvider(provider, scheduler)
+    # cache hits do not take from the rate limit
+    if cache is not None:
+        provider = CachedProvider(provider, cache)
+    return Web3(provider)
+
+
+@lru_cache(maxsize=None)
+def load_abi(file_name):
+    """
+    Parses an ABI file of the abi directory once per process.
+    Every contract of a run shares the parsed ABI, which web3 only reads
+    :param file_name: Name of the file in app/abi
+    :type file_name: str
+    :return: ABI
+    :type: list
+    """
+    with open(os.path.join(ABI_DIRECTORY, file_name)) as abi:
+        return json.load(abi)
 
 
 def fetch_abi(erc721=False):
@@ -47,11 +128,9 @@ def fetch_abi(erc721=False):
     :param erc721: if the contract is ERC721
     :type erc721: bool
     :return: ABI of the contract
-    :type: dict
+    :type: list
     """
     if erc721:
-        with open('app/abi/default-erc721.json') as abi:
-            return json.load(abi)
+        return load_abi('default-erc721.json')
 
-    with open('app/abi/default-erc20.json') as abi:
-        return json.load(abi)
+    return load_abi('default-erc20.json')
@@ -0,0 +1,176 @@
+"""
+Contains the watchlist mode, that extracts only the transfers of a list of addresses.
+The from and to arguments of Transfer are indexed topics, so the node filters the logs:
+one eth_getLogs asks for the transfers sent by the addresses and another for the ones they received.
+Transfers between two watched addresses are returned by both and kept once.
+The balances of the watched addresses are exact when the scan starts at the deployment of the contract
+"""
+
+import json
+from app.config import TRANSFER_TOPIC
+from app.ethereum import fetch_windows
+from app.parallel import split_range
+from app.writers import open_transfer_writer
+
+# addresses in the topic filter of one eth_getLogs call
+WATCHLIST_CHUNK = 500
+
+# block range of one eth_getLogs call, filtered queries return few logs
+WATCHLIST_BLOCK_RANGE = 100000
+
+
+def load_watchlist(path):
+    """
+    Loads the watched addresses of a file: a json list,
+    or one address per line, in the first column of a csv file.
+    Empty lines, lines starting with # and the header row are skipped
+    :param path: path to the watchlist
+    :type path: str
+    :return: checksummed addresses, without duplicates
+    :type: list(str)
+    """
+    import eth_utils
+
+    with open(path) as watchlist:
+        if path.endswith('.json'):
+            lines = json.load(watchlist)
+        else:
+            lines = [line.split(',')[0].strip() for line in watchlist]
+
+    addresses = []
+    for line in lines:
+        if not line or line.startswith('#') or line.lower() == 'address':
+            continue
+        if not eth_utils.is_address(line):
+            raise ValueError("Not an address in {}: {}".format(path, line))
+
+        address = eth_utils.to_checksum_address(line)
+        if address not in addresses:
+            addresses.append(address)
+
+    return addresses
+
+
+def to_topic(address):
+    """
+    Left pads an address to a 32 bytes topic
+    """
+    return "0x" + address[2:].lower().rjust(64, "0")
+
+
+def watchlist_topics(addresses, chunk=WATCHLIST_CHUNK):
+    """
+    Topic filters matching the transfers sent or received by the addresses,
+    two per chunk of addresses
+    :param addresses: watched addresses
+    :type addresses: list(str)
+    :param chunk: addresses in one filter
+    :type chunk: int
+    :return: topics of every filter
+    :type: list(list)
+    """
+    filters = []
+    for start in range(0, len(addresses), chunk):
+        topics = [to_topic(address) for address in addresses[start:start + chunk]]
+        filters.append([TRANSFER_TOPIC, topics])
+        filters.append([TRANSFER_TOPIC, None, topics])
+    return filters
+
+
+def merge_events(windows):
+    """
+    Merges the events of the filters of a window,
+    events matched by more than one filter are kept once
+    :param windows: events of every filter
+    :type windows: list(list(dict))
+    :return: events in (block number, log index) order
+    :type: list(dict)
+    """
+    events = {}
+    for window in windows:
+        for event in window:
+            events[(event['block_number'], event['log_index'])] = event
+    return [events[position] for position in sorted(events)]
+
+
+def watched_holders(holders, addresses, erc721=False):
+    """
+    Holders of the watched addresses only,
+    watched addresses without transfers hold nothing
+    :param holders: holders by address
+    :type holders: dict
+    :param addresses: watched addresses
+    :type addresses: list(str)
+    :return: holders by watched address
+    :type: dict
+    """
+    empty = {'tokens': []} if erc721 else {'balance': 0}
+    return {
+        address: holders.get(address, dict(empty, address=address))
+        for address in addresses
+    }
+
+
+def do_record_watchlist(
+    address,
+    web3_contract,
+    file_name,
+    addresses,
+    from_block,
+    to_block,
+    block_range=WATCHLIST_BLOCK_RANGE,
+    erc721=False,
+    output=None,
+    workers=1,
+    batch_size=1
+):
+    """
+    Records the transfers of the watched addresses in csv file, or in a Parquet file if output ends with .parquet.
+    Windows are fetched in ascending order, the filters of a window side by side
+    :param address: The contract address.
+    :type address: str
+    :param web3_contract: The web3 contract.
+    :type web3_contract: web3.contract.Contract
+    :param file_name: The file name.
+    :type file_name: str
+    :param addresses: The watched addresses.
+    :type addresses: list(str)
+    :param from_block: The first block.
+    :type from_block: int
+    :param to_block: The last block.
+    :type to_block: int
+    :param block_range: Number of blocks in one window, windows with too many events are split
+    :type block_range: int
+    :param erc721: Whether to fetch ERC721 events.
+    :type erc721: bool
+    :param output: The output file
+    :type output: str
+    :param workers: Number of threads fetching the windows of a filter
+    :type workers: int
+    :param batch_size: Number of windows sent in one JSON-RPC batch
+    :type batch_size: int
+    :return: void
+    """
+    event = web3_contract.events.Transfer
+    filters = watchlist_topics(addresses)
+    ranges = split_range(from_block, to_block, block_range)
+
+    output_path = output if output else 'app/data/{}_watchlist.csv'.format(file_name)
+    print('Writing to file {}'.format(output_path))
+    print("Fetching {} windows with {} filters for {} addresses".format(
+        len(ranges), len(filters), len(addresses)))
+
+    fetched = [
+        fetch_windows(event, ranges, address, erc721, workers=workers, batch_size=batch_size, topics=topics)
+        for topics in filters
+    ]
+
+    transactions_count = 0
+    with open_transfer_writer(output_path, erc721=erc721) as writer:
+        for windows in zip(*fetched):
+            events = merge_events(windows)
+            writer.write(events)
+            transactions_count += len(events)
+
+    print('Stored {} transfer events of {} addresses from blocks {}-{}'.format(
+        transactions_count, len(addresses), from_block, to_block))
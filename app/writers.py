@@ -0,0 +1,131 @@
+"""
+Contains writers that stream Transfer events to the output file,
+and readers of the transactions files they write
+"""
+
+import csv
+import os
+from contextlib import contextmanager
+from app.parquet import ParquetTransferWriter, is_parquet, iter_parquet_rows
+
+# number of events buffered before they are written to the file
+CHUNK_SIZE = 10000
+
+
+def transfer_columns(erc721=False):
+    """
+    Columns of a transactions file.
+    Files written before log_index and transaction_index were recorded
+    only have the first four columns
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :return: column names
+    :type: list(str)
+    """
+    return ['from', 'to', 'value' if not erc721 else 'tokenId', 'block_number', 'log_index', 'transaction_index']
+
+
+class CSVTransferWriter:
+
+    """
+    Appends Transfer events to a csv file in chunks of bounded size,
+    so memory does not grow with the number of events
+    and everything written before a crash stays in the file
+    :param path: Path to the csv file
+    :type path: str
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :param chunk_size: Number of events buffered before they are written
+    :type chunk_size: int
+    :param append: Append to an existing file instead of starting a new one
+    :type append: bool
+    """
+    def __init__(self, path, erc721=False, chunk_size=CHUNK_SIZE, append=False):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.columns = transfer_columns(erc721)
+        self.buffer = []
+        self.count = 0
+
+        new_file = not append or not os.path.isfile(path)
+        self.file = open(path, "w" if new_file else "a", newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.columns, extrasaction='ignore')
+
+        if new_file:
+            self.writer.writeheader()
+
+    def write(self, events):
+        """
+        Buffers the events, writes them once the buffer is full
+        :param events: Decoded Transfer events
+        :type events: iterable(dict)
+        """
+        for event in events:
+            self.buffer.append(event)
+            if len(self.buffer) >= self.chunk_size:
+                self.flush()
+
+    def flush(self, sync=False):
+        """
+        Writes the buffered events to the file
+        :param sync: Also make sure the file is written to disk
+        :type sync: bool
+        """
+        self.writer.writerows(self.buffer)
+        self.count += len(self.buffer)
+        self.buffer = []
+        self.file.flush()
+
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        """
+        Writes the remaining events and closes the file
+        """
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_transfer_writer(path, erc721=False, append=False):
+    """
+    Opens the writer for the format of the file, Parquet for .parquet files and csv otherwise
+    :param path: Path to the output file
+    :type path: str
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :param append: Append to an existing file instead of starting a new one
+    :type append: bool
+    :return: writer
+    :type: CSVTransferWriter or ParquetTransferWriter
+    """
+    if is_parquet(path):
+        return ParquetTransferWriter(path, erc721=erc721, append=append)
+    return CSVTransferWriter(path, erc721=erc721, append=append)
+
+
+@contextmanager
+def open_transactions(path, erc721=False):
+    """
+    Opens a transactions file as rows of
+    [from, to, value or token id, block number, log index, transaction index], in file order.
+    Rows of csv files are strings and start with the header row
+    :param path: Path to the transactions file
+    :type path: str
+    :param erc721: Whether the transfers are ERC721 transfers
+    :type erc721: bool
+    :return: rows
+    :type: iterable(list)
+    """
+    if is_parquet(path):
+        yield iter_parquet_rows(path, erc721=erc721)
+        return
+
+    with open(path, "r", newline='') as transactions:
+        yield csv.reader(transactions)
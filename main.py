@@ -2,7 +2,8 @@
 Main executable file of the project.
 The workflow is as follows:
 - Gets the arguments from the command line
-- Instantiates the web3 object with the Infura URL
+- With an input file, writes its holders offline, without importing web3
+- Otherwise instantiates the web3 object with the Infura URL
 - Based on the arguments, either:
     - Gets the ERC20 contract
         - If input file is not flagged:
@@ -15,74 +16,241 @@ The workflow is as follows:
 """
 
 from app.classes.erc721 import ERC721Contract
-from app.utils import instantiate_web3
-from app.config import INFURA_URL
+from app.config import INFURA_URL, RPC_URLS
 from app.classes.erc20 import ERC20Contract
 from app.parser import parser
+from app.watchlist import load_watchlist, WATCHLIST_BLOCK_RANGE
+from app.metrics import METRICS, serve_metrics
+from app.ranges import DEFAULT_BLOCK_RANGE
+import os
 
 CONTRACT_ADDRESS = "0x1CB1A5e65610AEFF2551A50f76a87a7d3fB649C6"
 
 print("Launching app ...")
 
-def main():
-    print("Instantiating contract...")
-    web3 = instantiate_web3(INFURA_URL)
+def write_holders(contract, options, input=None, incremental=False, output_dir=None):
+    """
+    Writes the holders of a contract, as of the target block if one is given,
+    and adds the transactions to the event store if one is given.
+    The holders file is named after the contract, in output_dir if one is given
+    """
+    output = None
+    if output_dir:
+        contract.set_file_name()
+        suffix = "_{}".format(options.atblock) if options.atblock else ""
+        output = os.path.join(output_dir, "{}_holders{}.csv".format(contract.file_name, suffix))
     
-    (options, args) = parser.parse_args()
+    with METRICS.timer('stage_seconds', stage='holders'):
+        if options.atblock:
+            contract.get_holders_at(int(options.atblock), input=input, output=output)
+        else:
+            contract.get_holders(input=input, output=output, incremental=incremental)
     
+    if options.store:
+        contract.load_store(input=input, path=options.store)
+
+def sync_from_block(contract, options):
+    """
+    Block the first sync of a contract starts from, its deployment block by default
+    """
+    if options.fromblock:
+        return int(options.fromblock)
+    return contract.deployment_block()
+
+def record_watchlist(contract, options, workers=1, batch_size=1):
+    """
+    Records the transfers of the watched addresses, unless an input file is given,
+    and writes the holdings of the watched addresses
+    """
+    addresses = load_watchlist(options.watchlist)
+    print("Watching {} addresses".format(len(addresses)))
+    
+    if not options.infile:
+        contract.record_watchlist(
+            addresses,
+            from_block=int(options.fromblock) if options.fromblock else None,
+            block_range=int(options.blockrange) if options.blockrange else WATCHLIST_BLOCK_RANGE,
+            output=options.outfile,
+            workers=workers,
+            batch_size=batch_size
+        )
+    contract.get_watchlist_holders(addresses, input=options.infile if options.infile else options.outfile)
+
+def contract_address(options):
+    """
+    Checksummed address of the contract of the options, the test contract by default
+    """
+    import eth_utils
+
     if not options.address:
         print("Using test contract address: {}".format(CONTRACT_ADDRESS))
+        return eth_utils.to_checksum_address(CONTRACT_ADDRESS)
+
+    print("Using contract address: {}".format(options.address))
+    return eth_utils.to_checksum_address(options.address)
+
+def make_contract(web3, address, options):
+    """
+    ERC721 or ERC20 contract of the options
+    """
+    contract_class = ERC721Contract if options.erc721 else ERC20Contract
+    return contract_class(web3, address, name=options.name, symbol=options.symbol)
+
+def record_from_block(web3, options, block_range):
+    """
+    Block to start extracting events from, the last block range by default
+    """
+    if options.fromblock:
+        return int(options.fromblock)
+    return web3.eth.block_number - (block_range if block_range else DEFAULT_BLOCK_RANGE)
+
+def run_manifest(web3, options, block_range=None, workers=1, batch_size=1):
+    """
+    Records the transactions of the contracts of the manifest with one scan,
+    over the blocks a single contract run would scan, then writes the holders of every contract.
+    With an input directory its transactions files are read instead, web3 can then be None.
+    The output option is the directory of the transactions and holders files, app/data by default
+    """
+    from app.multi import load_contracts, transactions_paths, do_record_contracts
     
-        checksum_address = web3.toChecksumAddress(CONTRACT_ADDRESS)
-    else:
-        print("Using contract address: {}".format(options.address))
-        checksum_address = web3.toChecksumAddress(options.address)
-    
-    # block number to start extracting events from
-    block_range = int(options.blockrange) if options.blockrange else 1000
-    from_block = web3.eth.block_number - block_range
-    
-    print("Block range: {}".format(block_range))
+    print("Reading contracts from: {}".format(options.manifest))
+    contracts = load_contracts(web3, options.manifest)
+    output_dir = options.outfile if options.outfile else 'app/data'
+    os.makedirs(output_dir, exist_ok=True)
     
-    if options.erc721:
-        nft = ERC721Contract(
-            web3,
-            checksum_address, 
-            name=options.name,
-            symbol=options.symbol,
-        )
-        if options.infile:
-            print("Reading from file: {}".format(options.infile))
-            nft.get_holders(input=options.infile)
-            print("Done!")
-            return
+    if options.infile:
+        print("Reading from directory: {}".format(options.infile))
+        paths = transactions_paths(contracts, options.infile)
+    else:
+        to_block = web3.eth.block_number
+        if options.fromblock:
+            from_block = int(options.fromblock)
+        elif options.fullhistory:
+            from_block = min(contract.deployment_block() for contract in contracts)
+        else:
+            from_block = to_block - (block_range if block_range else DEFAULT_BLOCK_RANGE)
         
-        nft.record_transactions(from_block=from_block, block_range=block_range, output=options.outfile)
+        paths = do_record_contracts(
+            contracts,
+            from_block=from_block,
+            to_block=to_block,
+            block_range=block_range,
+            output_dir=output_dir,
+            workers=workers,
+            batch_size=batch_size
+        )
         print("Recorded transactions from block: {}".format(from_block))
+    
+    for contract in contracts:
+        write_holders(contract, options, input=paths[contract.address], output_dir=output_dir)
 
-        nft.get_holders()
+def run_offline(options):
+    """
+    Writes the holders of an existing transactions file, or directory with a manifest.
+    Nothing is asked to the node, so web3 is neither imported nor instantiated
+    """
+    if options.manifest:
+        run_manifest(None, options)
         print("Done!")
         return
-
-    # contract = ERC20Contract(web3, checksum_address, name="anyswap", symbol="celo")
-    print("Getting logs ...")
     
-    erc20 = ERC20Contract(web3, checksum_address, name=options.name, symbol=options.symbol)
+    contract = make_contract(None, contract_address(options), options)
+    
+    if options.watchlist:
+        record_watchlist(contract, options)
+    else:
+        print("Reading from file: {}".format(options.infile))
+        write_holders(contract, options, input=options.infile)
+    print("Done!")
 
+def run(options):
+    """
+    Runs the extraction the options ask for
+    """
     if options.infile:
-        print("Reading from file: {}".format(options.infile))
-        erc20.get_holders(input=options.infile)
+        run_offline(options)
+        return
+    
+    from app.utils import instantiate_web3
+    from app.cache import LogCache
+    from app.scheduler import RequestScheduler
+    
+    print("Instantiating contract...")
+    cache = LogCache(options.cache) if options.cache else None
+    scheduler = RequestScheduler(rate=float(options.rate) if options.rate else None)
+    if RPC_URLS:
+        print("Spreading requests across {} RPC urls".format(len(RPC_URLS)))
+    web3 = instantiate_web3(RPC_URLS if RPC_URLS else INFURA_URL, cache=cache, scheduler=scheduler, hedge=options.hedge)
+    
+    checksum_address = contract_address(options)
+    
+    # without -r the range remembered for the contract is used
+    block_range = int(options.blockrange) if options.blockrange else None
+    workers = int(options.workers) if options.workers else 1
+    batch_size = int(options.batchsize) if options.batchsize else 1
+    
+    print("Block range: {}".format(block_range if block_range else "remembered"))
+    
+    if options.manifest:
+        run_manifest(web3, options, block_range, workers, batch_size)
         print("Done!")
         return
     
-    erc20.record_transactions(from_block=from_block, block_range=block_range, output=options.outfile)
-    print("Fetched transactions from block: {}".format(from_block))
+    print("Getting logs ...")
+    contract = make_contract(web3, checksum_address, options)
     
-    erc20.get_holders()
+    if options.watchlist:
+        record_watchlist(contract, options, workers, batch_size)
+        print("Done!")
+        return
+    
+    if options.sync or options.follow or options.serve:
+        contract.sync_transactions(
+            from_block=sync_from_block(contract, options),
+            block_range=block_range,
+            output=options.outfile,
+            workers=workers,
+            batch_size=batch_size
+        )
+        write_holders(contract, options, input=options.outfile, incremental=True)
+        if options.serve:
+            contract.serve_holders(int(options.serve), input=options.outfile)
+        elif options.follow:
+            contract.follow_transfers(input=options.outfile)
+        print("Done!")
+        return
+    
+    from_block = record_from_block(web3, options, block_range)
+    contract.record_transactions(
+        from_block=from_block,
+        block_range=block_range,
+        output=options.outfile,
+        workers=workers,
+        batch_size=batch_size,
+        full_history=options.fullhistory
+    )
+    print("Recorded transactions from block: {}".format(from_block))
+    
+    write_holders(contract, options, input=options.outfile)
     print("Done!")
     return
 
 
+def main():
+    (options, args) = parser.parse_args()
+    
+    if options.metrics or options.metricsport:
+        METRICS.enable()
+    if options.metricsport:
+        serve_metrics(int(options.metricsport))
+    
+    try:
+        run(options)
+    finally:
+        if options.metrics:
+            METRICS.save(options.metrics)
+
+
 # run the main function
 if __name__ == "__main__":
     main()
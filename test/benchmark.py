@@ -0,0 +1,221 @@
+"""
+End-to-end benchmarks of the pipeline stages, against the fake node served over HTTP.
+A synthetic chain is generated once, then every stage runs in its own forked process
+with its own node server, so its RPC calls and memory are its own:
+- fetch_events: eth_getLogs and decoding of every window, split when it has too many logs
+- record: do_record_transactions to a csv file, one window at a time
+- record_parallel: the same with workers and JSON-RPC batches
+- holders: balances, or owners, from the csv file
+Every stage reports its seconds, logs per second, RPC calls,
+peak RSS and how much the RSS grew over the forked process, which holds the chain.
+Run it with python -m test.benchmark, see --help for the chain and node settings
+"""
+
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.ethereum import fetch_range
+from app.parallel import split_range
+from app.utils import instantiate_web3
+from test.fake_node import FakeNode, FakeNodeServer, generate_chain, TEST_TOKEN
+
+parser = OptionParser(usage="python -m test.benchmark [options]")
+
+parser.add_option("--blocks", dest="blocks", type="int", default=100000,
+                  help="Blocks of the synthetic chain")
+
+parser.add_option("--density", dest="density", type="float", default=2.0,
+                  help="Average transfers per block")
+
+parser.add_option("--holders", dest="holders", type="int", default=10000,
+                  help="Addresses sending and receiving the transfers")
+
+parser.add_option("--erc721", dest="erc721", action="store_true", default=False,
+                  help="Generate ERC721 transfers instead of ERC20")
+
+parser.add_option("--latency", dest="latency", type="float", default=0.0,
+                  help="Seconds every round trip to the node takes")
+
+parser.add_option("--maxresults", dest="maxresults", type="int", default=10000,
+                  help="Logs after which eth_getLogs fails, like Infura")
+
+parser.add_option("--blockrange", dest="blockrange", type="int", default=2000,
+                  help="Block range of the eth_getLogs windows")
+
+parser.add_option("--workers", dest="workers", type="int", default=4,
+                  help="Workers of the record_parallel stage")
+
+parser.add_option("--batchsize", dest="batchsize", type="int", default=8,
+                  help="Windows in one JSON-RPC batch of the record_parallel stage")
+
+parser.add_option("--output", dest="output",
+                  help="Json file the results are written to", metavar="OUTPUT")
+
+
+def peak_rss():
+    """
+    Peak resident memory of the process in MB,
+    ru_maxrss is in KB on Linux and in bytes on macOS
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def transactions_path(directory):
+    return os.path.join(directory, "transactions.csv")
+
+
+def fetch_events_stage(contract, options, directory):
+    event = contract.to_token_contract().events.Transfer
+    for from_block, to_block in split_range(1, options.blocks, options.blockrange):
+        fetch_range(event, from_block, to_block, address=contract.address, erc721=options.erc721)
+
+
+def record_stage(contract, options, directory):
+    contract.record_transactions(
+        from_block=1,
+        block_range=options.blockrange,
+        output=transactions_path(directory)
+    )
+
+
+def record_parallel_stage(contract, options, directory):
+    contract.record_transactions(
+        from_block=1,
+        block_range=options.blockrange,
+        output=os.path.join(directory, "transactions_parallel.csv"),
+        workers=options.workers,
+        batch_size=options.batchsize
+    )
+
+
+def holders_stage(contract, options, directory):
+    contract.get_holders(
+        input=transactions_path(directory),
+        output=os.path.join(directory, "holders.csv")
+    )
+
+
+# stages in the order they run, holders reads the file of record
+STAGES = (
+    ('fetch_events', fetch_events_stage),
+    ('record', record_stage),
+    ('record_parallel', record_parallel_stage),
+    ('holders', holders_stage),
+)
+
+
+def measure_stage(name, stage, node, options, directory):
+    """
+    Runs a stage against a fresh node server
+    :return: measures of the stage
+    :type: dict
+    """
+    start_rss = peak_rss()
+
+    with FakeNodeServer(node) as server:
+        web3 = instantiate_web3(server.url)
+        contract_class = ERC721Contract if options.erc721 else ERC20Contract
+        contract = contract_class(
+            web3,
+            web3.toChecksumAddress(TEST_TOKEN),
+            name="BENCH",
+            ranges_path=os.path.join(directory, "block_ranges.json")
+        )
+        # contract creation already called eth_chainId
+        node.calls = []
+
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            stage(contract, options, directory)
+        seconds = time.perf_counter() - start
+
+    return {
+        'stage': name,
+        'seconds': round(seconds, 3),
+        'logs': node.transactions,
+        'logs_per_second': round(node.transactions / seconds) if seconds else None,
+        'rpc_calls': len(node.calls),
+        'http_posts': server.posts,
+        'peak_rss_mb': round(peak_rss(), 1),
+        'rss_growth_mb': round(peak_rss() - start_rss, 1),
+    }
+
+
+def run_stage(name, stage, node, options, directory, results):
+    """
+    Runs a stage in a forked process and puts its measures in results
+    """
+    results.put(measure_stage(name, stage, node, options, directory))
+
+
+def run(options):
+    """
+    Generates the chain and runs every stage
+    :return: measures of every stage
+    :type: list(dict)
+    """
+    node = FakeNode(max_results=options.maxresults, latency=options.latency)
+    start = time.perf_counter()
+    transfers = generate_chain(
+        node,
+        blocks=options.blocks,
+        transfers_per_block=options.density,
+        holders=options.holders,
+        erc721=options.erc721
+    )
+    print("Generated {} transfers in {} blocks in {:.1f}s".format(
+        transfers, options.blocks, time.perf_counter() - start))
+
+    # forked processes measure their own memory, without fork the stages share the process
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    measures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, stage in STAGES:
+            if method is None:
+                measures.append(measure_stage(name, stage, node, options, directory))
+                continue
+
+            context = multiprocessing.get_context(method)
+            results = context.Queue()
+            process = context.Process(target=run_stage, args=(name, stage, node, options, directory, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError("Stage {} failed with exit code {}".format(name, process.exitcode))
+            measures.append(results.get())
+
+    return measures
+
+
+def main():
+    (options, args) = parser.parse_args()
+    measures = run(options)
+
+    print("{:<16} {:>9} {:>12} {:>10} {:>10} {:>12}".format(
+        "stage", "seconds", "logs/sec", "rpc calls", "peak MB", "growth MB"))
+    for measure in measures:
+        print("{:<16} {:>9.3f} {:>12} {:>10} {:>10.1f} {:>12.1f}".format(
+            measure['stage'],
+            measure['seconds'],
+            measure['logs_per_second'],
+            measure['rpc_calls'],
+            measure['peak_rss_mb'],
+            measure['rss_growth_mb']
+        ))
+
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(measures, output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
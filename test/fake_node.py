@@ -0,0 +1,427 @@
+"""
+In-memory Ethereum node used by the tests and the benchmarks instead of Infura.
+Serves Transfer logs through a web3 provider, or over HTTP with FakeNodeServer.
+Logs are indexed by block, so chains of millions of logs are served quickly,
+generate_chain fills a node with a synthetic token history.
+Reorgs are scripted with reorg(block): the blocks from that block on
+are replaced, so they get new hashes and lose their logs
+"""
+
+import bisect
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from web3 import Web3
+from web3.providers.base import BaseProvider
+from app.config import TRANSFER_TOPIC
+
+TEST_TOKEN = "0x68749665FF8D2d112Fa859AA293F07A622782F38"
+
+ZERO_ADDRESS = "0x" + "00" * 20
+
+
+def to_topic(address):
+    """
+    Left pads an address to a 32 bytes topic
+    """
+    return "0x" + address[2:].lower().rjust(64, "0")
+
+
+def to_int(block):
+    """
+    Converts a hex block number of a filter to int
+    """
+    if isinstance(block, int):
+        return block
+    return int(block, 16)
+
+
+class FakeNodeError(Exception):
+
+    """
+    JSON-RPC error returned by the fake node
+    """
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class FakeNode:
+
+    """
+    Fake node that keeps Transfer logs in memory
+    :param block_number: Latest block of the chain
+    :type block_number: int
+    :param max_results: Number of logs after which eth_getLogs fails, like Infura
+    :type max_results: int
+    :param latency: Seconds every round trip to the node takes
+    :type latency: float
+    """
+    def __init__(self, block_number=0, max_results=10000, latency=0):
+        self.block_number = block_number
+        self.max_results = max_results
+        self.latency = latency
+        # logs of every block, and the blocks with logs in ascending order
+        self.blocks = {}
+        self.block_numbers = []
+        self.transactions = 0
+        self.calls = []
+        # first block of every reorg
+        self.reorgs = []
+        # errors returned for the next calls
+        self.failures = []
+        # deployment block of every contract
+        self.deployments = {}
+
+    def add_transfer(self, block_number, from_, to, value, address=TEST_TOKEN, erc721=False):
+        """
+        Adds a Transfer log to the chain
+        :param value: Amount of tokens for ERC20, token id for ERC721
+        :type value: int
+        """
+        if block_number not in self.blocks:
+            self.blocks[block_number] = []
+            bisect.insort(self.block_numbers, block_number)
+        block = self.blocks[block_number]
+
+        log_index = len(block)
+        topics = [TRANSFER_TOPIC, to_topic(from_), to_topic(to)]
+        data = "0x"
+
+        if erc721:
+            topics.append("0x{:064x}".format(value))
+        else:
+            data = "0x{:064x}".format(value)
+
+        self.transactions += 1
+        block.append({
+            'address': address,
+            'blockNumber': hex(block_number),
+            'data': data,
+            'logIndex': hex(log_index),
+            'removed': False,
+            'topics': topics,
+            'transactionHash': "0x{:064x}".format(self.transactions),
+            'transactionIndex': hex(log_index),
+        })
+        self.block_number = max(self.block_number, block_number)
+
+    @property
+    def logs(self):
+        """
+        All logs, in block order
+        """
+        return [log for block_number in self.block_numbers for log in self.blocks[block_number]]
+
+    def deploy(self, address, block_number):
+        """
+        Deploys a contract: it has code from block_number on
+        """
+        self.deployments[address.lower()] = block_number
+
+    def get_code(self, address, block):
+        block_number = self.block_number if block == 'latest' else to_int(block)
+        deployed = self.deployments.get(address.lower())
+        if deployed is None or block_number < deployed:
+            return "0x"
+        return "0x6080604052"
+
+    def fail_next(self, count, code=-32005, message="project ID request rate exceeded"):
+        """
+        Makes the next count calls fail with a JSON-RPC error, like a rate limited provider
+        """
+        self.failures.extend([(code, message)] * count)
+
+    def mine(self, block_number):
+        """
+        Moves the head of the chain to block_number, blocks without logs are added
+        """
+        self.block_number = max(self.block_number, block_number)
+
+    def reorg(self, block_number):
+        """
+        Replaces the blocks from block_number on: their logs are dropped,
+        the head goes back to block_number - 1 and later blocks get new hashes
+        """
+        position = bisect.bisect_left(self.block_numbers, block_number)
+        for dropped in self.block_numbers[position:]:
+            del self.blocks[dropped]
+        del self.block_numbers[position:]
+        self.block_number = block_number - 1
+        self.reorgs.append(block_number)
+
+    def block_hash(self, block_number):
+        """
+        Hash of a block, it changes with every reorg at or before the block
+        """
+        fork = len([start for start in self.reorgs if start <= block_number])
+        return "0x{:032x}{:032x}".format(fork, block_number)
+
+    def get_block(self, block):
+        block_number = self.block_number if block == 'latest' else to_int(block)
+        if block_number > self.block_number:
+            return None
+
+        return {
+            'number': hex(block_number),
+            'hash': self.block_hash(block_number),
+            'parentHash': self.block_hash(block_number - 1) if block_number > 0 else "0x" + "0" * 64,
+            'timestamp': hex(block_number * 12),
+            'transactions': [],
+        }
+
+    def get_logs(self, params):
+        """
+        Filters the logs by address, topics and block range
+        """
+        from_block = to_int(params.get('fromBlock', 0))
+        to_block = params.get('toBlock', 'latest')
+        to_block = self.block_number if to_block == 'latest' else to_int(to_block)
+
+        addresses = params.get('address')
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        if addresses is not None:
+            addresses = {address.lower() for address in addresses}
+
+        start = bisect.bisect_left(self.block_numbers, from_block)
+        end = bisect.bisect_right(self.block_numbers, to_block)
+        topics = params.get('topics') or []
+
+        logs = []
+        for block_number in self.block_numbers[start:end]:
+            block_hash = self.block_hash(block_number)
+            for log in self.blocks[block_number]:
+                if addresses is not None and log['address'].lower() not in addresses:
+                    continue
+                if not self.match_topics(log['topics'], topics):
+                    continue
+                logs.append(dict(log, blockHash=block_hash))
+
+            if len(logs) > self.max_results:
+                raise FakeNodeError(-32005, "query returned more than {} results".format(self.max_results))
+
+        return logs
+
+    def match_topics(self, topics, filters):
+        for position, expected in enumerate(filters):
+            if expected is None:
+                continue
+            if position >= len(topics):
+                return False
+            expected = expected if isinstance(expected, list) else [expected]
+            if topics[position].lower() not in [topic.lower() for topic in expected]:
+                return False
+        return True
+
+    def wait(self):
+        """
+        Waits the latency of a round trip
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+    def handle(self, method, params):
+        """
+        Returns the result of a JSON-RPC call
+        """
+        self.calls.append(method)
+
+        if self.failures:
+            raise FakeNodeError(*self.failures.pop(0))
+        if method == 'eth_blockNumber':
+            return hex(self.block_number)
+        if method == 'eth_chainId':
+            return '0x1'
+        if method == 'eth_getLogs':
+            return self.get_logs(params[0])
+        if method == 'eth_getBlockByNumber':
+            return self.get_block(params[0])
+        if method == 'eth_getCode':
+            return self.get_code(params[0], params[1])
+
+        raise FakeNodeError(-32601, "the method {} does not exist".format(method))
+
+
+def respond(node, request):
+    """
+    JSON-RPC response of the fake node to a single request
+    """
+    try:
+        result = node.handle(request['method'], request.get('params', []))
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+    except FakeNodeError as error:
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': error.code, 'message': error.message}}
+
+
+def generate_chain(
+    node,
+    blocks=10000,
+    transfers_per_block=1.0,
+    holders=1000,
+    erc721=False,
+    address=TEST_TOKEN,
+    from_block=1,
+    seed=0
+):
+    """
+    Fills the node with a synthetic token history, the same for the same seed.
+    The contract is deployed in from_block.
+    ERC20 transfers move a part of the balance of an address to another,
+    addresses without balance are minted tokens instead.
+    ERC721 tokens are minted to a random address one time in ten,
+    otherwise a random token moves from its owner to another address
+    :param node: Node to fill
+    :type node: FakeNode
+    :param blocks: Number of blocks
+    :type blocks: int
+    :param transfers_per_block: Average transfers in a block, the fraction is spread at random
+    :type transfers_per_block: float
+    :param holders: Number of addresses sending and receiving the transfers
+    :type holders: int
+    :return: number of transfers added
+    :type: int
+    """
+    generator = random.Random(seed)
+    addresses = ["0x{:040x}".format(position + 1) for position in range(holders)]
+    whole = int(transfers_per_block)
+    fraction = transfers_per_block - whole
+    balances = {}
+    # owner of every token id
+    owners = []
+    count = 0
+
+    node.deploy(address, from_block)
+    for block_number in range(from_block, from_block + blocks):
+        for _ in range(whole + (1 if generator.random() < fraction else 0)):
+            to = generator.choice(addresses)
+            count += 1
+
+            if erc721:
+                if not owners or generator.random() < 0.1:
+                    node.add_transfer(block_number, ZERO_ADDRESS, to, len(owners), address, erc721=True)
+                    owners.append(to)
+                    continue
+                token_id = generator.randrange(len(owners))
+                node.add_transfer(block_number, owners[token_id], to, token_id, address, erc721=True)
+                owners[token_id] = to
+                continue
+
+            from_ = generator.choice(addresses)
+            balance = balances.get(from_, 0)
+            if balance == 0:
+                from_, value = ZERO_ADDRESS, generator.randrange(1, 10 ** 24)
+            else:
+                value = generator.randint(1, balance)
+                balances[from_] = balance - value
+            node.add_transfer(block_number, from_, to, value, address)
+            balances[to] = balances.get(to, 0) + value
+
+    node.mine(from_block + blocks - 1)
+    return count
+
+
+class FakeNodeServer:
+
+    """
+    Serves the fake node over HTTP on a local port
+    :param node: Fake node to serve
+    :type node: FakeNode
+    :param batches: Whether JSON-RPC batch requests are supported
+    :type batches: bool
+    Statuses appended to statuses are returned for the next posts, like HTTP 429
+    """
+    def __init__(self, node, batches=True):
+        self.node = node
+        self.batches = batches
+        self.posts = 0
+        # HTTP status codes returned for the next posts
+        self.statuses = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                fake.posts += 1
+                fake.node.wait()
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+                if fake.statuses:
+                    self.send_response(fake.statuses.pop(0))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                if not isinstance(payload, list):
+                    response = respond(fake.node, payload)
+                elif fake.batches:
+                    # answer in reverse order, responses are matched by id
+                    response = [respond(fake.node, request) for request in reversed(payload)]
+                else:
+                    response = {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': 'batch requests are not supported'}}
+
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeProvider(BaseProvider):
+
+    """
+    Web3 provider that sends requests to a fake node
+    """
+    def __init__(self, node):
+        self.node = node
+
+    def make_request(self, method, params):
+        self.node.wait()
+        return respond(self.node, {'id': 1, 'method': method, 'params': params})
+
+    def isConnected(self):
+        return True
+
+
+def fake_web3(node):
+    """
+    Web3 instance connected to the fake node
+    """
+    return Web3(FakeProvider(node))
+
+
+def ranges_file(testcase):
+    """
+    Path of a block ranges file in a temporary directory removed after the test,
+    passed as ranges_path so contracts never remember their ranges in app/data
+    :param testcase: Test the directory belongs to
+    :type testcase: unittest.TestCase
+    :return: path to the ranges file
+    :type: str
+    """
+    directory = tempfile.TemporaryDirectory()
+    testcase.addCleanup(directory.cleanup)
+    return os.path.join(directory.name, "block_ranges.json")
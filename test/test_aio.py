@@ -0,0 +1,129 @@
+import unittest
+import asyncio
+import tempfile
+import os
+
+import aiohttp
+from app.aio import instantiate_async_web3, scan_contracts
+from app.classes.async_erc20 import AsyncERC20Contract
+from app.classes.async_erc721 import AsyncERC721Contract
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.holders import aggregate_rows, OwnerIndex
+from app.ordering import ordered_rows
+from app.scheduler import RequestScheduler
+from test.fake_node import FakeNode, FakeNodeServer, fake_web3, generate_chain, TEST_TOKEN, ranges_file
+
+OTHER_TOKEN = "0x00000000000000000000000000000000000000cc"
+
+
+"""
+Unit tests for aio.py and the async contracts
+"""
+class AioTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.ranges_path = ranges_file(self)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_async(self, node, scan):
+        """
+        Runs scan(web3) against the node served over HTTP
+        """
+        async def run(url):
+            async with aiohttp.ClientSession(raise_for_status=True) as session:
+                web3 = await instantiate_async_web3(url, session)
+                return await scan(web3)
+
+        with FakeNodeServer(node) as server:
+            return asyncio.run(run(server.url))
+
+    def sync_rows(self, node, contract_class, address=TEST_TOKEN):
+        """
+        Rows of the transactions file the blocking contract records from the node, in block order
+        """
+        web3 = fake_web3(node)
+        contract = contract_class(web3, web3.toChecksumAddress(address), ranges_path=self.ranges_path)
+        path = os.path.join(self.directory.name, "{}.csv".format(address))
+        contract.record_transactions(from_block=1, block_range=100, output=path)
+        return list(ordered_rows(path, erc721=contract_class is ERC721Contract))
+
+    def test_record_transactions(self):
+        node = FakeNode(max_results=30)
+        transfers = generate_chain(node, blocks=500, transfers_per_block=1, holders=20)
+
+        async def scan(web3):
+            contract = AsyncERC20Contract(web3, TEST_TOKEN)
+            batches = []
+            async for events in contract.record_transactions(from_block=1, block_range=100, workers=2):
+                batches.append(events)
+            return batches
+
+        batches = self.run_async(node, scan)
+        events = [event for batch in batches for event in batch]
+
+        self.assertEqual(len(events), transfers)
+        # windows of 100 blocks have too many logs and are split
+        self.assertEqual(len(batches), 5)
+        self.assertGreater(len(node.calls), 5)
+        blocks = [(event['block_number'], event['log_index']) for event in events]
+        self.assertEqual(blocks, sorted(blocks))
+
+    def test_get_holders_erc20(self):
+        node = FakeNode()
+        generate_chain(node, blocks=400, transfers_per_block=2, holders=30)
+        expected, _ = aggregate_rows(self.sync_rows(node, ERC20Contract))
+
+        async def scan(web3):
+            return await AsyncERC20Contract(web3, TEST_TOKEN).get_holders(from_block=1, block_range=50)
+
+        self.assertEqual(self.run_async(node, scan), expected)
+
+    def test_get_holders_erc721(self):
+        node = FakeNode()
+        generate_chain(node, blocks=400, transfers_per_block=2, holders=30, erc721=True)
+        index = OwnerIndex()
+        index.apply_rows(self.sync_rows(node, ERC721Contract))
+
+        async def scan(web3):
+            return await AsyncERC721Contract(web3, TEST_TOKEN).get_holders(from_block=1, block_range=50, workers=4)
+
+        self.assertEqual(self.run_async(node, scan), index.holders())
+
+    def test_retries(self):
+        node = FakeNode()
+        transfers = generate_chain(node, blocks=100, transfers_per_block=1, holders=10)
+        node.fail_next(2)
+        scheduler = RequestScheduler(backoff=0)
+
+        async def scan(web3):
+            contract = AsyncERC20Contract(web3, TEST_TOKEN, scheduler=scheduler)
+            return [events async for events in contract.record_transactions(from_block=1, to_block=100)]
+
+        batches = self.run_async(node, scan)
+        self.assertEqual(sum(len(events) for events in batches), transfers)
+        self.assertEqual(scheduler.retried, 2)
+
+    def test_scan_contracts(self):
+        node = FakeNode()
+        generate_chain(node, blocks=300, transfers_per_block=1, holders=20)
+        generate_chain(node, blocks=300, transfers_per_block=1, holders=20, address=OTHER_TOKEN, seed=1)
+        expected = {
+            TEST_TOKEN: aggregate_rows(self.sync_rows(node, ERC20Contract))[0],
+            OTHER_TOKEN: aggregate_rows(self.sync_rows(node, ERC20Contract, OTHER_TOKEN))[0],
+        }
+
+        async def scan(web3):
+            contracts = [AsyncERC20Contract(web3, address) for address in (TEST_TOKEN, OTHER_TOKEN)]
+            return await scan_contracts(contracts, from_block=1, block_range=40, concurrency=3)
+
+        holders = self.run_async(node, scan)
+        self.assertEqual(holders, expected)
+        self.assertNotEqual(holders[TEST_TOKEN], holders[OTHER_TOKEN])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from web3 import Web3
+from app.batch import BatchHTTPProvider, batch_request
+from app.ethereum import fetch_batch
+from app.utils import fetch_abi
+from test.fake_node import FakeNode, FakeNodeServer, fake_web3, TEST_TOKEN
+
+SENDER = "0x" + "aa" * 20
+RECEIVER = "0x" + "bb" * 20
+WINDOWS = [(0, 99), (100, 199), (200, 299)]
+
+"""
+Unit tests for batch.py
+"""
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.node = FakeNode(max_results=20)
+        for block in range(0, 300, 5):
+            self.node.add_transfer(block, SENDER, RECEIVER, block)
+
+    def fetch(self, web3):
+        contract = web3.eth.contract(address=TEST_TOKEN, abi=fetch_abi())
+        fetched = fetch_batch(contract.events.Transfer, WINDOWS, address=TEST_TOKEN)
+        return [[event['block_number'] for event in events] for events in fetched]
+
+    def test_windows_in_one_request(self):
+        with FakeNodeServer(self.node) as server:
+            fetched = self.fetch(Web3(BatchHTTPProvider(server.url)))
+
+            self.assertEqual(server.posts, 1)
+            self.assertEqual(fetched, [list(range(start, end + 1, 5)) for start, end in WINDOWS])
+
+    def test_logs_in_batch(self):
+        with FakeNodeServer(self.node) as server:
+            web3 = Web3(BatchHTTPProvider(server.url))
+            logs, = batch_request(web3, [
+                ('eth_getLogs', [{'fromBlock': '0x0', 'toBlock': '0x9'}]),
+            ])
+
+            self.assertEqual(len(logs), 2)
+            self.assertEqual(logs[0]['blockNumber'], 0)
+
+    def test_rejected_batch_falls_back(self):
+        with FakeNodeServer(self.node, batches=False) as server:
+            provider = BatchHTTPProvider(server.url)
+            fetched = self.fetch(Web3(provider))
+
+            self.assertFalse(provider.supports_batch)
+            self.assertEqual(server.posts, 1 + len(WINDOWS))
+            self.assertEqual(fetched, [list(range(start, end + 1, 5)) for start, end in WINDOWS])
+
+    def test_overflowing_window_is_split(self):
+        self.node.max_results = 10
+        fetched = self.fetch(fake_web3(self.node))
+
+        self.assertEqual(fetched, [list(range(start, end + 1, 5)) for start, end in WINDOWS])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from test.benchmark import parser, run, STAGES
+from test.fake_node import FakeNode, generate_chain
+
+
+"""
+Unit tests for benchmark.py and the synthetic chain of fake_node.py
+"""
+class BenchmarkTest(unittest.TestCase):
+    def test_generate_chain(self):
+        node = FakeNode()
+        transfers = generate_chain(node, blocks=1000, transfers_per_block=0.5, holders=20, seed=1)
+
+        self.assertEqual(node.block_number, 1000)
+        self.assertEqual(len(node.logs), transfers)
+        self.assertGreater(transfers, 400)
+        self.assertLess(transfers, 600)
+
+        # the same seed gives the same chain
+        again = FakeNode()
+        generate_chain(again, blocks=1000, transfers_per_block=0.5, holders=20, seed=1)
+        self.assertEqual(again.logs, node.logs)
+
+    def test_erc721_chain(self):
+        node = FakeNode()
+        generate_chain(node, blocks=500, transfers_per_block=2, holders=10, erc721=True)
+
+        owners = {}
+        for log in node.logs:
+            token_id = log['topics'][3]
+            if token_id in owners:
+                # a token is only moved by its owner
+                self.assertEqual(log['topics'][1], owners[token_id])
+            owners[token_id] = log['topics'][2]
+
+    def test_stages(self):
+        (options, args) = parser.parse_args([
+            "--blocks", "300", "--density", "2", "--holders", "30", "--blockrange", "50", "--maxresults", "60"
+        ])
+        measures = run(options)
+
+        self.assertEqual([measure['stage'] for measure in measures], [name for name, _ in STAGES])
+        for measure in measures:
+            self.assertGreater(measure['logs'], 0)
+            self.assertGreater(measure['peak_rss_mb'], 0)
+
+        # windows are split when they return more than 60 logs
+        self.assertGreater(measures[1]['rpc_calls'], 300 // 50)
+        self.assertEqual(measures[3]['rpc_calls'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import tempfile
+import os
+
+from web3 import Web3
+from app.cache import LogCache, CachedProvider
+from app.ethereum import fetch_batch
+from app.utils import fetch_abi
+from test.fake_node import FakeNode, FakeProvider, fake_web3, TEST_TOKEN
+
+SENDER = "0x" + "aa" * 20
+RECEIVER = "0x" + "bb" * 20
+
+"""
+Unit tests for cache.py
+"""
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.node = FakeNode()
+        for block in range(0, 1000, 3):
+            self.node.add_transfer(block, SENDER, RECEIVER, block)
+        self.node.mine(1000)
+
+        self.cache = LogCache(os.path.join(self.directory.name, 'cache', 'logs.sqlite'))
+        self.web3 = Web3(CachedProvider(FakeProvider(self.node), self.cache))
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def get_logs(self, from_block, to_block):
+        self.node.calls = []
+        logs = self.web3.eth.get_logs({'fromBlock': from_block, 'toBlock': to_block, 'address': TEST_TOKEN})
+        expected = fake_web3(self.node).eth.get_logs({'fromBlock': from_block, 'toBlock': to_block, 'address': TEST_TOKEN})
+        self.assertEqual(logs, expected)
+        return self.node.calls.count('eth_getLogs') - 1
+
+    def test_repeated_window_is_cached(self):
+        self.assertEqual(self.get_logs(100, 500), 1)
+        self.assertEqual(self.get_logs(100, 500), 0)
+        # sub ranges of cached windows
+        self.assertEqual(self.get_logs(150, 160), 0)
+
+    def test_overlapping_ranges(self):
+        self.get_logs(100, 300)
+        self.get_logs(500, 600)
+
+        # only the blocks between the cached ranges are fetched
+        self.assertEqual(self.get_logs(50, 700), 3)
+        self.assertEqual(self.get_logs(0, 900), 2)
+        self.assertEqual(self.get_logs(0, 900), 0)
+
+    def test_recent_blocks_are_not_cached(self):
+        # blocks after 1000 - 64 are not final
+        self.assertEqual(self.get_logs(950, 1000), 1)
+        self.assertEqual(self.get_logs(950, 1000), 1)
+
+        self.assertEqual(self.get_logs(800, 1000), 1)
+        self.assertEqual(self.get_logs(800, 936), 0)
+        self.assertEqual(self.get_logs(800, 1000), 1)
+
+    def test_shorter_range_keeps_the_longer_one(self):
+        self.get_logs(100, 500)
+        ranges = self.cache.connection.execute("SELECT key, from_block, to_block FROM ranges").fetchall()
+        self.assertEqual([(start, end) for _, start, end in ranges], [(100, 500)])
+
+        # a range starting at the same block, cached before the head moved
+        self.cache.store(ranges[0][0], 100, 200, [])
+        self.assertEqual(self.get_logs(100, 500), 0)
+
+        # a longer range replaces the ranges inside it
+        self.cache.store(ranges[0][0], 50, 600, [])
+        ranges = self.cache.connection.execute("SELECT from_block, to_block FROM ranges").fetchall()
+        self.assertEqual(ranges, [(50, 600)])
+
+    def test_errors_are_not_cached(self):
+        self.node.max_results = 10
+        with self.assertRaises(ValueError):
+            self.web3.eth.get_logs({'fromBlock': 0, 'toBlock': 500, 'address': TEST_TOKEN})
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_least_recently_used_ranges_are_evicted(self):
+        self.get_logs(0, 99)
+        size = self.cache.size()
+        self.cache.max_size = size * 2
+
+        self.get_logs(200, 299)
+        self.get_logs(0, 99)
+        self.get_logs(400, 499)
+
+        self.assertLessEqual(self.cache.size(), self.cache.max_size)
+        self.assertEqual(self.get_logs(0, 99), 0)
+        self.assertEqual(self.get_logs(200, 299), 1)
+
+    def test_head_error(self):
+        # eth_blockNumber fails, the logs are fetched without the cache
+        self.node.fail_next(1)
+        self.assertEqual(self.get_logs(100, 200), 1)
+        self.assertEqual(self.cache.size(), 0)
+
+        self.assertEqual(self.get_logs(100, 200), 1)
+        self.assertEqual(self.get_logs(100, 200), 0)
+
+    def test_batches(self):
+        contract = self.web3.eth.contract(address=TEST_TOKEN, abi=fetch_abi())
+        windows = [(0, 99), (100, 199), (900, 999)]
+
+        self.node.calls = []
+        first = fetch_batch(contract.events.Transfer, windows, address=TEST_TOKEN)
+        self.assertEqual(self.node.calls.count('eth_getLogs'), 3)
+
+        self.node.calls = []
+        second = fetch_batch(contract.events.Transfer, windows, address=TEST_TOKEN)
+        self.assertEqual(first, second)
+        # the last window is not final
+        self.assertEqual(self.node.calls.count('eth_getLogs'), 1)
+        self.assertEqual([event['block_number'] for event in second[0]], list(range(0, 100, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+import csv
+import os
+from unittest import mock
+
+from app.classes.erc20 import ERC20Contract
+from app.deployment import find_deployment_block, deployment_block, load_deployments
+from test.fake_node import FakeNode, fake_web3, TEST_TOKEN, ranges_file
+
+SENDER = "0x" + "aa" * 20
+RECEIVER = "0x" + "bb" * 20
+
+
+"""
+Unit tests for deployment.py
+"""
+class DeploymentTest(unittest.TestCase):
+    def setUp(self):
+        self.ranges_path = ranges_file(self)
+        self.directory = tempfile.TemporaryDirectory()
+        self.deployments_path = os.path.join(self.directory.name, "deployments.json")
+        self.node = FakeNode(block_number=1000000)
+        self.node.deploy(TEST_TOKEN, 123457)
+        self.web3 = fake_web3(self.node)
+
+        for patched in (
+            mock.patch('app.deployment.DEPLOYMENTS_FILE', self.deployments_path),
+        ):
+            patched.start()
+            self.addCleanup(patched.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find_deployment_block(self):
+        self.assertEqual(find_deployment_block(self.web3, TEST_TOKEN), 123457)
+        # a binary search over a million blocks
+        self.assertLessEqual(self.node.calls.count('eth_getCode'), 22)
+
+    def test_deployment_block_is_remembered(self):
+        self.assertEqual(deployment_block(self.web3, TEST_TOKEN), 123457)
+        self.assertEqual(load_deployments(), {TEST_TOKEN: 123457})
+
+        self.node.calls = []
+        self.assertEqual(deployment_block(self.web3, TEST_TOKEN), 123457)
+        self.assertNotIn('eth_getCode', self.node.calls)
+
+    def test_no_contract(self):
+        with self.assertRaises(ValueError):
+            find_deployment_block(self.web3, "0x" + "cc" * 20)
+
+    def test_full_history(self):
+        node = FakeNode()
+        node.deploy(TEST_TOKEN, 1000)
+        node.add_transfer(1000, SENDER, RECEIVER, 5)
+        node.add_transfer(1001, RECEIVER, SENDER, 1)
+        # a quiet period longer than several windows
+        node.add_transfer(9000, SENDER, RECEIVER, 7)
+        node.mine(12000)
+
+        output = os.path.join(self.directory.name, "transactions.csv")
+        contract = ERC20Contract(fake_web3(node), TEST_TOKEN, ranges_path=self.ranges_path)
+        with mock.patch.object(node, 'get_logs', wraps=node.get_logs) as get_logs:
+            contract.record_transactions(from_block=11500, block_range=500, output=output, full_history=True)
+
+        with open(output) as transactions:
+            values = sorted(int(row['value']) for row in csv.DictReader(transactions))
+        self.assertEqual(values, [1, 5, 7])
+
+        # no window starts before the deployment block
+        from_blocks = [int(call.args[0]['fromBlock'], 16) for call in get_logs.call_args_list]
+        self.assertEqual(min(from_blocks), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
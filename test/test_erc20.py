@@ -1,17 +1,36 @@
 import unittest
 from app.classes.erc20 import ERC20Contract
-from app.config import INFURA_URL
-from app.utils import instantiate_web3
+from test.fake_node import FakeNode, fake_web3, generate_chain, ranges_file
+import tempfile
 import json
+import csv
 import os
 
 TEST_CONTRACT = "0x68749665ff8d2d112fa859aa293f07a622782f38"
 
 class ERC20Test(unittest.TestCase):
+    def setUp(self):
+        # a synthetic history served by an in-memory node instead of Infura
+        self.node = FakeNode()
+        self.transfers = generate_chain(
+            self.node,
+            blocks=60000,
+            transfers_per_block=0.02,
+            holders=50,
+            erc721=False,
+            address=TEST_CONTRACT
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        
+        self.ranges_path = ranges_file(self)
+    
+    def tearDown(self):
+        self.directory.cleanup()
+    
     def setup(self):
-        web3 = instantiate_web3(INFURA_URL)
+        web3 = fake_web3(self.node)
         checksum_address = web3.toChecksumAddress(TEST_CONTRACT)
-        return ERC20Contract(web3, checksum_address, name="TEST")
+        return ERC20Contract(web3, checksum_address, name="TEST", ranges_path=self.ranges_path)
     
     def get_default_abi(self):
         with open("app/abi/default-erc20.json") as f:
@@ -36,26 +55,30 @@ class ERC20Test(unittest.TestCase):
     def test_record_transactions(self):
         contract = self.setup()
         from_block = contract.web3.eth.block_number
+        output = os.path.join(self.directory.name, "TEST_erc_20_transfers_generated.csv")
         
         contract.record_transactions(
             from_block=from_block - 50000,
             to_block=contract.web3.eth.block_number,
             block_range=50000,
-            output="test/expected-data/TEST_erc_20_transfers_generated.csv"
+            output=output
         )
         
         # assert that file exists
-        self.assertTrue(os.path.isfile("test/expected-data/TEST_erc_20_transfers_generated.csv"))
+        self.assertTrue(os.path.isfile(output))
+        
+        with open(output) as transfers:
+            self.assertEqual(len(list(csv.DictReader(transfers))), self.transfers)
     
     def test_get_holders(self):
         contract = self.setup()
         
         contract.get_holders(
             input="test/test-data/TEST_erc_20_transfers.csv",
-            output="test/expected-data/TEST_erc_20_holders_generated.csv"
+            output=os.path.join(self.directory.name, "TEST_erc_20_holders_generated.csv")
         )
 
-        self.assertTrue(os.path.isfile("test/expected-data/TEST_erc_20_holders_generated.csv"))
+        self.assertTrue(os.path.isfile(os.path.join(self.directory.name, "TEST_erc_20_holders_generated.csv")))
 
 
 if __name__ == '__main__':
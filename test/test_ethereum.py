@@ -0,0 +1,130 @@
+import unittest
+import tempfile
+import csv
+import os
+
+from app.ethereum import do_record_transactions, decode_logs
+from app.config import TRANSFER_TOPIC_BYTES
+from app.parallel import split_range
+from app.ranges import AdaptiveBlockRange, is_overflow_error, load_ranges
+from app.utils import fetch_abi
+from test.fake_node import FakeNode, fake_web3, TEST_TOKEN
+
+SENDER = "0x" + "aa" * 20
+RECEIVER = "0x" + "bb" * 20
+
+"""
+Unit tests for ethereum.py
+"""
+class EthereumTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.ranges_path = os.path.join(self.directory.name, "block_ranges.json")
+        self.output = os.path.join(self.directory.name, "transfers.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self, node, from_block, to_block, block_range, workers=1, batch_size=1):
+        web3 = fake_web3(node)
+        contract = web3.eth.contract(address=TEST_TOKEN, abi=fetch_abi())
+        do_record_transactions(
+            TEST_TOKEN,
+            contract,
+            "TEST",
+            initial_from_block=from_block,
+            initial_to_block=to_block,
+            block_range=block_range,
+            output=self.output,
+            ranges_path=self.ranges_path,
+            workers=workers,
+            batch_size=batch_size
+        )
+        with open(self.output) as transactions:
+            return list(csv.DictReader(transactions))
+
+    def test_overflowing_window_is_split(self):
+        node = FakeNode(max_results=10)
+        for block in range(100, 200):
+            node.add_transfer(block, SENDER, RECEIVER, block)
+
+        rows = self.record(node, 100, 199, block_range=100)
+
+        self.assertEqual(len(rows), 100)
+        self.assertEqual(sorted(int(row['block_number']) for row in rows), list(range(100, 200)))
+        self.assertLess(load_ranges(self.ranges_path)[TEST_TOKEN], 100)
+
+    def test_sparse_windows_grow(self):
+        node = FakeNode()
+        for block in range(5000, 10001, 10):
+            node.add_transfer(block, SENDER, RECEIVER, block)
+
+        rows = self.record(node, 9991, 10000, block_range=10)
+
+        self.assertEqual(len(rows), 501)
+        # windows double: 10, 20, 40, ... instead of 500 windows of 10 blocks
+        self.assertLess(node.calls.count('eth_getLogs'), 15)
+        self.assertGreater(load_ranges(self.ranges_path)[TEST_TOKEN], 10)
+
+    def test_parallel_windows_are_ordered(self):
+        node = FakeNode(max_results=20)
+        for block in range(1000, 1400, 2):
+            node.add_transfer(block, SENDER, RECEIVER, block)
+
+        rows = self.record(node, 1000, 1399, block_range=50, workers=4)
+
+        self.assertEqual([int(row['block_number']) for row in rows], list(range(1000, 1400, 2)))
+        self.assertEqual((rows[0]['log_index'], rows[0]['transaction_index']), ('0', '0'))
+
+    def test_batched_windows_are_ordered(self):
+        node = FakeNode(max_results=20)
+        for block in range(1000, 1400, 2):
+            node.add_transfer(block, SENDER, RECEIVER, block)
+
+        rows = self.record(node, 1000, 1399, block_range=50, workers=2, batch_size=3)
+
+        self.assertEqual([int(row['block_number']) for row in rows], list(range(1000, 1400, 2)))
+
+    def test_split_range(self):
+        self.assertEqual(split_range(0, 9, 4), [(0, 3), (4, 7), (8, 9)])
+        self.assertEqual(split_range(5, 5, 100), [(5, 5)])
+
+    def test_remembered_range(self):
+        window = AdaptiveBlockRange(TEST_TOKEN, 1000, path=self.ranges_path)
+        window.shrink()
+        window.save()
+
+        self.assertEqual(AdaptiveBlockRange(TEST_TOKEN, path=self.ranges_path).block_range, 500)
+        self.assertEqual(AdaptiveBlockRange(SENDER, path=self.ranges_path).block_range, 1000)
+
+        # an explicit range wins and replaces the remembered one
+        self.assertEqual(AdaptiveBlockRange(TEST_TOKEN, 200, path=self.ranges_path).block_range, 200)
+        self.assertEqual(load_ranges(self.ranges_path)[TEST_TOKEN], 200)
+        self.assertEqual(AdaptiveBlockRange(TEST_TOKEN, path=self.ranges_path).block_range, 200)
+
+    def test_decode_raw_logs(self):
+        logs = [
+            {
+                'topics': [TRANSFER_TOPIC_BYTES, bytes(12) + bytes.fromhex("aa" * 20), bytes(12) + bytes.fromhex("bb" * 20), (2 ** 255).to_bytes(32, 'big')],
+                'data': '0x',
+                'blockNumber': 7,
+                'logIndex': 3,
+                'transactionIndex': 1,
+            },
+            {'topics': [bytes(32)], 'data': '0x', 'blockNumber': 7, 'logIndex': 4, 'transactionIndex': 1},
+        ]
+
+        events = list(decode_logs(logs, erc721=True))
+
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['from'], "0xaAaAaAaaAaAaAaaAaAAAAAAAAaaaAaAaAaaAaaAa")
+        self.assertEqual(events[0]['tokenId'], 2 ** 255)
+        self.assertEqual((events[0]['block_number'], events[0]['log_index']), (7, 3))
+
+    def test_is_overflow_error(self):
+        self.assertTrue(is_overflow_error(ValueError({'code': -32005, 'message': 'query returned more than 10000 results'})))
+        self.assertFalse(is_overflow_error(ValueError({'code': -32000, 'message': 'header not found'})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+import unittest
+import tempfile
+import csv
+import os
+from unittest import mock
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.follow import BackfillReorged, Follower
+from app.sync import SyncState
+from test.fake_node import FakeNode, fake_web3, TEST_TOKEN, ranges_file
+
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+CAROL = "0x" + "cc" * 20
+DAVE = "0x" + "dd" * 20
+
+
+def chain_holders(node, erc721=False):
+    """
+    Holders of the logs that are on the chain of the fake node
+    """
+    holders = {}
+    owners = {}
+    logs = sorted(node.logs, key=lambda log: (int(log['blockNumber'], 16), int(log['logIndex'], 16)))
+    for log in logs:
+        from_, to = "0x" + log['topics'][1][-40:], "0x" + log['topics'][2][-40:]
+        if erc721:
+            owners[str(int(log['topics'][3], 16))] = to
+            holders.setdefault(from_, None)
+            holders.setdefault(to, None)
+        else:
+            value = int(log['data'], 16)
+            holders[from_] = holders.get(from_, 0) - value
+            holders[to] = holders.get(to, 0) + value
+    if erc721:
+        return {address: sorted(token for token, owner in owners.items() if owner == address) for address in holders}
+    return holders
+
+
+def follower_holders(follower, erc721=False):
+    if erc721:
+        return {address.lower(): sorted(holder['tokens']) for address, holder in follower.holders().items()}
+    return {address.lower(): holder['balance'] for address, holder in follower.holders().items()}
+
+
+"""
+Unit tests for follow.py
+"""
+class FollowTest(unittest.TestCase):
+    def setUp(self):
+        self.node = FakeNode()
+        self.ranges_path = ranges_file(self)
+
+    def follower(self, erc721=False, reorg_depth=64):
+        contract_class = ERC721Contract if erc721 else ERC20Contract
+        contract = contract_class(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        return Follower(
+            contract.to_token_contract(),
+            TEST_TOKEN,
+            from_block=1,
+            erc721=erc721,
+            reorg_depth=reorg_depth,
+            ranges_path=self.ranges_path
+        )
+
+    def test_scripted_chain_with_reorgs(self):
+        follower = self.follower()
+        script = [
+            lambda: [self.node.add_transfer(block, ALICE, BOB, 10 * block) for block in range(1, 6)],
+            lambda: [self.node.add_transfer(6, BOB, CAROL, 7), self.node.add_transfer(7, BOB, ALICE, 3)],
+            # blocks 6 and 7 are replaced, DAVE only appears in the new chain
+            lambda: [self.node.reorg(6), self.node.add_transfer(6, BOB, DAVE, 1), self.node.mine(9)],
+            lambda: self.node.mine(12),
+            # blocks after the last transfer are replaced
+            lambda: [self.node.reorg(8), self.node.add_transfer(10, DAVE, CAROL, 1)],
+            # the new chain drops DAVE again
+            lambda: [self.node.reorg(6), self.node.mine(11)],
+        ]
+
+        for step in script:
+            step()
+            follower.poll()
+            self.assertEqual(follower.synced_to, self.node.block_number)
+            self.assertEqual(follower_holders(follower), chain_holders(self.node))
+
+    def test_poll_is_cheap_without_new_blocks(self):
+        follower = self.follower()
+        self.node.add_transfer(3, ALICE, BOB, 1)
+        follower.poll()
+
+        self.node.calls = []
+        self.assertEqual(follower.poll(), 0)
+        self.assertNotIn('eth_getLogs', self.node.calls)
+
+    def test_erc721_reorg(self):
+        follower = self.follower(erc721=True)
+        self.node.add_transfer(1, ALICE, BOB, 1, erc721=True)
+        self.node.add_transfer(2, BOB, CAROL, 1, erc721=True)
+        follower.poll()
+
+        self.node.reorg(2)
+        self.node.add_transfer(2, BOB, DAVE, 1, erc721=True)
+        self.node.add_transfer(3, ALICE, CAROL, 2, erc721=True)
+        follower.poll()
+        self.assertEqual(follower_holders(follower, erc721=True), chain_holders(self.node, erc721=True))
+
+        self.node.reorg(2)
+        self.node.mine(4)
+        follower.poll()
+        self.assertEqual(follower_holders(follower, erc721=True), chain_holders(self.node, erc721=True))
+
+    def test_reorg_below_the_remembered_blocks(self):
+        follower = self.follower()
+        self.node.add_transfer(2, ALICE, BOB, 1)
+        self.node.mine(10)
+        follower.poll()
+
+        # every block after the fork is replaced, only the anchor is still on the chain
+        self.node.reorg(1)
+        self.node.add_transfer(3, ALICE, CAROL, 4)
+        self.node.mine(12)
+        follower.poll()
+        self.assertEqual(follower.synced_to, 12)
+        self.assertEqual(follower_holders(follower), chain_holders(self.node))
+
+    def test_reorg_deeper_than_depth(self):
+        follower = self.follower(reorg_depth=3)
+        self.node.add_transfer(2, ALICE, BOB, 1)
+        self.node.mine(5)
+        follower.poll()
+        self.node.add_transfer(6, BOB, CAROL, 1)
+        self.node.mine(10)
+        follower.poll()
+
+        # block 5, the newest block deeper than 3 blocks, is replaced too
+        self.node.reorg(4)
+        self.node.mine(10)
+        with self.assertRaisesRegex(ValueError, "deeper"):
+            follower.poll()
+
+    def test_backfill_reorg(self):
+        for block in range(1, 11):
+            self.node.add_transfer(block, ALICE, BOB, 5)
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        follower = Follower(contract.to_token_contract(), TEST_TOKEN, from_block=11, holders={
+            ALICE: {'address': ALICE, 'balance': -50}, BOB: {'address': BOB, 'balance': 50}
+        }, ranges_path=self.ranges_path)
+        follower.poll()
+
+        # the follower cannot roll back the blocks of the backfill
+        self.node.reorg(10)
+        self.node.mine(12)
+        with self.assertRaises(BackfillReorged):
+            follower.poll()
+
+    def test_oversized_windows_are_split(self):
+        self.node.max_results = 4
+        for block in range(1, 41):
+            self.node.add_transfer(block, ALICE, BOB, block)
+        follower = self.follower()
+
+        self.assertEqual(follower.poll(), 40)
+        self.assertEqual(follower_holders(follower), chain_holders(self.node))
+        self.assertLess(follower.window.block_range, 40)
+
+    def test_transient_errors(self):
+        follower = self.follower()
+        self.node.add_transfer(1, ALICE, BOB, 5)
+
+        # rate limits are retried on the next poll
+        self.node.fail_next(1)
+        follower.run(poll_interval=0, polls=2)
+        self.assertEqual(follower_holders(follower), chain_holders(self.node))
+
+        self.node.fail_next(1, code=-32602, message="invalid argument")
+        with self.assertRaises(ValueError):
+            follower.run(poll_interval=0, polls=1)
+
+    def test_follow_transfers(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        transactions = os.path.join(directory.name, "transfers.csv")
+        holders = os.path.join(directory.name, "holders.csv")
+
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        self.node.add_transfer(1, ALICE, BOB, 5)
+        contract.sync_transactions(from_block=0, to_block=1, block_range=10, output=transactions)
+        contract.get_holders(input=transactions, output=holders, incremental=True)
+
+        self.node.add_transfer(3, BOB, CAROL, 2)
+        follower = contract.follow_transfers(input=transactions, output=holders, poll_interval=0, polls=1)
+
+        self.assertEqual(follower.synced_to, 3)
+        with open(holders) as rows:
+            balances = {row['address'].lower(): int(row['balance']) for row in csv.DictReader(rows)}
+        self.assertEqual(balances, chain_holders(self.node))
+        # the holders file is ahead of the transactions file
+        self.assertIsNone(SyncState.load(transactions).holders)
+
+    def sync(self, directory, blocks=10):
+        """
+        Syncs blocks of ALICE sending 5 to BOB, returns the contract and the transactions and holders paths
+        """
+        transactions = os.path.join(directory, "transfers.csv")
+        holders = os.path.join(directory, "holders.csv")
+
+        for block in range(1, blocks + 1):
+            self.node.add_transfer(block, ALICE, BOB, 5)
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        contract.sync_transactions(from_block=1, block_range=4, output=transactions)
+        contract.get_holders(input=transactions, output=holders, incremental=True)
+        return contract, transactions, holders
+
+    def read_balances(self, holders):
+        with open(holders) as rows:
+            return {row['address'].lower(): int(row['balance']) for row in csv.DictReader(rows)}
+
+    def test_follow_after_backfill_reorg(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        contract, transactions, holders = self.sync(directory.name)
+
+        # the last synced block is replaced before following
+        self.node.reorg(10)
+        self.node.add_transfer(10, ALICE, BOB, 7)
+        follower = contract.follow_transfers(input=transactions, output=holders, poll_interval=0, polls=3)
+
+        self.assertEqual(follower_holders(follower), {ALICE: -52, BOB: 52})
+        self.assertEqual(self.read_balances(holders), {ALICE: -52, BOB: 52})
+        # the rows of the reorged block were synced again
+        contract.get_holders(input=transactions, output=holders)
+        self.assertEqual(self.read_balances(holders), {ALICE: -52, BOB: 52})
+
+    def test_backfill_reorged_while_following(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        contract, transactions, holders = self.sync(directory.name)
+
+        def reorg(seconds):
+            if not self.node.reorgs:
+                self.node.reorg(10)
+                self.node.add_transfer(11, BOB, CAROL, 1)
+                self.node.mine(12)
+
+        with mock.patch('app.follow.time.sleep', side_effect=reorg):
+            follower = contract.follow_transfers(input=transactions, output=holders, poll_interval=0, polls=2)
+
+        self.assertEqual(follower.synced_to, 12)
+        self.assertEqual(follower_holders(follower), chain_holders(self.node))
+        self.assertEqual(SyncState.load(transactions).synced_to, 12)
+
+    def test_follow_needs_a_sync(self):
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        with self.assertRaises(ValueError):
+            contract.follow_transfers(input=os.path.join(tempfile.gettempdir(), "never-synced.csv"), polls=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import tempfile
+import random
+import csv
+import os
+
+import ast
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.holders import BalanceAggregator, OwnerIndex, aggregate_rows, decimal_limbs
+
+TEST_TOKEN = "0x68749665FF8D2d112Fa859AA293F07A622782F38"
+ADDRESSES = ["0x{:040x}".format(number) for number in range(1, 30)]
+
+"""
+Unit tests for holders.py
+"""
+class HoldersTest(unittest.TestCase):
+    def test_decimal_limbs(self):
+        limbs = decimal_limbs([0, 2 ** 256 - 1])
+        self.assertEqual(limbs.shape, (2, 9))
+        self.assertEqual(limbs[0].tolist(), [0] * 9)
+        self.assertEqual(int(''.join('{:09d}'.format(limb) for limb in limbs[1].tolist())), 2 ** 256 - 1)
+
+    def test_uint256_balances_are_exact(self):
+        generator = random.Random(1)
+        expected = {}
+        rows = []
+        for _ in range(2000):
+            from_, to = generator.choice(ADDRESSES), generator.choice(ADDRESSES)
+            value = generator.randrange(2 ** 256)
+            rows.append([from_, to, str(value), '1'])
+            expected[from_] = expected.get(from_, 0) - value
+            expected[to] = expected.get(to, 0) + value
+
+        holders, count = aggregate_rows([['from', 'to', 'value', 'block_number']] + rows, batch_size=300)
+
+        self.assertEqual(count, 2000)
+        self.assertEqual({address: holder['balance'] for address, holder in holders.items()}, expected)
+
+    def test_initial_balances(self):
+        aggregator = BalanceAggregator({ADDRESSES[0]: 10})
+        aggregator.add_rows([[ADDRESSES[0], ADDRESSES[1], '4', '1']])
+
+        self.assertEqual(aggregator.balances, {ADDRESSES[0]: 6, ADDRESSES[1]: 4})
+
+    def test_holders_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "holders.csv")
+            contract = ERC20Contract(None, TEST_TOKEN, name="TEST")
+            contract.get_holders(input="test/test-data/TEST_erc_20_transfers.csv", output=output)
+
+            with open(output) as holders:
+                balances = {row['address']: row['balance'] for row in csv.DictReader(holders)}
+
+        with open("test/test-data/TEST_erc_20_holders.csv") as holders:
+            # the expected file still has a row for the header of the transfers file
+            expected = {row['address']: row['balance'] for row in csv.DictReader(holders) if row['address'] != 'to'}
+
+        self.assertEqual(balances, expected)
+
+    def test_owner_index(self):
+        index = OwnerIndex()
+        index.apply_rows([
+            ['from', 'to', 'tokenId', 'block_number'],
+            [ADDRESSES[0], ADDRESSES[1], '7', '1'],
+            [ADDRESSES[0], ADDRESSES[1], '8', '2'],
+            [ADDRESSES[1], ADDRESSES[2], '7', '3'],
+        ])
+
+        self.assertEqual(index.owner_of(7), ADDRESSES[2])
+        self.assertEqual(index.tokens_of(ADDRESSES[1]), ['8'])
+        self.assertEqual(index.tokens_of(ADDRESSES[0]), [])
+
+        rebuilt = OwnerIndex.from_holders(index.holders())
+        self.assertEqual(rebuilt.owner_of(8), ADDRESSES[1])
+        self.assertEqual(rebuilt.holders(), index.holders())
+
+    def test_self_transfer_keeps_token(self):
+        index = OwnerIndex()
+        index.transfer(ADDRESSES[0], ADDRESSES[1], '7')
+        index.transfer(ADDRESSES[1], ADDRESSES[1], '7')
+
+        self.assertEqual(index.tokens_of(ADDRESSES[1]), ['7'])
+
+    def test_erc721_holders_file(self):
+        transfers = "test/test-data/TEST_erc_721_transfers.csv"
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "holders.csv")
+            contract = ERC721Contract(None, TEST_TOKEN, name="TEST")
+            contract.get_holders(input=transfers, output=output)
+
+            with open(output) as holders:
+                tokens = {row['address']: ast.literal_eval(row['tokens']) for row in csv.DictReader(holders)}
+
+        # every token belongs to the receiver of its last transfer
+        with open(transfers) as rows:
+            owners = {}
+            for row in sorted(csv.DictReader(rows), key=lambda row: row['block_number']):
+                owners[row['tokenId']] = row['to']
+
+        self.assertEqual(
+            {(token_id, address) for address, token_ids in tokens.items() for token_id in token_ids},
+            set(owners.items())
+        )
+        self.assertEqual(contract.owner_of(5732), "0x5f355688dc460649738fAaBaf55067338b1a7DA2")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import tempfile
+import os
+import subprocess
+import sys
+import csv
+import json
+import shutil
+
+from app.utils import fetch_abi, load_abi
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs main with the arguments of argv, then prints the heavy modules it imported
+OFFLINE_RUN = """
+import sys
+sys.path.insert(0, {root!r})
+import main
+(options, args) = main.parser.parse_args(sys.argv[1:])
+main.run(options)
+print("imported:", sorted(module for module in ('web3', 'pyarrow', 'requests', 'numpy') if module in sys.modules))
+"""
+
+
+"""
+Unit tests for main.py and the startup of the cli
+"""
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.directory.name, "app", "data"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_main(self, *arguments):
+        # no node url, nothing can be asked to a node
+        environment = dict(os.environ, INFURA_URL="", RPC_URLS="")
+        result = subprocess.run(
+            [sys.executable, "-c", OFFLINE_RUN.format(root=ROOT)] + list(arguments),
+            cwd=self.directory.name,
+            env=environment,
+            capture_output=True,
+            text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_abi_is_parsed_once(self):
+        self.assertIs(fetch_abi(), fetch_abi())
+        self.assertIs(fetch_abi(erc721=True), load_abi('default-erc721.json'))
+        self.assertIsNot(fetch_abi(), fetch_abi(erc721=True))
+
+    def test_offline_infile(self):
+        infile = os.path.join(ROOT, "test", "test-data", "TEST_erc_20_transfers.csv")
+        output = self.run_main("-i", infile, "-n", "offline")
+
+        # only the balances need numpy
+        self.assertIn("imported: ['numpy']", output)
+        with open(os.path.join(self.directory.name, "app", "data", "offline_erc20_transactions_holders.csv")) as holders:
+            self.assertGreater(len(list(csv.reader(holders))), 1)
+
+    def test_offline_infile_erc721(self):
+        infile = os.path.join(ROOT, "test", "test-data", "TEST_erc_721_transfers.csv")
+        output = self.run_main("-i", infile, "-n", "offline", "-c", "true")
+
+        self.assertIn("imported: []", output)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory.name, "app", "data", "offline_erc721_transfers_holders.csv")))
+
+    def test_offline_manifest(self):
+        manifest = os.path.join(self.directory.name, "manifest.json")
+        with open(manifest, "w") as contracts:
+            json.dump([
+                {"name": "first", "type": "ERC20", "address": "0x" + "11" * 20},
+                {"name": "second", "type": "ERC721", "address": "0x" + "22" * 20},
+            ], contracts)
+
+        infile = os.path.join(self.directory.name, "transactions")
+        os.makedirs(infile)
+        shutil.copy(os.path.join(ROOT, "test", "test-data", "TEST_erc_20_transfers.csv"),
+                    os.path.join(infile, "first_erc20_transactions.csv"))
+        shutil.copy(os.path.join(ROOT, "test", "test-data", "TEST_erc_721_transfers.csv"),
+                    os.path.join(infile, "second_erc721_transfers.csv"))
+
+        output = self.run_main("-m", manifest, "-i", infile, "-o", "holders")
+
+        self.assertIn("imported: ['numpy']", output)
+        for holders in ("first_erc20_transactions_holders.csv", "second_erc721_transfers_holders.csv"):
+            self.assertTrue(os.path.exists(os.path.join(self.directory.name, "holders", holders)))
+
+
+if __name__ == '__main__':
+    unittest.main()
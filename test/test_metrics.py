@@ -0,0 +1,114 @@
+import unittest
+import tempfile
+import json
+import os
+from urllib.request import urlopen
+
+from web3 import Web3
+from app.classes.erc20 import ERC20Contract
+from app.metrics import Metrics, METRICS, NO_TIMER, SIZE_BUCKETS, serve_metrics
+from app.scheduler import RequestScheduler, ScheduledProvider
+from test.fake_node import FakeNode, FakeProvider, generate_chain, TEST_TOKEN, ranges_file
+
+
+"""
+Unit tests for metrics.py
+"""
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.ranges_path = ranges_file(self)
+
+    def tearDown(self):
+        METRICS.enabled = False
+        METRICS.reset()
+        self.directory.cleanup()
+
+    def test_disabled(self):
+        metrics = Metrics()
+        metrics.count('rpc_calls', method='eth_getLogs')
+        metrics.observe('rpc_seconds', 0.1)
+
+        self.assertIs(metrics.timer('decode_seconds'), NO_TIMER)
+        self.assertEqual(metrics.counters, {})
+        self.assertEqual(metrics.histograms, {})
+
+    def test_counters_and_histograms(self):
+        metrics = Metrics(enabled=True)
+        metrics.count('rpc_calls', method='eth_getLogs')
+        metrics.count('rpc_calls', 2, method='eth_getLogs')
+        metrics.count('rpc_calls', method='eth_blockNumber')
+        for size in (5, 50, 50, 5000):
+            metrics.observe('window_logs', size, buckets=SIZE_BUCKETS)
+        with metrics.timer('decode_seconds'):
+            pass
+
+        summary = metrics.to_dict()
+        counters = {(counter['name'], counter['labels'].get('method')): counter['value'] for counter in summary['counters']}
+        self.assertEqual(counters[('rpc_calls', 'eth_getLogs')], 3)
+        self.assertEqual(counters[('rpc_calls', 'eth_blockNumber')], 1)
+
+        histograms = {histogram['name']: histogram for histogram in summary['histograms']}
+        self.assertEqual(histograms['window_logs']['count'], 4)
+        self.assertEqual(histograms['window_logs']['sum'], 5105)
+        self.assertEqual(histograms['window_logs']['buckets']['10'], 1)
+        self.assertEqual(histograms['window_logs']['buckets']['100'], 3)
+        self.assertEqual(histograms['window_logs']['buckets']['+Inf'], 4)
+        self.assertEqual(histograms['decode_seconds']['count'], 1)
+
+        text = metrics.prometheus()
+        self.assertIn('# TYPE holders_rpc_calls_total counter', text)
+        self.assertIn('holders_rpc_calls_total{method="eth_getLogs"} 3', text)
+        self.assertIn('# TYPE holders_window_logs histogram', text)
+        self.assertIn('holders_window_logs_bucket{le="1000"} 3', text)
+        self.assertIn('holders_window_logs_bucket{le="+Inf"} 4', text)
+        self.assertIn('holders_window_logs_count 4', text)
+
+    def test_record_stages(self):
+        node = FakeNode(max_results=40)
+        transfers = generate_chain(node, blocks=600, transfers_per_block=1, holders=20)
+        node.fail_next(1)
+        scheduler = RequestScheduler(sleep=lambda seconds: None)
+        web3 = Web3(ScheduledProvider(FakeProvider(node), scheduler))
+        contract = ERC20Contract(web3, TEST_TOKEN, ranges_path=self.ranges_path)
+
+        METRICS.enable()
+        transactions = os.path.join(self.directory.name, "transactions.csv")
+        contract.record_transactions(from_block=1, block_range=100, output=transactions)
+        contract.get_holders(input=transactions, output=os.path.join(self.directory.name, "holders.csv"))
+        path = os.path.join(self.directory.name, "metrics.json")
+        METRICS.save(path)
+
+        with open(path) as metrics:
+            metrics = json.load(metrics)
+        counters = {(counter['name'], counter['labels'].get('method')): counter['value'] for counter in metrics['counters']}
+        histograms = {(histogram['name'], histogram['labels'].get('stage')): histogram for histogram in metrics['histograms']}
+
+        self.assertEqual(counters[('logs_decoded', None)], transfers)
+        self.assertEqual(counters[('rows_applied', None)], transfers)
+        self.assertEqual(counters[('rpc_retries', None)], 1)
+        self.assertGreater(counters[('window_splits', None)], 0)
+        self.assertGreater(counters[('rpc_calls', 'eth_getLogs')], 6)
+        self.assertEqual(histograms[('window_logs', None)]['sum'], transfers)
+        self.assertEqual(histograms[('stage_seconds', 'record')]['count'], 1)
+        self.assertIn(('rpc_seconds', None), histograms)
+
+        decode_seconds = histograms[('decode_seconds', None)]['sum']
+        self.assertAlmostEqual(metrics['rates']['logs_decoded_per_second'], transfers / decode_seconds)
+        self.assertGreater(metrics['rates']['rpc_calls_per_second'], 0)
+        self.assertIn('# TYPE holders_logs_decoded_per_second gauge', METRICS.prometheus())
+
+    def test_serve_metrics(self):
+        metrics = Metrics(enabled=True)
+        metrics.count('reorgs')
+        server = serve_metrics(0, metrics, host='127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with urlopen('http://127.0.0.1:{}/metrics'.format(server.server_address[1])) as response:
+            self.assertIn('holders_reorgs_total 1', response.read().decode())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import tempfile
+import json
+import csv
+import os
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.multi import load_contracts, do_record_contracts
+from test.fake_node import FakeNode, fake_web3, TEST_TOKEN, ranges_file
+
+TEST_NFT = "0x1CB1A5e65610AEFF2551A50f76a87a7d3fB649C6"
+OTHER_TOKEN = "0x999e88075692bCeE3dBC07e7E64cD32f39A1D3ab"
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+
+"""
+Unit tests for multi.py
+"""
+class MultiTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.ranges_path = ranges_file(self)
+
+        self.manifest = os.path.join(self.directory.name, "contracts.json")
+        with open(self.manifest, "w") as manifest:
+            json.dump([
+                {"name": "Gold", "type": "ERC20", "symbol": "GLD", "address": TEST_TOKEN.lower()},
+                {"name": "Toadz", "type": "ERC721", "symbol": "TOADZ", "address": TEST_NFT},
+            ], manifest)
+
+    def read(self, path):
+        with open(path) as transactions:
+            return list(csv.DictReader(transactions))
+
+    def test_load_contracts(self):
+        contracts = load_contracts(fake_web3(FakeNode()), self.manifest, ranges_path=self.ranges_path)
+
+        self.assertIsInstance(contracts[0], ERC20Contract)
+        self.assertIsInstance(contracts[1], ERC721Contract)
+        self.assertEqual(contracts[0].address, TEST_TOKEN)
+        self.assertEqual(contracts[1].name, "Toadz")
+
+    def test_one_scan_for_all_contracts(self):
+        node = FakeNode()
+        for block in range(0, 100, 10):
+            node.add_transfer(block, ALICE, BOB, block + 1)
+            node.add_transfer(block, BOB, ALICE, block, address=TEST_NFT, erc721=True)
+            node.add_transfer(block, ALICE, BOB, 5, address=OTHER_TOKEN)
+
+        web3 = fake_web3(node)
+        contracts = load_contracts(web3, self.manifest, ranges_path=self.ranges_path)
+        paths = do_record_contracts(contracts, 0, 99, block_range=50, output_dir=self.directory.name)
+
+        self.assertEqual(node.calls.count('eth_getLogs'), 2)
+
+        transfers = self.read(paths[TEST_TOKEN])
+        self.assertEqual([row['value'] for row in transfers], [str(block + 1) for block in range(0, 100, 10)])
+
+        nfts = self.read(paths[TEST_NFT])
+        self.assertEqual([row['tokenId'] for row in nfts], [str(block) for block in range(0, 100, 10)])
+        self.assertEqual(os.path.basename(paths[TEST_NFT]), "Toadz_erc721_transfers.csv")
+
+
+if __name__ == '__main__':
+    unittest.main()
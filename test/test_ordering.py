@@ -0,0 +1,96 @@
+import unittest
+import tempfile
+import os
+
+from unittest import mock
+
+from app.ordering import ordered_rows, find_runs, external_sort, sort_key
+from app.parquet import has_pyarrow, find_parquet_runs
+from app.writers import CSVTransferWriter
+
+SENDER = "0x" + "aa" * 20
+RECEIVER = "0x" + "bb" * 20
+
+"""
+Unit tests for ordering.py
+"""
+class OrderingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "transfers.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, windows):
+        with CSVTransferWriter(self.path) as writer:
+            for window in windows:
+                writer.write(
+                    {'from': SENDER, 'to': RECEIVER, 'value': 1, 'block_number': block, 'log_index': log_index}
+                    for block, log_index in window
+                )
+
+    def write_parquet(self, windows, chunk_size=2):
+        from app.parquet import ParquetTransferWriter
+
+        self.path = os.path.join(self.directory.name, "transfers.parquet")
+        with ParquetTransferWriter(self.path, chunk_size=chunk_size) as writer:
+            for window in windows:
+                writer.write(
+                    {'from': SENDER, 'to': RECEIVER, 'value': 1, 'block_number': block, 'log_index': log_index}
+                    for block, log_index in window
+                )
+
+    def keys(self, rows):
+        return [sort_key(row) for row in rows]
+
+    def test_windows_are_read_in_order(self):
+        # windows written walking back from the latest block
+        self.write([[(20, 0), (20, 3), (25, 1)], [(10, 5), (12, 0)], [(1, 0)]])
+
+        self.assertEqual(len(find_runs(self.path)), 3)
+        self.assertEqual(
+            self.keys(ordered_rows(self.path)),
+            [(1, 0), (10, 5), (12, 0), (20, 0), (20, 3), (25, 1)]
+        )
+
+    def test_same_block_is_ordered_by_log_index(self):
+        self.write([[(5, 2)], [(5, 0), (5, 1)]])
+
+        self.assertEqual(self.keys(ordered_rows(self.path)), [(5, 0), (5, 1), (5, 2)])
+
+    def test_overlapping_windows_are_merge_sorted(self):
+        self.write([[(1, 0), (9, 0), (30, 0)], [(2, 0), (8, 0)], [(3, 0), (31, 0)]])
+
+        self.assertEqual(
+            self.keys(ordered_rows(self.path, memory_rows=2)),
+            [(1, 0), (2, 0), (3, 0), (8, 0), (9, 0), (30, 0), (31, 0)]
+        )
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_parquet_windows_are_read_in_order(self):
+        # row groups of 2 rows, a window spans row groups and a row group spans windows
+        self.write_parquet([[(20, 0), (20, 3), (25, 1)], [(10, 5), (12, 0)], [(1, 0)]])
+
+        self.assertEqual(len(find_parquet_runs(self.path)), 5)
+        with mock.patch('app.ordering.external_sort') as external_sort:
+            keys = self.keys(ordered_rows(self.path))
+        external_sort.assert_not_called()
+        self.assertEqual(keys, [(1, 0), (10, 5), (12, 0), (20, 0), (20, 3), (25, 1)])
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_overlapping_parquet_windows_are_merge_sorted(self):
+        self.write_parquet([[(1, 0), (9, 0), (30, 0)], [(2, 0), (8, 0)], [(3, 0), (31, 0)]], chunk_size=10)
+
+        rows = list(ordered_rows(self.path, memory_rows=2))
+        self.assertEqual(self.keys(rows), [(1, 0), (2, 0), (3, 0), (8, 0), (9, 0), (30, 0), (31, 0)])
+        self.assertEqual([rows[0][0].lower(), rows[0][1].lower(), int(rows[0][2])], [SENDER, RECEIVER, 1])
+
+    def test_external_sort_spills_chunks(self):
+        rows = [[SENDER, RECEIVER, '1', str(block), '0'] for block in range(100, 0, -1)]
+
+        self.assertEqual([int(row[3]) for row in external_sort(rows, memory_rows=7)], list(range(1, 101)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import tempfile
+import threading
+import time
+import csv
+import os
+from unittest import mock
+
+from requests.exceptions import ConnectionError
+from web3 import Web3
+from app.classes.erc20 import ERC20Contract
+from app.pool import ProviderPool, MIN_HEDGE_SAMPLES
+from app.scheduler import RequestScheduler, ScheduledProvider
+from test.fake_node import FakeNode, FakeProvider, TEST_TOKEN, ranges_file
+
+SENDER = "0x" + "aa" * 20
+RECEIVER = "0x" + "bb" * 20
+
+
+class SlowProvider(FakeProvider):
+
+    """
+    Fake provider with a latency, that can be made to fail or stall
+    """
+    def __init__(self, node, latency=0.0):
+        super().__init__(node)
+        self.latency = latency
+        self.down = False
+        self.stalls = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def make_request(self, method, params):
+        with self.lock:
+            self.requests += 1
+            stall = self.stalls > 0
+            self.stalls -= 1 if stall else 0
+
+        time.sleep(1.0 if stall else self.latency)
+        if self.down:
+            raise ConnectionError("connection refused")
+        return super().make_request(method, params)
+
+
+"""
+Unit tests for pool.py
+"""
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.node = FakeNode()
+        self.ranges_path = ranges_file(self)
+        for block in range(0, 100, 2):
+            self.node.add_transfer(block, SENDER, RECEIVER, block)
+
+    def get_logs(self, web3, from_block=0, to_block=99):
+        return web3.eth.get_logs({'fromBlock': from_block, 'toBlock': to_block, 'address': TEST_TOKEN})
+
+    def test_faster_endpoint_gets_more_requests(self):
+        slow, fast = SlowProvider(self.node, 0.02), SlowProvider(self.node, 0.001)
+        web3 = Web3(ProviderPool([slow, fast]))
+
+        for _ in range(30):
+            self.assertEqual(len(self.get_logs(web3)), 50)
+
+        self.assertGreater(fast.requests, 3 * slow.requests)
+        self.assertGreaterEqual(slow.requests, 1)
+
+    def test_concurrent_requests_are_spread(self):
+        providers = [SlowProvider(self.node, 0.01) for _ in range(3)]
+        web3 = Web3(ProviderPool(providers))
+
+        threads = [threading.Thread(target=self.get_logs, args=(web3,)) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(provider.requests >= 1 for provider in providers))
+
+    def test_unhealthy_endpoint_is_left_out(self):
+        down, up = SlowProvider(self.node), SlowProvider(self.node)
+        down.down = True
+        pool = ProviderPool([down, up])
+        web3 = Web3(ScheduledProvider(pool, RequestScheduler(sleep=lambda seconds: None)))
+
+        for _ in range(20):
+            self.assertEqual(len(self.get_logs(web3)), 50)
+
+        self.assertLessEqual(down.requests, 3)
+        self.assertEqual(pool.stats()[1]['requests'], up.requests)
+
+    def test_hedged_request(self):
+        first, second = SlowProvider(self.node, 0.005), SlowProvider(self.node, 0.01)
+        bucket = mock.Mock()
+        pool = ProviderPool([first, second], hedge=True, bucket=bucket)
+        web3 = Web3(pool)
+
+        for _ in range(MIN_HEDGE_SAMPLES):
+            self.get_logs(web3)
+
+        # the faster endpoint is picked first and stalls
+        first.stalls = 1
+        start = time.monotonic()
+        self.assertEqual(len(self.get_logs(web3)), 50)
+
+        # one endpoint stalled, the hedged request answered
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(pool.hedged, 1)
+        # the hedged request took a token from the rate limit
+        bucket.acquire.assert_called_once_with()
+
+    def test_contracts_work_unchanged(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        providers = [SlowProvider(self.node) for _ in range(2)]
+        web3 = Web3(ScheduledProvider(ProviderPool(providers), RequestScheduler()))
+        output = os.path.join(directory.name, "transfers.csv")
+
+        contract = ERC20Contract(web3, TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        contract.record_transactions(from_block=0, to_block=99, block_range=10, output=output, workers=2, batch_size=2)
+
+        with open(output) as transactions:
+            self.assertEqual(sorted(int(row['block_number']) for row in csv.DictReader(transactions)), list(range(0, 100, 2)))
+        self.assertTrue(all(provider.requests > 0 for provider in providers))
+
+
+if __name__ == '__main__':
+    unittest.main()
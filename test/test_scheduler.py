@@ -0,0 +1,173 @@
+import unittest
+import tempfile
+import csv
+import os
+
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+from requests.models import Response
+from web3 import Web3
+from app.batch import BatchHTTPProvider
+from app.classes.erc20 import ERC20Contract
+from app.ethereum import fetch_batch
+from app.scheduler import TokenBucket, RequestScheduler, ScheduledProvider, RetriesExhausted, is_retryable
+from app.utils import fetch_abi
+from test.fake_node import FakeNode, FakeNodeServer, FakeProvider, fake_web3, TEST_TOKEN, ranges_file
+
+SENDER = "0x" + "aa" * 20
+RECEIVER = "0x" + "bb" * 20
+
+
+def http_error(status):
+    response = Response()
+    response.status_code = status
+    return HTTPError(response=response)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+"""
+Unit tests for scheduler.py
+"""
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.node = FakeNode()
+        for block in range(0, 100, 2):
+            self.node.add_transfer(block, SENDER, RECEIVER, block)
+
+        self.ranges_path = ranges_file(self)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, burst=2, clock=clock, sleep=clock.sleep)
+
+        for _ in range(6):
+            bucket.acquire()
+
+        # the burst goes at once, then one request every 0.1s
+        self.assertAlmostEqual(clock.now, 0.4)
+        self.assertEqual(len(clock.sleeps), 4)
+
+        clock.now += 10
+        bucket.acquire()
+        self.assertEqual(len(clock.sleeps), 4)
+
+    def test_is_retryable(self):
+        self.assertTrue(is_retryable(Timeout()))
+        self.assertTrue(is_retryable(ConnectionError()))
+        self.assertTrue(is_retryable(http_error(429)))
+        self.assertTrue(is_retryable(http_error(503)))
+        self.assertFalse(is_retryable(http_error(401)))
+        self.assertTrue(is_retryable({'code': -32005, 'message': 'project ID request rate exceeded'}))
+        self.assertTrue(is_retryable({'code': 429, 'message': 'Too Many Requests'}))
+        self.assertFalse(is_retryable({'code': -32005, 'message': 'query returned more than 10000 results'}))
+        self.assertFalse(is_retryable({'code': -32602, 'message': 'invalid argument'}))
+
+    def test_backoff(self):
+        clock = FakeClock()
+        scheduler = RequestScheduler(retries=3, backoff=1, max_backoff=3, sleep=clock.sleep)
+        responses = iter([{'error': {'code': 429, 'message': 'rate limit'}}] * 3 + [{'result': '0x1'}])
+
+        self.assertEqual(scheduler.call('eth_blockNumber', lambda: next(responses)), {'result': '0x1'})
+        self.assertEqual(len(clock.sleeps), 3)
+        for attempt, seconds in enumerate(clock.sleeps):
+            self.assertLessEqual(seconds, min(3, 2 ** attempt))
+
+    def test_retries_run_out(self):
+        scheduler = RequestScheduler(retries=2, sleep=lambda seconds: None)
+
+        def send():
+            raise Timeout()
+
+        with self.assertRaises(RetriesExhausted):
+            scheduler.call('eth_getLogs', send)
+
+        # errors that are not retryable are raised right away
+        calls = []
+        def invalid():
+            calls.append(1)
+            raise http_error(401)
+
+        with self.assertRaises(HTTPError):
+            scheduler.call('eth_getLogs', invalid)
+        self.assertEqual(len(calls), 1)
+
+    def record(self, web3):
+        output = os.path.join(self.directory.name, "transfers.csv")
+        contract = ERC20Contract(web3, TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        contract.record_transactions(from_block=0, to_block=99, block_range=10, output=output)
+
+        with open(output) as transactions:
+            return sorted(int(row['block_number']) for row in csv.DictReader(transactions))
+
+    def test_rate_limited_run_is_complete(self):
+        scheduler = RequestScheduler(sleep=lambda seconds: None)
+        web3 = Web3(ScheduledProvider(FakeProvider(self.node), scheduler))
+
+        self.node.fail_next(2)
+
+        original = self.node.get_logs
+        counter = {'calls': 0}
+        def flaky_get_logs(params):
+            counter['calls'] += 1
+            # every third window is rate limited once
+            if counter['calls'] % 3 == 0:
+                self.node.fail_next(1)
+            return original(params)
+        self.node.get_logs = flaky_get_logs
+
+        self.assertEqual(self.record(web3), list(range(0, 100, 2)))
+        self.assertGreater(scheduler.retried, 2)
+
+    def test_failures_are_not_truncated(self):
+        self.node.fail_next(1, code=-32000, message="unknown failure")
+        with self.assertRaises(ValueError):
+            self.record(fake_web3(self.node))
+
+    def test_http_429_on_batches(self):
+        windows = [(0, 49), (50, 99)]
+        with FakeNodeServer(self.node) as server:
+            provider = BatchHTTPProvider(server.url)
+            web3 = Web3(ScheduledProvider(provider, RequestScheduler(sleep=lambda seconds: None)))
+            contract = web3.eth.contract(address=TEST_TOKEN, abi=fetch_abi())
+
+            server.statuses = [429, 503]
+            fetched = fetch_batch(contract.events.Transfer, windows, address=TEST_TOKEN)
+
+            self.assertTrue(provider.supports_batch)
+            self.assertEqual(server.posts, 3)
+            self.assertEqual(
+                [[event['block_number'] for event in events] for events in fetched],
+                [list(range(0, 50, 2)), list(range(50, 100, 2))]
+            )
+
+    def test_failed_calls_of_a_batch_are_retried(self):
+        scheduler = RequestScheduler(sleep=lambda seconds: None)
+        web3 = Web3(ScheduledProvider(FakeProvider(self.node), scheduler))
+        contract = web3.eth.contract(address=TEST_TOKEN, abi=fetch_abi())
+
+        self.node.calls = []
+        self.node.fail_next(1)
+        fetched = fetch_batch(contract.events.Transfer, [(0, 49), (50, 99)], address=TEST_TOKEN)
+
+        # only the failed call is sent again
+        self.assertEqual(self.node.calls.count('eth_getLogs'), 3)
+        self.assertEqual(sum(len(events) for events in fetched), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import unittest
+import tempfile
+import json
+import os
+import threading
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.follow import Follower
+from app.service import HolderService, serve_holders
+from test.fake_node import FakeNode, fake_web3, TEST_TOKEN, ranges_file
+
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+CAROL = "0x" + "cc" * 20
+
+
+"""
+Unit tests for service.py
+"""
+class ServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.node = FakeNode()
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.ranges_path = ranges_file(self)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def service(self, erc721=False, holders=None):
+        contract_class = ERC721Contract if erc721 else ERC20Contract
+        contract = contract_class(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        follower = Follower(
+            contract.to_token_contract(),
+            TEST_TOKEN,
+            from_block=1,
+            erc721=erc721,
+            holders=holders,
+            ranges_path=self.ranges_path
+        )
+        return HolderService(follower)
+
+    def get(self, server, path):
+        try:
+            with urlopen('http://127.0.0.1:{}{}'.format(server.server_address[1], path)) as response:
+                return response.status, json.loads(response.read())
+        except HTTPError as error:
+            return error.code, json.loads(error.read())
+
+    def test_erc20_queries(self):
+        big = 10 ** 30
+        service = self.service(holders={
+            '0x' + 'AA' * 20: {'address': '0x' + 'AA' * 20, 'balance': 0},
+        })
+        self.node.add_transfer(1, ALICE, BOB, big)
+        self.node.add_transfer(2, BOB, CAROL, 3)
+        self.assertEqual(service.refresh(), 2)
+
+        server = serve_holders(service, 0, host='127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        status, body = self.get(server, '/balance/{}'.format(BOB))
+        self.assertEqual(status, 200)
+        self.assertEqual(body['balance'], str(big - 3))
+        self.assertEqual(self.get(server, '/balance/{}'.format("0x" + "ee" * 20))[1]['balance'], "0")
+
+        status, body = self.get(server, '/top?n=5')
+        self.assertEqual([holder['balance'] for holder in body['holders']], [str(big - 3), "3"])
+
+        self.assertEqual(self.get(server, '/status')[1]['synced_to'], 2)
+        self.assertEqual(self.get(server, '/balance/0x12')[0], 400)
+        self.assertEqual(self.get(server, '/owner/1')[0], 404)
+
+    def test_erc721_queries(self):
+        service = self.service(erc721=True)
+        self.node.add_transfer(1, ALICE, BOB, 1, erc721=True)
+        self.node.add_transfer(1, ALICE, BOB, 2, erc721=True)
+        self.node.add_transfer(2, BOB, CAROL, 1, erc721=True)
+        service.refresh()
+
+        self.assertEqual(service.query('/owner/1')[1]['owner'].lower(), CAROL)
+        self.assertEqual(service.query('/tokens/{}'.format(BOB))[1]['tokens'], ['2'])
+        self.assertEqual(service.query('/owner/7')[0], 404)
+        self.assertEqual(
+            [(holder['address'].lower(), holder['tokens']) for holder in service.query('/top')[1]['holders']],
+            [(BOB, 1), (CAROL, 1)]
+        )
+
+    def test_refresh_invalidates_ranking(self):
+        service = self.service()
+        self.node.add_transfer(1, ALICE, BOB, 5)
+        service.refresh()
+        self.assertEqual(service.top(1)[0][0].lower(), BOB)
+
+        # a reorg replaces the transfer, the ranking follows
+        self.node.reorg(1)
+        self.node.add_transfer(1, ALICE, CAROL, 5)
+        service.refresh()
+        self.assertEqual(service.top(1)[0][0].lower(), CAROL)
+        self.assertEqual(service.balance_of(service.top(1)[0][0]), 5)
+
+    def test_queries_while_the_chain_is_read(self):
+        service = self.service()
+        self.node.add_transfer(1, ALICE, BOB, 5)
+        fetching = threading.Event()
+        fetched = threading.Event()
+        fetch = service.follower.fetch
+
+        def slow_fetch():
+            fetching.set()
+            fetched.wait(5)
+            return fetch()
+
+        with mock.patch.object(service.follower, 'fetch', side_effect=slow_fetch):
+            refresh = threading.Thread(target=service.refresh)
+            refresh.start()
+            fetching.wait(5)
+            # the lock is only taken once the transfers are applied
+            self.assertEqual(service.query('/status')[1]['synced_to'], 0)
+            fetched.set()
+            refresh.join(5)
+
+        self.assertEqual(service.query('/status')[1]['synced_to'], 1)
+        self.assertEqual(service.top(1)[0][1], 5)
+
+    def test_serve_holders(self):
+        transactions = os.path.join(self.directory.name, "transfers.csv")
+        holders = os.path.join(self.directory.name, "holders.csv")
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        self.node.add_transfer(1, ALICE, BOB, 5)
+        contract.sync_transactions(from_block=0, to_block=1, block_range=10, output=transactions)
+
+        # the holders are computed from the transactions, then the new block is applied in memory
+        self.node.add_transfer(3, BOB, CAROL, 2)
+        service = contract.serve_holders(0, input=transactions, output=holders, poll_interval=0, polls=1, host='127.0.0.1')
+
+        self.assertEqual(service.follower.synced_to, 3)
+        balances = {address.lower(): balance for address, balance in service.top()}
+        self.assertEqual(balances, {BOB: 3, CAROL: 2})
+        self.assertTrue(os.path.isfile(holders))
+
+    def test_serve_needs_a_sync(self):
+        contract = ERC721Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        with self.assertRaises(ValueError):
+            contract.serve_holders(0, input=os.path.join(self.directory.name, "never-synced.csv"), polls=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import unittest
+import tempfile
+import random
+import csv
+import os
+from unittest import mock
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.snapshots import Checkpoints
+from app.sync import read_holders
+
+TEST_TOKEN = "0x68749665FF8D2d112Fa859AA293F07A622782F38"
+ADDRESSES = ["0x{:040x}".format(number) for number in range(1, 20)]
+
+
+def make_rows(count, erc721=False, seed=1):
+    generator = random.Random(seed)
+    rows = []
+    block = 1000
+    for number in range(count):
+        block += generator.choice([0, 1, 7, 40])
+        value = generator.randrange(20) if erc721 else generator.randrange(2 ** 256)
+        rows.append([generator.choice(ADDRESSES), generator.choice(ADDRESSES), value, block, number, 0])
+    return rows
+
+
+def replay(rows, block, erc721=False):
+    holders = {}
+    owners = {}
+    for from_, to, value, block_number, _, _ in rows:
+        if block_number > block:
+            break
+        if erc721:
+            owners[str(value)] = to
+            holders.setdefault(from_, None)
+            holders.setdefault(to, None)
+        else:
+            holders[from_] = holders.get(from_, 0) - value
+            holders[to] = holders.get(to, 0) + value
+    if erc721:
+        return {
+            address: sorted(token for token, owner in owners.items() if owner == address)
+            for address in holders
+        }
+    return holders
+
+
+def write_rows(path, rows, erc721=False):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['from', 'to', 'tokenId' if erc721 else 'value', 'block_number', 'log_index', 'transaction_index'])
+        writer.writerows(rows)
+
+
+"""
+Unit tests for snapshots.py
+"""
+class SnapshotsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'transactions.csv')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check_balances(self, rows, checkpoints):
+        for block in [0, 999, rows[0][3], 1500, 2222, 3000, rows[-1][3], 10 ** 8]:
+            holders = checkpoints.holders_at(block)
+            self.assertEqual(
+                {address: holder['balance'] for address, holder in holders.items()},
+                replay(rows, block),
+                block
+            )
+
+    def test_balances_at_block(self):
+        rows = make_rows(500)
+        write_rows(self.path, rows)
+        checkpoints = Checkpoints(self.path, interval=100)
+
+        self.check_balances(rows, checkpoints)
+        self.assertTrue(all(position is not None for block, position in checkpoints.positions.items()
+                            if block != max(checkpoints.positions)))
+
+    def test_windows_written_backwards(self):
+        rows = make_rows(500, seed=2)
+        windows = [rows[start:start + 60] for start in range(0, len(rows), 60)]
+        write_rows(self.path, [row for window in reversed(windows) for row in window])
+
+        checkpoints = Checkpoints(self.path, interval=250)
+        self.check_balances(rows, checkpoints)
+        self.assertIsNotNone(checkpoints.runs)
+
+    def test_unordered_file(self):
+        rows = make_rows(300, seed=3)
+        shuffled = list(rows)
+        random.Random(4).shuffle(shuffled)
+        write_rows(self.path, shuffled)
+
+        checkpoints = Checkpoints(self.path, interval=100)
+        self.check_balances(rows, checkpoints)
+        self.assertIsNone(checkpoints.runs)
+
+    def test_owners_at_block(self):
+        rows = make_rows(400, erc721=True, seed=5)
+        write_rows(self.path, rows, erc721=True)
+        checkpoints = Checkpoints(self.path, erc721=True, interval=150)
+
+        for block in [1000, 1800, 2500, rows[-1][3]]:
+            holders = checkpoints.holders_at(block)
+            self.assertEqual(
+                {address: sorted(holder['tokens']) for address, holder in holders.items()},
+                replay(rows, block, erc721=True)
+            )
+
+    def test_checkpoints_are_reused(self):
+        rows = make_rows(200, seed=6)
+        write_rows(self.path, rows)
+        Checkpoints(self.path, interval=100).holders_at(1500)
+
+        with mock.patch.object(Checkpoints, 'build') as build:
+            Checkpoints(self.path, interval=100).holders_at(2000)
+            build.assert_not_called()
+
+        # the file changed, checkpoints are rebuilt
+        rows += [[ADDRESSES[0], ADDRESSES[1], 5, rows[-1][3] + 1, 0, 0]]
+        write_rows(self.path, rows)
+        checkpoints = Checkpoints(self.path, interval=100)
+        self.assertFalse(checkpoints.load())
+        self.check_balances(rows, checkpoints)
+
+    def test_get_holders_at(self):
+        rows = make_rows(200, seed=7)
+        write_rows(self.path, rows)
+        output_path = os.path.join(self.directory.name, 'holders.csv')
+
+        contract = ERC20Contract(None, TEST_TOKEN, name="TEST")
+        contract.get_holders_at(2000, input=self.path, output=output_path)
+
+        holders = read_holders(output_path)
+        self.assertEqual({address: holder['balance'] for address, holder in holders.items()}, replay(rows, 2000))
+
+    def test_nft_get_holders_at(self):
+        rows = make_rows(200, erc721=True, seed=8)
+        write_rows(self.path, rows, erc721=True)
+        output_path = os.path.join(self.directory.name, 'holders.csv')
+
+        nft = ERC721Contract(None, TEST_TOKEN, name="TEST")
+        nft.get_holders_at(1900, input=self.path, output=output_path)
+
+        holders = read_holders(output_path, erc721=True)
+        self.assertEqual(
+            {address: sorted(holder['tokens']) for address, holder in holders.items()},
+            replay(rows, 1900, erc721=True)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import tempfile
+import json
+import os
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.stats import HolderStats, holders_file_stats, stats_path
+from test.fake_node import FakeNode, fake_web3, TEST_TOKEN
+
+
+def exact_gini(balances):
+    balances = sorted(balances)
+    total = sum(balances)
+    weighted = sum((2 * (rank + 1) - len(balances) - 1) * balance for rank, balance in enumerate(balances))
+    return weighted / (len(balances) * total)
+
+
+"""
+Unit tests for stats.py
+"""
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_top_holders(self):
+        stats = HolderStats(top=3)
+        for position in range(1000):
+            stats.add("0x{:040x}".format(position), position)
+
+        # the zero balance is not a holder
+        self.assertEqual(stats.holders, 999)
+        self.assertEqual(stats.total, sum(range(1000)))
+        self.assertEqual([balance for balance, _ in stats.top_holders()], [999, 998, 997])
+        self.assertEqual(len(stats.largest), 10)
+        self.assertAlmostEqual(stats.top_share(10), sum(range(990, 1000)) / sum(range(1000)))
+
+    def test_gini(self):
+        equal = HolderStats()
+        for position in range(100):
+            equal.add("0x{:040x}".format(position), 10 ** 18)
+        self.assertAlmostEqual(equal.gini(), 0)
+
+        balances = [int(1.07 ** position) * 10 ** 18 + position for position in range(500)]
+        skewed = HolderStats()
+        for position, balance in enumerate(balances):
+            skewed.add("0x{:040x}".format(position), balance)
+        self.assertAlmostEqual(skewed.gini(), exact_gini(balances), delta=0.02)
+
+        median = sorted(balances)[250]
+        self.assertAlmostEqual(skewed.quantile(0.5) / median, 1, delta=0.1)
+
+    def test_uint256_balances(self):
+        stats = HolderStats()
+        stats.add("0x" + "aa" * 20, 2 ** 256 - 1)
+        stats.add("0x" + "bb" * 20, 1)
+
+        summary = json.loads(json.dumps(stats.summary()))
+        self.assertEqual(summary['total'], str(2 ** 256))
+        self.assertEqual(summary['top'][0]['balance'], str(2 ** 256 - 1))
+        self.assertEqual([bucket['holders'] for bucket in summary['histogram']], [1, 1])
+
+    def test_written_with_holders(self):
+        node = FakeNode()
+        holders = ["0x{:040x}".format(position) for position in range(1, 30)]
+
+        output = os.path.join(self.directory.name, "holders.csv")
+        contract = ERC20Contract(fake_web3(node), TEST_TOKEN)
+        contract.write_holders({
+            holder: {'address': holder, 'balance': (position + 1) * 100} for position, holder in enumerate(holders)
+        }, output)
+
+        with open(stats_path(output)) as summary:
+            summary = json.load(summary)
+        self.assertEqual(stats_path(output), os.path.join(self.directory.name, "holders_stats.json"))
+        self.assertEqual(summary['holders'], 29)
+        self.assertEqual(summary['top'][0]['balance'], "2900")
+        self.assertEqual(summary, holders_file_stats(output).summary())
+
+        nft = ERC721Contract(fake_web3(node), TEST_TOKEN)
+        nft.write_holders({holders[0]: {'address': holders[0], 'tokens': [1, 2, 3]}}, output)
+        self.assertEqual(holders_file_stats(output).total, 3)
+        with open(stats_path(output)) as summary:
+            summary = json.load(summary)
+        self.assertEqual(summary['top'], [{'address': holders[0], 'token_count': 3}])
+        self.assertEqual(summary, holders_file_stats(output).summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
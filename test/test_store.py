@@ -0,0 +1,174 @@
+import unittest
+import tempfile
+import random
+import csv
+import os
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.store import EventStore
+
+TEST_TOKEN = "0x68749665FF8D2d112Fa859AA293F07A622782F38"
+ADDRESSES = ["0x{:040x}".format(number) for number in range(1, 20)]
+
+
+def make_events(count, erc721=False, seed=1):
+    generator = random.Random(seed)
+    events = []
+    for number in range(count):
+        event = {
+            'from': generator.choice(ADDRESSES),
+            'to': generator.choice(ADDRESSES),
+            'block_number': 100 + number // 3,
+            'log_index': number % 3,
+            'transaction_index': 0,
+        }
+        if erc721:
+            event['tokenId'] = generator.randrange(10)
+        else:
+            event['value'] = generator.randrange(2 ** 256)
+        events.append(event)
+    return events
+
+
+"""
+Unit tests for store.py
+"""
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'data', 'events.sqlite')
+        self.store = EventStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_balances(self):
+        events = make_events(300)
+        expected = {}
+        for event in events:
+            expected[event['from']] = expected.get(event['from'], 0) - event['value']
+            expected[event['to']] = expected.get(event['to'], 0) + event['value']
+
+        # ingested in two batches, balances carry over
+        self.assertEqual(self.store.ingest(TEST_TOKEN, events[:120]), 120)
+        self.assertEqual(self.store.ingest(TEST_TOKEN, events[120:]), 180)
+
+        for address in ADDRESSES:
+            self.assertEqual(self.store.balance_of(TEST_TOKEN, address), expected.get(address, 0))
+        self.assertEqual(self.store.balance_of(TEST_TOKEN, "0x" + "f" * 40), 0)
+
+        holders = self.store.holders(TEST_TOKEN)
+        positive = sorted(
+            [(address, balance) for address, balance in expected.items() if balance > 0],
+            key=lambda holder: holder[1], reverse=True
+        )
+        self.assertEqual(holders, positive)
+        self.assertEqual(self.store.holders(TEST_TOKEN, limit=2), positive[:2])
+
+    def test_holders_limit_is_exact(self):
+        # both balances have the same approximate amount
+        events = [
+            {'from': ADDRESSES[0], 'to': ADDRESSES[1], 'value': 2 ** 60, 'block_number': 100, 'log_index': 0,
+             'transaction_index': 0},
+            {'from': ADDRESSES[0], 'to': ADDRESSES[2], 'value': 2 ** 60 + 1, 'block_number': 100, 'log_index': 1,
+             'transaction_index': 0},
+        ]
+        self.store.ingest(TEST_TOKEN, events)
+
+        self.assertEqual(self.store.holders(TEST_TOKEN, limit=1), [(ADDRESSES[2], 2 ** 60 + 1)])
+        self.assertEqual(self.store.holders(TEST_TOKEN, limit=5), [(ADDRESSES[2], 2 ** 60 + 1), (ADDRESSES[1], 2 ** 60)])
+        self.assertEqual(self.store.holders(TEST_TOKEN, limit=0), [])
+
+    def test_ingest_is_idempotent(self):
+        events = make_events(50)
+        self.store.ingest(TEST_TOKEN, events)
+        balances = [self.store.balance_of(TEST_TOKEN, address) for address in ADDRESSES]
+
+        self.assertEqual(self.store.ingest(TEST_TOKEN, events), 0)
+        self.assertEqual(self.store.ingest(TEST_TOKEN, events[40:]), 0)
+        self.assertEqual([self.store.balance_of(TEST_TOKEN, address) for address in ADDRESSES], balances)
+        self.assertEqual(len(self.store.transfers(TEST_TOKEN)), 50)
+
+    def test_owners(self):
+        events = make_events(100, erc721=True)
+        self.store.ingest(TEST_TOKEN, events, erc721=True)
+
+        owners = {}
+        for event in events:
+            owners[event['tokenId']] = event['to']
+
+        for token_id, owner in owners.items():
+            self.assertEqual(self.store.owner_of(TEST_TOKEN, token_id), owner)
+            self.assertIn(str(token_id), self.store.tokens_of(TEST_TOKEN, owner))
+        self.assertIsNone(self.store.owner_of(TEST_TOKEN, 1000))
+
+    def test_transfers(self):
+        events = make_events(90)
+        self.store.ingest(TEST_TOKEN, events)
+        # another contract does not show up in the queries
+        self.store.ingest(ADDRESSES[0], make_events(30, seed=3))
+
+        transfers = self.store.transfers(TEST_TOKEN, from_block=105, to_block=110)
+        self.assertEqual(
+            [(transfer[0], transfer[1]) for transfer in transfers],
+            [(event['block_number'], event['log_index']) for event in events if 105 <= event['block_number'] <= 110]
+        )
+
+        address = ADDRESSES[4]
+        transfers = self.store.transfers(TEST_TOKEN, address=address)
+        expected = [event for event in events if address in (event['from'], event['to'])]
+        self.assertEqual(len(transfers), len(expected))
+        self.assertEqual(
+            transfers,
+            [(event['block_number'], event['log_index'], event['from'], event['to'], str(event['value']))
+             for event in expected]
+        )
+
+    def test_contract_load_store(self):
+        events = make_events(60)
+        input_path = os.path.join(self.directory.name, 'transactions.csv')
+        with open(input_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            # legacy files without log index
+            writer.writerow(['from', 'to', 'value', 'block_number'])
+            for event in events:
+                writer.writerow([event['from'], event['to'], event['value'], event['block_number']])
+
+        contract = ERC20Contract(None, TEST_TOKEN, name="TEST")
+        contract.load_store(input=input_path, path=self.path)
+
+        self.assertEqual(len(self.store.transfers(TEST_TOKEN)), 60)
+        for address in ADDRESSES:
+            expected = sum(event['value'] for event in events if event['to'] == address) - \
+                sum(event['value'] for event in events if event['from'] == address)
+            self.assertEqual(contract.balance_of(address), expected)
+
+        # loading the same file again adds nothing
+        self.assertEqual(contract.store.ingest_file(TEST_TOKEN, input_path), 0)
+        contract.store.close()
+
+    def test_nft_load_store(self):
+        events = make_events(40, erc721=True)
+        input_path = os.path.join(self.directory.name, 'transfers.csv')
+        with open(input_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['from', 'to', 'tokenId', 'block_number', 'log_index', 'transaction_index'])
+            for event in events:
+                writer.writerow([event['from'], event['to'], event['tokenId'], event['block_number'],
+                                 event['log_index'], event['transaction_index']])
+
+        nft = ERC721Contract(None, TEST_TOKEN, name="TEST")
+        nft.load_store(input=input_path, path=self.path)
+
+        owners = {}
+        for event in events:
+            owners[event['tokenId']] = event['to']
+        for token_id, owner in owners.items():
+            self.assertEqual(nft.owner_of(token_id), owner)
+        nft.store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
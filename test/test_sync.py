@@ -0,0 +1,131 @@
+import unittest
+import tempfile
+import csv
+import os
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.sync import SyncState
+from test.fake_node import FakeNode, fake_web3, TEST_TOKEN, ranges_file
+
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+CAROL = "0x" + "cc" * 20
+
+"""
+Unit tests for sync.py
+"""
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.transactions = os.path.join(self.directory.name, "transfers.csv")
+        self.holders = os.path.join(self.directory.name, "holders.csv")
+        self.node = FakeNode()
+
+        self.ranges_path = ranges_file(self)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def sync(self, contract, to_block):
+        contract.sync_transactions(from_block=0, to_block=to_block, block_range=10, output=self.transactions)
+        contract.get_holders(input=self.transactions, output=self.holders, incremental=True)
+
+        with open(self.holders) as holders:
+            return {row['address'].lower(): row for row in csv.DictReader(holders)}
+
+    def block_numbers(self):
+        with open(self.transactions) as transactions:
+            return [int(row['block_number']) for row in csv.DictReader(transactions)]
+
+    def test_only_new_blocks_are_fetched(self):
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        self.node.add_transfer(5, ALICE, BOB, 100)
+        self.node.add_transfer(15, BOB, CAROL, 40)
+
+        holders = self.sync(contract, 20)
+        self.assertEqual(int(holders[CAROL]['balance']), 40)
+        self.assertEqual(SyncState.load(self.transactions).synced_to, 20)
+
+        self.node.add_transfer(25, CAROL, ALICE, 15)
+        self.node.calls = []
+        holders = self.sync(contract, 30)
+
+        self.assertEqual(self.block_numbers(), [5, 15, 25])
+        self.assertEqual(self.node.calls.count('eth_getLogs'), 1)
+        self.assertEqual(int(holders[ALICE]['balance']), -85)
+        self.assertEqual(int(holders[BOB]['balance']), 60)
+        self.assertEqual(int(holders[CAROL]['balance']), 25)
+
+    def test_resume_after_crash(self):
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        self.node.add_transfer(5, ALICE, BOB, 100)
+        self.sync(contract, 10)
+
+        # rows written after the last checkpoint
+        with open(self.transactions, "a") as transactions:
+            transactions.write("{},{},1,12\n".format(ALICE, BOB))
+
+        self.node.add_transfer(12, ALICE, BOB, 1)
+        self.sync(contract, 20)
+
+        self.assertEqual(self.block_numbers(), [5, 12])
+
+    def test_holders_skip_rows_after_the_checkpoint(self):
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        self.node.add_transfer(5, ALICE, BOB, 100)
+        self.sync(contract, 10)
+
+        # rows of an interrupted sync
+        with open(self.transactions, "a") as transactions:
+            transactions.write("{},{},1,12\n".format(ALICE, BOB))
+        contract.get_holders(input=self.transactions, output=self.holders, incremental=True)
+        state = SyncState.load(self.transactions)
+        self.assertEqual(state.holders['offset'], state.offset)
+
+        self.node.add_transfer(12, ALICE, BOB, 1)
+        holders = self.sync(contract, 20)
+        self.assertEqual(int(holders[BOB]['balance']), 101)
+
+    def test_resume_after_reorg(self):
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        for block in (5, 15, 25):
+            self.node.add_transfer(block, ALICE, BOB, block)
+        self.node.mine(30)
+        self.sync(contract, 30)
+
+        # the checkpoints after block 18 are no longer on the chain
+        self.node.reorg(18)
+        self.node.add_transfer(19, BOB, CAROL, 3)
+        self.node.mine(30)
+        holders = self.sync(contract, 30)
+
+        self.assertEqual(self.block_numbers(), [5, 15, 19])
+        self.assertEqual(SyncState.load(self.transactions).synced_to, 30)
+        self.assertEqual(int(holders[ALICE]['balance']), -20)
+        self.assertEqual(int(holders[CAROL]['balance']), 3)
+
+    def test_recorded_file_is_not_overwritten(self):
+        contract = ERC20Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        with open(self.transactions, "w") as transactions:
+            transactions.write("from,to,value,block_number\n{},{},1,12\n".format(ALICE, BOB))
+
+        with self.assertRaises(ValueError):
+            contract.sync_transactions(from_block=0, to_block=20, block_range=10, output=self.transactions)
+        self.assertEqual(self.block_numbers(), [12])
+
+    def test_erc721_holders_are_updated(self):
+        contract = ERC721Contract(fake_web3(self.node), TEST_TOKEN, name="TEST", ranges_path=self.ranges_path)
+        self.node.add_transfer(5, ALICE, BOB, 7, erc721=True)
+        self.node.add_transfer(6, ALICE, BOB, 8, erc721=True)
+        self.sync(contract, 10)
+
+        self.node.add_transfer(15, BOB, CAROL, 7, erc721=True)
+        holders = self.sync(contract, 20)
+
+        self.assertEqual(holders[BOB]['tokens'], "['8']")
+        self.assertEqual(holders[CAROL]['tokens'], "['7']")
+
+
+if __name__ == '__main__':
+    unittest.main()
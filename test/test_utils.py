@@ -1,6 +1,6 @@
 import unittest
 
-from app.utils import format_address, instantiate_web3
+from app.utils import format_address, checksum_address, instantiate_web3
 from app.config import INFURA_URL
 from web3 import Web3
 from eth_utils.hexadecimal import decode_hex
@@ -27,6 +27,11 @@ class UtilsTest(unittest.TestCase):
         
         self.assertEqual(format_address(unchanged_address), "0x0000000000000000000000000000000000000011")
 
+    def test_checksum_address_is_interned(self):
+        address = checksum_address(bytes.fromhex("aa" * 20))
+        self.assertEqual(address, "0xaAaAaAaaAaAaAaaAaAAAAAAAAaaaAaAaAaaAaaAa")
+        self.assertIs(checksum_address(bytes.fromhex("aa" * 20)), address)
+
 
 if __name__ == '__main__':
     unittest.main()
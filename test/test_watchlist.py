@@ -0,0 +1,134 @@
+import unittest
+import tempfile
+import csv
+import os
+from unittest import mock
+
+from app.classes.erc20 import ERC20Contract
+from app.classes.erc721 import ERC721Contract
+from app.watchlist import load_watchlist, watchlist_topics, merge_events
+from test.fake_node import FakeNode, fake_web3, TEST_TOKEN, ranges_file
+
+ZERO = "0x" + "00" * 20
+TREASURY = "0x" + "aa" * 20
+EXCHANGE = "0x" + "bb" * 20
+OTHERS = ["0x" + "{:02x}".format(byte) * 20 for byte in range(0x10, 0x30)]
+
+
+def read_rows(path):
+    with open(path) as rows:
+        return list(csv.DictReader(rows))
+
+
+"""
+Unit tests for watchlist.py
+"""
+class WatchlistTest(unittest.TestCase):
+    def setUp(self):
+        self.ranges_path = ranges_file(self)
+        self.directory = tempfile.TemporaryDirectory()
+        self.node = FakeNode()
+        self.node.deploy(TEST_TOKEN, 10)
+
+        for patched in (
+            mock.patch('app.deployment.DEPLOYMENTS_FILE', self.path("deployments.json")),
+        ):
+            patched.start()
+            self.addCleanup(patched.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_load_watchlist(self):
+        with open(self.path("watchlist.csv"), "w") as watchlist:
+            watchlist.write("address,label\n# team wallets\n{},treasury\n\n{},exchange\n{},again\n".format(
+                TREASURY, EXCHANGE.upper().replace("0X", "0x"), TREASURY))
+
+        addresses = load_watchlist(self.path("watchlist.csv"))
+        self.assertEqual([address.lower() for address in addresses], [TREASURY, EXCHANGE])
+
+        with open(self.path("broken.txt"), "w") as watchlist:
+            watchlist.write("0x1234\n")
+        with self.assertRaises(ValueError):
+            load_watchlist(self.path("broken.txt"))
+
+    def test_watchlist_topics(self):
+        filters = watchlist_topics([TREASURY, EXCHANGE, OTHERS[0]], chunk=2)
+        self.assertEqual(len(filters), 4)
+        self.assertEqual(len(filters[0][1]), 2)
+        self.assertIsNone(filters[1][1])
+        self.assertEqual(filters[3][2], ["0x" + OTHERS[0][2:].rjust(64, "0")])
+
+    def test_merge_events(self):
+        first = {'block_number': 5, 'log_index': 1}
+        second = {'block_number': 3, 'log_index': 0}
+        self.assertEqual(merge_events([[first], [second, dict(first)]]), [second, first])
+
+    def test_erc20_balances(self):
+        self.node.add_transfer(10, ZERO, TREASURY, 1000)
+        for block, other in enumerate(OTHERS, start=11):
+            self.node.add_transfer(block, ZERO, other, 50)
+            self.node.add_transfer(block, other, OTHERS[0], 1)
+        self.node.add_transfer(100, TREASURY, EXCHANGE, 300)
+        self.node.add_transfer(101, EXCHANGE, OTHERS[3], 120)
+        self.node.add_transfer(102, OTHERS[4], EXCHANGE, 20)
+
+        web3 = fake_web3(self.node)
+        addresses = [web3.toChecksumAddress(address) for address in (TREASURY, EXCHANGE, "0x" + "cc" * 20)]
+        contract = ERC20Contract(web3, TEST_TOKEN, ranges_path=self.ranges_path)
+
+        served = []
+        get_logs = self.node.get_logs
+
+        def serve(params):
+            logs = get_logs(params)
+            served.extend(logs)
+            return logs
+
+        with mock.patch.object(self.node, 'get_logs', side_effect=serve):
+            contract.record_watchlist(addresses, from_block=0, output=self.path("watchlist.csv"), batch_size=2)
+        contract.get_watchlist_holders(addresses, input=self.path("watchlist.csv"), output=self.path("holders.csv"))
+
+        # the transfer between the two watched addresses is stored once
+        self.assertEqual(len(read_rows(self.path("watchlist.csv"))), 4)
+        # the node only served the logs of the watched addresses, one of them twice
+        self.assertEqual(len(served), 5)
+
+        # the same balances as from all the transfers
+        contract.record_transactions(from_block=0, output=self.path("all.csv"))
+        contract.get_holders(input=self.path("all.csv"), output=self.path("all_holders.csv"))
+        balances = {row['address']: row['balance'] for row in read_rows(self.path("all_holders.csv"))}
+
+        holders = read_rows(self.path("holders.csv"))
+        self.assertEqual([row['address'] for row in holders], addresses)
+        self.assertEqual(holders[0]['balance'], balances[addresses[0]])
+        self.assertEqual(holders[1]['balance'], balances[addresses[1]])
+        self.assertEqual(holders[2]['balance'], '0')
+
+    def test_erc721_tokens(self):
+        self.node.add_transfer(10, ZERO, TREASURY, 1, erc721=True)
+        self.node.add_transfer(11, ZERO, OTHERS[0], 2, erc721=True)
+        self.node.add_transfer(12, OTHERS[0], OTHERS[1], 2, erc721=True)
+        self.node.add_transfer(13, OTHERS[1], TREASURY, 2, erc721=True)
+        self.node.add_transfer(14, TREASURY, OTHERS[2], 1, erc721=True)
+
+        web3 = fake_web3(self.node)
+        contract = ERC721Contract(web3, TEST_TOKEN, ranges_path=self.ranges_path)
+        addresses = [web3.toChecksumAddress(TREASURY)]
+
+        # starts from the deployment block
+        contract.record_watchlist(addresses, output=self.path("watchlist.csv"), block_range=2)
+        contract.get_watchlist_holders(addresses, input=self.path("watchlist.csv"), output=self.path("holders.csv"))
+
+        self.assertEqual(len(read_rows(self.path("watchlist.csv"))), 3)
+        holders = read_rows(self.path("holders.csv"))
+        self.assertEqual(len(holders), 1)
+        self.assertIn("2", holders[0]['tokens'])
+        self.assertNotIn("1", holders[0]['tokens'])
+
+
+if __name__ == '__main__':
+    unittest.main()
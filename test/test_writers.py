@@ -0,0 +1,102 @@
+import unittest
+import tempfile
+import csv
+import os
+
+from app.classes.erc20 import ERC20Contract
+
+from app.writers import CSVTransferWriter, open_transfer_writer, open_transactions
+from app.parquet import has_pyarrow, read_parquet_transactions
+
+SENDER = "0x" + "aa" * 20
+RECEIVER = "0x" + "bb" * 20
+TEST_TOKEN = "0x68749665FF8D2d112Fa859AA293F07A622782F38"
+
+"""
+Unit tests for writers.py
+"""
+class WritersTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "transfers.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def events(self, blocks):
+        return [{'from': SENDER, 'to': RECEIVER, 'value': 10 ** 70, 'block_number': block} for block in blocks]
+
+    def read(self):
+        with open(self.path) as transactions:
+            return list(csv.DictReader(transactions))
+
+    def test_full_chunks_are_written(self):
+        writer = CSVTransferWriter(self.path, chunk_size=2)
+        writer.write(self.events([1, 2, 3]))
+
+        # the first chunk survives even if the run dies now
+        self.assertEqual([row['block_number'] for row in self.read()], ['1', '2'])
+
+        writer.close()
+        rows = self.read()
+        self.assertEqual([row['block_number'] for row in rows], ['1', '2', '3'])
+        self.assertEqual(int(rows[0]['value']), 10 ** 70)
+
+    def test_append(self):
+        with CSVTransferWriter(self.path) as writer:
+            writer.write(self.events([1]))
+
+        with CSVTransferWriter(self.path, append=True) as writer:
+            writer.write(self.events([2]))
+
+        self.assertEqual([row['block_number'] for row in self.read()], ['1', '2'])
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_parquet_round_trip(self):
+        path = os.path.join(self.directory.name, "transfers.parquet")
+
+        with open_transfer_writer(path) as writer:
+            writer.write(self.events([1, 2]))
+
+        table = read_parquet_transactions(path, columns=['from', 'block_number'])
+        self.assertEqual(table.column_names, ['from', 'block_number'])
+        self.assertEqual(table.column('from')[0].as_py(), bytes.fromhex("aa" * 20))
+
+        with open_transactions(path) as transactions:
+            rows = list(transactions)
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][0], "0xaAaAaAaaAaAaAaaAaAAAAAAAAaaaAaAaAaaAaaAa")
+        # the same strings as the rows of a csv file
+        self.assertEqual(rows[0][2], str(10 ** 70))
+        self.assertEqual(rows[1][3], "2")
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_parquet_holders_match_csv(self):
+        path = os.path.join(self.directory.name, "transfers.parquet")
+
+        with open("test/test-data/TEST_erc_20_transfers.csv") as transactions:
+            events = [dict(row) for row in csv.DictReader(transactions)]
+        with open_transfer_writer(path) as writer:
+            writer.write({**event, 'block_number': int(event['block_number'])} for event in events)
+
+        holders = ERC20Contract(None, TEST_TOKEN, abi=[], name="TEST")
+        holders.get_holders(input=path, output=os.path.join(self.directory.name, "parquet_holders.csv"))
+        holders.get_holders(
+            input="test/test-data/TEST_erc_20_transfers.csv",
+            output=os.path.join(self.directory.name, "csv_holders.csv")
+        )
+
+        balances = []
+        for name in ("parquet_holders.csv", "csv_holders.csv"):
+            with open(os.path.join(self.directory.name, name)) as holders_file:
+                balances.append({
+                    row['address']: row['balance'] for row in csv.DictReader(holders_file)
+                    if row['address'] not in ('from', 'to')
+                })
+
+        self.assertEqual(balances[0], balances[1])
+
+
+if __name__ == '__main__':
+    unittest.main()